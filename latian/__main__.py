@@ -12,4 +12,6 @@ def main():
     except (KeyboardInterrupt, Exit):
         pass
 
-main()
+# Worker processes may import this module without running the application.
+if __name__ == '__main__':
+    main()
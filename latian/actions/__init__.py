@@ -7,6 +7,7 @@ from typing import Callable, Coroutine
 from ..io import IO
 from ..dal import DAL
 from ..common import Implementations
+from .offload import worker_pool
 
 ActionFn = Callable[[DAL, IO], Coroutine]
 
@@ -0,0 +1,54 @@
+'''
+A pool of worker processes CPU-heavy action work is offloaded to, so it
+neither blocks the event loop other sessions share nor is limited to one
+core.
+
+Runtimes serving many sessions start the pool; without it, work runs
+inline. Offloaded functions and their arguments must be picklable, so
+actions package the data they need rather than passing a DAL.
+
+Workers are not forked from the runtime, whose threads may hold locks a
+forked copy would never see released; they are started by a fork server,
+or spawned where there is none.
+'''
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, TypeVar, Any
+
+START_METHOD = \
+    'forkserver' \
+    if 'forkserver' in multiprocessing.get_all_start_methods() \
+    else 'spawn'
+
+T = TypeVar('T')
+class WorkerPool:
+    executor: ProcessPoolExecutor
+
+    def __init__(self):
+        self.executor = None
+
+    def start(self, size: int):
+        '''Start `size` worker processes, when first needed.'''
+        self.shutdown()
+        self.executor = ProcessPoolExecutor(
+            max_workers=size,
+            mp_context=multiprocessing.get_context(START_METHOD)
+        )
+
+    def shutdown(self):
+        if self.executor is None:
+            return
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        '''Run `fn` in a worker process if the pool is started.'''
+        if self.executor is None:
+            return fn(*args)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+worker_pool = WorkerPool()
@@ -1,74 +1,333 @@
+'''
+Reports over a user's event history.
+
+Totals over any span are read from the running totals materialised for
+each exercise, at the same cost whatever the span. Differences are read
+from `EventGroups`, which sums the values of the events in the compared
+spans grouped by `(type, exercise, day)` in a single pass over their
+columns, vectorised when NumPy is installed and run in the worker pool
+for large spans. Logs are paged through newest first, a page of events
+fetched at a time.
+'''
+from array import array
 from datetime import timedelta, date
+from typing import Any
 
 from ..io import IO, IOWriter
 from ..dal import DAL
-from ..model import EXERCISE_TYPES, Exercise, Event
+from ..dal.columnar import (
+    EPOCH_DAY, SECONDS_PER_DAY, NULL_INT, ColumnarCollection
+)
+from ..model import EXERCISE_TYPES, Event
+from .offload import worker_pool
 from . import actions
 
+try:
+    import numpy
+except ImportError:
+    # Without NumPy, events are grouped in an interpreted loop.
+    numpy = None
+
+# The day of undated events, in raw group keys.
+UNDATED = None
+# The spans reports can cover other than all time, and their units.
+SPAN_NAMES = {
+    'daily': 'day',
+    'weekly': 'week',
+    'monthly': 'month',
+    'range': 'range'
+}
+# Events shown on each page of a log.
+LOG_PAGE_SIZE = 20
+# Events below which grouping runs inline rather than in a worker.
+OFFLOAD_EVENTS = 50000
+
+def _group_rows(
+    types: array, exercises: array, values: array, whens: array
+) -> tuple[dict[tuple, int], dict[Any, int]]:
+    '''
+    Sum values by raw `(type code, exercise code, day number)` key, and
+    count events by day number.
+    '''
+    totals = dict()
+    counts = dict()
+    for type, exercise, value, when in zip(types, exercises, values, whens):
+        day = UNDATED if when != when else int(when//SECONDS_PER_DAY)
+        if value == NULL_INT:
+            value = 0
+
+        key = (type, exercise, day)
+        totals[key] = totals.get(key, 0) + value
+        counts[day] = counts.get(day, 0) + 1
+
+    return totals, counts
+
+def _group_arrays(
+    types: array, exercises: array, values: array, whens: array
+) -> tuple[dict[tuple, int], dict[Any, int]]:
+    '''`_group_rows`, vectorised with NumPy.'''
+    types, exercises, values, whens = (
+        numpy.frombuffer(column, dtype=column.typecode)
+        for column in (types, exercises, values, whens)
+    )
+    types = types.astype(numpy.int64)
+    exercises = exercises.astype(numpy.int64)
+    values = numpy.where(values == NULL_INT, 0, values)
+
+    # Days are numbered from the first, with undated events after the last.
+    dated = ~numpy.isnan(whens)
+    days = numpy.floor_divide(
+        numpy.where(dated, whens, 0), SECONDS_PER_DAY
+    ).astype(numpy.int64)
+    first = last = 0
+    if dated.any():
+        first = int(days[dated].min())
+        last = int(days[dated].max())
+    undated_slot = last - first + 1
+    slots = numpy.where(dated, days - first, undated_slot)
+
+    def day_of(slot: int) -> Any:
+        return UNDATED if slot == undated_slot else first + slot
+
+    # Group on a single integer key by summing runs of equal sorted keys.
+    span = undated_slot + 1
+    radix = int(exercises.max()) + 1
+    keys = (types*radix + exercises)*span + slots
+    order = numpy.argsort(keys, kind='stable')
+    keys = keys[order]
+    starts = numpy.flatnonzero(
+        numpy.concatenate(([True], keys[1:] != keys[:-1]))
+    )
+    sums = numpy.add.reduceat(values[order], starts)
+
+    totals = dict()
+    for key, total in zip(keys[starts].tolist(), sums.tolist()):
+        group, slot = divmod(key, span)
+        type, exercise = divmod(group, radix)
+        totals[(type, exercise, day_of(slot))] = total
+
+    counts = dict()
+    for slot, count in enumerate(numpy.bincount(slots).tolist()):
+        if count:
+            counts[day_of(slot)] = count
+
+    return totals, counts
+
+def _group(
+    types: array, exercises: array, values: array, whens: array
+) -> tuple[dict[tuple, int], dict[Any, int]]:
+    '''Group event columns, in whichever process has them.'''
+    group = _group_rows if numpy is None else _group_arrays
+
+    return group(types, exercises, values, whens)
+
+class EventGroups:
+    '''The totals of a set of events, grouped by type, exercise and day.'''
+    totals: dict[tuple[str, str, date], int]
+    exercise_totals: dict[tuple[str, str], int]
+    counts: dict[date, int]
+
+    def __init__(self, events: ColumnarCollection, grouped: tuple = None):
+        '''
+        Group `events`, or decode the result of `_group` over their
+        columns if it is given.
+        '''
+        self.totals = dict()
+        self.exercise_totals = dict()
+        self.counts = dict()
+        if not len(events):
+            return
+
+        totals, counts = grouped or _group(*self._columns(events))
+
+        type_names = events.dictionaries['type'].values
+        exercise_names = events.dictionaries['exercise'].values
+        for (type, exercise, day), total in totals.items():
+            type = type_names[type]
+            exercise = exercise_names[exercise]
+            key = (type, exercise, self._day(day))
+
+            self.totals[key] = total
+            self.exercise_totals[(type, exercise)] = \
+                self.exercise_totals.get((type, exercise), 0) + total
+        for day, count in counts.items():
+            self.counts[self._day(day)] = count
+
+    @classmethod
+    async def offloaded(cls, events: ColumnarCollection) -> 'EventGroups':
+        '''
+        Group `events` in the worker pool, if there are enough of them to
+        be worth sending there.
+        '''
+        if len(events) < OFFLOAD_EVENTS:
+            return cls(events)
+
+        return cls(
+            events, await worker_pool.run(_group, *cls._columns(events))
+        )
+
+    @staticmethod
+    def _columns(events: ColumnarCollection) -> tuple[array, ...]:
+        return tuple(
+            events.columns[field]
+            for field in ('type', 'exercise', 'value', 'when')
+        )
+
+    def _day(self, day: Any) -> date:
+        if day is UNDATED:
+            return None
+
+        return EPOCH_DAY + timedelta(days=day)
+
+    def total(self, type: str, exercise: str, day: date = None) -> int:
+        '''The total of an exercise on `day`, or over every day.'''
+        if day is None:
+            return self.exercise_totals.get((type, exercise), 0)
+
+        return self.totals.get((type, exercise, day), 0)
+
+    def count(self, day: date = None) -> int:
+        '''The number of events on `day`, or on every day.'''
+        if day is None:
+            return sum(self.counts.values())
+
+        return self.counts.get(day, 0)
+
+def _add_months(day: date, months: int) -> date:
+    '''The first of the month `months` after the month of `day`.'''
+    month = day.year*12 + day.month - 1 + months
+
+    return date(month//12, month%12 + 1, 1)
+
+def _span_window(span: str, ago: int, today: date) -> tuple[date, date]:
+    '''The days of the span `ago` spans before today's, as `[start, end)`.'''
+    if span == 'monthly':
+        start = _add_months(today, -ago)
+        return start, _add_months(start, 1)
+    if span == 'weekly':
+        start = today - timedelta(days=today.weekday() + 7*ago)
+        return start, start + timedelta(days=7)
+
+    start = today - timedelta(days=ago)
+    return start, start + timedelta(days=1)
+
+def _previous_window(
+    span: str, window: tuple[date, date]
+) -> tuple[date, date]:
+    '''The window a span is compared with: the one before, as wide.'''
+    start, end = window
+    if span == 'monthly':
+        return _add_months(start, -1), start
+
+    return start - (end - start), start
+
+def _write_window(out: IOWriter, window: tuple[date, date]):
+    start, end = window
+    last = end - timedelta(days=1)
+    if start == last:
+        out.write_message(start.strftime('%d/%m/%Y'))
+    else:
+        out.write_message('%s - %s'%(
+            start.strftime('%d/%m/%Y'), last.strftime('%d/%m/%Y')
+        ))
+
 async def _report_log(
-    dal: DAL, out: IOWriter, base_day: date = None
+    dal: DAL, io: IO, window: tuple[date, date] = None
 ):
-    events = await dal.get_events(day=base_day)
+    '''
+    Page through events newest first, fetching each page only once the
+    one before it has been read.
+    '''
+    start, end = window or (None, None)
+    events = dal.iter_events(
+        start=start, end=end, order='desc', page_size=LOG_PAGE_SIZE
+    )
 
-    out.write_message('- log -')
+    async def next_event() -> Event:
+        try:
+            return await events.__anext__()
+        except StopAsyncIteration:
+            return None
 
-    last_date = date(year=2000, month=1, day=1)
-    for event in events:
-        event_date = event.when.date()
-        if last_date != event_date:
-            out.write_message(
-                event_date.strftime('%d/%m/%Y')
-            )
+    try:
+        event = await next_event()
+        page = 1
+        while True:
+            with io.temporary_write() as temp_out:
+                temp_out.write_message('- log -')
+                if window:
+                    _write_window(temp_out, window)
+                if page > 1:
+                    temp_out.write_message('page %d', page)
 
-        out.write_event(
-            event,
-            prefix=event.when.strftime('%H:%M')
-        )
-        last_date = event_date
+                last_date = None
+                for _ in range(LOG_PAGE_SIZE):
+                    if event is None:
+                        break
+
+                    event_date = event.when.date()
+                    if last_date != event_date:
+                        temp_out.write_message(
+                            event_date.strftime('%d/%m/%Y')
+                        )
+
+                    temp_out.write_event(
+                        event,
+                        prefix=event.when.strftime('%H:%M')
+                    )
+                    last_date = event_date
+                    event = await next_event()
+
+                if event is None:
+                    await io.read_signal()
+                    return
+
+                choice = await io.read_choice(('older', 'done'))
+                if choice == 'done':
+                    return
+
+            page += 1
+    finally:
+        await events.aclose()
 
 async def _report_totals(
-    dal: DAL, out: IOWriter, base_day: date = None
+    dal: DAL, out: IOWriter, window: tuple[date, date] = None
 ):
+    start, end = window or (None, None)
+
     out.write_message('- totals -')
-    if base_day:
-        out.write_message(base_day.strftime('%d/%m/%Y'))
+    if window:
+        _write_window(out, window)
 
     for type in EXERCISE_TYPES:
         exercises = await dal.get_exercises(type)
 
         for exercise in exercises:
-            total = await dal.get_exercise_total(
-                exercise, day=base_day
-            )
             dummy_event = Event(
                 type=type,
                 exercise=exercise.name,
-                value=total
+                value=await dal.get_exercise_total(
+                    exercise, start=start, end=end
+                )
             )
             out.write_event(dummy_event)
 
 async def _report_difference(
-    dal: DAL, out: IOWriter, base_day: date
+    dal: DAL, out: IOWriter, span: str, window: tuple[date, date]
 ):
-    events_this = await dal.get_events(day=base_day)
-    events_prev = await dal.get_events(
-        day=base_day - timedelta(days=1)
+    previous = _previous_window(span, window)
+    groups = await EventGroups.offloaded(
+        await dal.get_event_columns(start=window[0], end=window[1])
+    )
+    groups_prev = await EventGroups.offloaded(
+        await dal.get_event_columns(start=previous[0], end=previous[1])
     )
 
-    def totals_in(set: list[Event], exercise: Exercise):
-        total = 0
-        for event in set:
-            if not event.is_exercise(exercise):
-                continue
-
-            total += event.value
-
-        return total
-
-    out.write_message('- daily difference -')
-    out.write_message(base_day.strftime('%d/%m/%Y'))
-    out.write_message('events day before: %d', len(events_prev))
-    out.write_message('events this day: %d', len(events_this))
+    name = SPAN_NAMES[span]
+    out.write_message('- %s difference -', span)
+    _write_window(out, window)
+    out.write_message('events %s before: %d', name, groups_prev.count())
+    out.write_message('events this %s: %d', name, groups.count())
 
     for type in EXERCISE_TYPES:
         exercises = await dal.get_exercises(type)
@@ -78,8 +337,8 @@ async def _report_difference(
                 type=type,
                 exercise=exercise.name,
                 value=(
-                    totals_in(events_this, exercise) - \
-                    totals_in(events_prev, exercise)
+                    groups.total(type, exercise.name) - \
+                    groups_prev.total(type, exercise.name)
                 )
             )
             out.write_event(dummy_event, prefix='+/-')
@@ -87,30 +346,36 @@ async def _report_difference(
 @actions.implementation('view report')
 async def report_action(dal: DAL, io: IO):
     report_span = await io.read_choice(
-        ('daily', 'all time'), 'timespan', with_cancel=True
+        (*SPAN_NAMES, 'all time'), 'timespan', with_cancel=True
     )
 
-    day_minus = 0
+    window = None
     report_types = ['log', 'totals']
-    if report_span == 'daily':
+    if report_span in SPAN_NAMES:
         report_types.append('difference')
 
-        day_minus = await io.read_int('for how many days ago?')
+        if report_span == 'range':
+            start = await io.read_date('from (dd/mm/yyyy)?')
+            last = await io.read_date('to (dd/mm/yyyy)?', min=start)
+            window = (start, last + timedelta(days=1))
+        else:
+            ago = await io.read_int(
+                'for how many %ss ago?'%SPAN_NAMES[report_span]
+            )
+            window = _span_window(report_span, ago, date.today())
         
     report_type = await io.read_choice(
         report_types, 'report type', with_cancel=True
     )
 
-    base_day = None
-    if report_span == 'daily':
-        base_day = date.today() - timedelta(days=day_minus)
+    if report_type == 'log':
+        await _report_log(dal, io, window)
+        return
 
     with io.temporary_write() as temp_out:
         if report_type == 'difference':
-            await _report_difference(dal, temp_out, base_day)
-        elif report_type == 'log':
-            await _report_log(dal, temp_out, base_day)
+            await _report_difference(dal, temp_out, report_span, window)
         else:
-            await _report_totals(dal, temp_out, base_day)
+            await _report_totals(dal, temp_out, window)
 
         await io.read_signal()
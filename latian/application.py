@@ -2,89 +2,295 @@
 Factory that collects the configured application in an asynchonous
 callable.
 '''
+import os
 import sys
 from typing import Callable, Coroutine
 
-from .dal import DAL, storage_backends
+from .dal import DAL, storage_backends, commit_modes, user_cache
 from .io import IO, io_sources
 from .cli import CLIArgs
 from .model import get_schema
 from .actions import actions
+from .commands import commands
 from .runtime import runtimes
 
+# The command line options of the application.
+ARGUMENTS = {
+    'help': (
+        ('--help', '-h'),
+        'show the help text',
+        dict()
+    ),
+    'io': (
+        ('--io', '-i'),
+        'specify io type',
+        {
+            'value': io_sources.names,
+            'default': io_sources.names[0]
+        }
+    ),
+    'storage': (
+        ('--storage', '-s'),
+        'specify storage type',
+        {
+            'value': storage_backends.names,
+            'default': storage_backends.names[0]
+        }
+    ),
+    'storage_dest': (
+        ('--storage-dest', '-d'),
+        'specify storage location',
+        {
+            'value': str,
+            'default': lambda args: \
+                '.' \
+                if args.get('storage') in ('file', 'sqlite', 'memory') \
+                else None
+        }
+    ),
+    'storage_pool': (
+        ('--storage-pool',),
+        'specify connection pool size for database storage',
+        {
+            'value': int,
+            'default': 4
+        }
+    ),
+    'journal': (
+        ('--journal', '-j'),
+        'append file storage writes to a journal',
+        dict()
+    ),
+    'journal_compact': (
+        ('--journal-compact',),
+        'journal records before file storage compaction',
+        {
+            'value': int,
+            'default': 1000
+        }
+    ),
+    'commit_mode': (
+        ('--commit-mode', '-c'),
+        'specify when commits are persisted',
+        {
+            'value': commit_modes.names,
+            'default': commit_modes.names[0]
+        }
+    ),
+    'commit_window_ms': (
+        ('--commit-window-ms',),
+        'milliseconds batched commits are coalesced for',
+        {
+            'value': int,
+            'default': 1000
+        }
+    ),
+    'commit_batch': (
+        ('--commit-batch',),
+        'mutations that force a batched commit',
+        {
+            'value': int,
+            'default': 50
+        }
+    ),
+    'fsync': (
+        ('--fsync',),
+        'fsync file storage writes before publishing them',
+        dict()
+    ),
+    'snapshot_format': (
+        ('--snapshot-format',),
+        'specify file storage snapshot format',
+        {
+            'value': ['json', 'binary'],
+            'default': 'json'
+        }
+    ),
+    'snapshot_keep': (
+        ('--snapshot-keep',),
+        'previous file storage snapshots kept for recovery',
+        {
+            'value': int,
+            'default': 2
+        }
+    ),
+    'columnar': (
+        ('--columnar',),
+        'hold file storage collections in columnar arrays',
+        dict()
+    ),
+    'partition': (
+        ('--partition',),
+        'split file storage time series into monthly files',
+        dict()
+    ),
+    'memory_snapshot': (
+        ('--memory-snapshot',),
+        'periodically snapshot memory storage to the storage location',
+        dict()
+    ),
+    'memory_snapshot_interval': (
+        ('--memory-snapshot-interval',),
+        'seconds between memory storage snapshots',
+        {
+            'value': int,
+            'default': 300
+        }
+    ),
+    'cache_budget_mb': (
+        ('--cache-budget-mb',),
+        'megabytes of idle user data kept loaded in memory',
+        {
+            'value': int,
+            'default': 256
+        }
+    ),
+    'no_query_cache': (
+        ('--no-query-cache',),
+        'read storage every time instead of caching unchanged results',
+        dict()
+    ),
+    'maintenance_interval': (
+        ('--maintenance-interval',),
+        'seconds between storage maintenance runs, 0 to disable',
+        {
+            'value': int,
+            'default': 3600
+        }
+    ),
+    'runtime': (
+        ('--runtime', '-r'),
+        'specify runtime type',
+        {
+            'value': runtimes.names,
+            'default': runtimes.names[0]
+        }
+    ),
+    'report_workers': (
+        ('--report-workers',),
+        'processes report work is offloaded to in the multi runtime',
+        {
+            'value': int,
+            'default': lambda args: os.cpu_count() or 1
+        }
+    ),
+    'port': (
+        ('--port', '-p'),
+        'specify port for network io',
+        {
+            'value': int,
+            'default': 5000
+        }
+    ),
+    'user': (
+        ('--user', '-u'),
+        'user for single-user runtimes and commands',
+        {
+            'value': str,
+            'default': 'default'
+        }
+    ),
+    'transfer_file': (
+        ('--file', '-f'),
+        'file events are exported to or imported from, - for stdio',
+        {
+            'value': str,
+            'default': '-'
+        }
+    ),
+    'transfer_format': (
+        ('--format',),
+        'format of exported or imported events',
+        {
+            'value': ['jsonl', 'csv'],
+            'default': lambda args: \
+                'csv' \
+                if args.get('transfer_file').endswith('.csv') \
+                else 'jsonl'
+        }
+    ),
+    'transfer_batch': (
+        ('--batch',),
+        'models read or created at a time by export, import and migrate',
+        {
+            'value': int,
+            'default': 1000
+        }
+    ),
+    'migrate_from': (
+        ('--from',),
+        'storage type migrated from',
+        {
+            'value': storage_backends.names,
+            'default': lambda args: args.get('storage')
+        }
+    ),
+    'migrate_to': (
+        ('--to',),
+        'storage type migrated to',
+        {
+            'value': storage_backends.names
+        }
+    ),
+    'migrate_to_dest': (
+        ('--to-dest',),
+        'storage location migrated to',
+        {
+            'value': str,
+            'default': lambda args: args.get('storage_dest')
+        }
+    ),
+    'migrate_workers': (
+        ('--workers',),
+        'users migrated concurrently',
+        {
+            'value': int,
+            'default': 4
+        }
+    ),
+    'import_commit': (
+        ('--import-commit',),
+        'events imported between commits',
+        {
+            'value': int,
+            'default': 100000
+        }
+    )
+}
+
 def create_application() -> Callable[[], Coroutine]:
-    args = CLIArgs(sys.argv[1:], {
-        'help': (
-            ('--help', '-h'),
-            'show the help text',
-            dict()
-        ),
-        'io': (
-            ('--io', '-i'),
-            'specify io type',
-            {
-                'value': io_sources.names,
-                'default': io_sources.names[0]
-            }
-        ),
-        'storage': (
-            ('--storage', '-s'),
-            'specify storage type',
-            {
-                'value': storage_backends.names,
-                'default': storage_backends.names[0]
-            }
-        ),
-        'storage_dest': (
-            ('--storage-dest', '-d'),
-            'specify storage location',
-            {
-                'value': str,
-                'default': lambda args: \
-                    '.' \
-                    if args.get('storage') == 'file' \
-                    else None
-            }
-        ),
-        'runtime': (
-            ('--runtime', '-r'),
-            'specify runtime type',
-            {
-                'value': runtimes.names,
-                'default': runtimes.names[0]
-            }
-        ),
-        'port': (
-            ('--port', '-p'),
-            'specify port for network io',
-            {
-                'value': int,
-                'default': 5000
-            }
-        ),
-        'user': (
-            ('--user', '-u'),
-            'user for single-user runtimes',
-            {
-                'value': str,
-                'default': 'default'
-            }
-        )
-    })
+    # A leading command name runs that command instead of a runtime.
+    arguments = sys.argv[1:]
+    command = None
+    if arguments and arguments[0] in commands.names:
+        command = commands.get(arguments[0])
+        arguments = arguments[1:]
+
+    args = CLIArgs(arguments, ARGUMENTS)
     
     if args.get('help'):
         args.show_help()
+        print('commands: %s'%', '.join(commands.names))
         sys.exit(0)
 
+    user_cache.configure(args.get('cache_budget_mb'))
+
     StorageBackendImpl = storage_backends.get(args.get('storage'))
+    CommitSchedulerImpl = commit_modes.get(args.get('commit_mode'))
     IOSourceImpl = io_sources.get(args.get('io'))
     RuntimeImpl = runtimes.get(args.get('runtime'))
 
     def dal_factory():
-        return DAL(StorageBackendImpl(get_schema(), args))
+        backend = StorageBackendImpl(get_schema(), args)
+        return DAL(backend, CommitSchedulerImpl(backend, args))
     def io_factory():
         return IO(IOSourceImpl(args))
 
+    if command:
+        async def run_command():
+            await command(dal_factory, args)
+        return run_command
+
     runtime = RuntimeImpl(dal_factory, io_factory, args)
 
     async def run():
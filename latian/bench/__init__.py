@@ -0,0 +1,10 @@
+'''
+Benchmarks for sizing deployments, run as `python -m latian.bench <suite>`.
+
+Suites generate their workloads from a fixed seed and start date, so
+reports of runs with the same options are comparable across commits.
+'''
+from .suite import Timings, suites, BENCH_ARGUMENTS
+
+# Load suite implementations.
+from . import storage
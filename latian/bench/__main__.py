@@ -0,0 +1,61 @@
+import os
+import sys
+import json
+import asyncio
+import platform
+import subprocess
+
+from ..cli import CLIArgs
+from ..dal import user_cache
+from ..application import ARGUMENTS
+from . import suites, BENCH_ARGUMENTS
+from .suite import BENCH_VERSION
+
+def get_revision() -> str:
+    '''The commit benchmarked, if running from a git checkout.'''
+    try:
+        result = subprocess.run(
+            ('git', 'rev-parse', 'HEAD'),
+            cwd=os.path.dirname(__file__),
+            capture_output=True,
+            text=True
+        )
+    except OSError:
+        return None
+
+    return result.stdout.strip() or None
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in suites.names:
+        print(
+            'usage: python -m latian.bench <suite> [options], where <suite> '
+            'is one of: %s'%', '.join(suites.names),
+            file=sys.stderr
+        )
+        sys.exit(1)
+
+    name = sys.argv[1]
+    args = CLIArgs(sys.argv[2:], { **ARGUMENTS, **BENCH_ARGUMENTS })
+    if args.get('help'):
+        args.show_help()
+        sys.exit(0)
+
+    user_cache.configure(args.get('cache_budget_mb'))
+
+    results = asyncio.run(suites.get(name)(args))
+
+    json.dump({
+        'suite': name,
+        'version': BENCH_VERSION,
+        'revision': get_revision(),
+        'python': platform.python_version(),
+        'arguments': sys.argv[2:],
+        'parameters': dict(
+            (key, args.get(key)) for key in BENCH_ARGUMENTS
+            if key != 'bench_dir'
+        ),
+        'results': results
+    }, sys.stdout, indent=2)
+    print()
+
+main()
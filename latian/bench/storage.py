@@ -0,0 +1,277 @@
+'''
+Storage benchmark: synthetic multi-year histories run through every
+storage backend.
+
+Each user gets a catalog of exercises and events spread over a span of
+days. Every backend sees the same users and the same sequence of
+operations. The connect, query, aggregate and commit workloads are timed
+through the DAL, as application logic sees them, with the query cache off
+so repeated reads still reach the backend. The cache is measured by a
+workload of its own.
+'''
+import os
+import gc
+import shutil
+import random
+import tempfile
+import tracemalloc
+from datetime import datetime, date, timedelta
+from typing import Any
+
+from ..cli import CLIArgs
+from ..dal import (
+    DAL, storage_backends, commit_modes, user_cache, query_caches
+)
+from ..model import Event, Exercise, EXERCISE_TYPES, get_schema
+from .suite import Timings, suites
+
+# Histories start on a fixed day so generated data doesn't depend on when
+# the benchmark is run.
+START = datetime(2020, 1, 1)
+
+class SyntheticUser:
+    name: str
+    exercises: list[Exercise]
+    events: list[Event]
+
+    def __init__(
+        self,
+        name: str,
+        exercises: list[Exercise],
+        events: list[Event]
+    ):
+        self.name = name
+        self.exercises = exercises
+        self.events = events
+
+def generate_event(
+    generator: random.Random, exercise: Exercise, when: datetime
+) -> Event:
+    return Event(
+        type=exercise.type,
+        exercise=exercise.name,
+        value=generator.randint(1, 50) if exercise.is_rep \
+            else generator.randint(10, 300),
+        when=when
+    )
+
+def generate_user(
+    generator: random.Random, name: str, args: CLIArgs
+) -> SyntheticUser:
+    exercises = list(
+        Exercise(
+            type=EXERCISE_TYPES[k%len(EXERCISE_TYPES)],
+            name='exercise %d'%k
+        )
+        for k in range(args.get('bench_exercises'))
+    )
+
+    span = args.get('bench_days')*86400
+    moments = sorted(
+        generator.randrange(span) for _ in range(args.get('bench_events'))
+    )
+    events = list(
+        generate_event(
+            generator,
+            generator.choice(exercises),
+            START + timedelta(seconds=moment)
+        )
+        for moment in moments
+    )
+
+    return SyntheticUser(name, exercises, events)
+
+def random_day(generator: random.Random, args: CLIArgs) -> date:
+    return (
+        START + timedelta(days=generator.randrange(args.get('bench_days')))
+    ).date()
+
+def disk_usage(path: str) -> int:
+    usage = 0
+    for directory, _, file_names in os.walk(path):
+        for file_name in file_names:
+            usage += os.path.getsize(os.path.join(directory, file_name))
+
+    return usage
+
+async def run_backend(
+    name: str,
+    args: CLIArgs,
+    cached_args: CLIArgs,
+    users: list[SyntheticUser]
+) -> dict[str, Any]:
+    '''
+    Run every workload against one storage backend, with the query cache
+    only enabled by `cached_args`.
+    '''
+    StorageBackendImpl = storage_backends.get(name)
+    CommitSchedulerImpl = commit_modes.get(args.get('commit_mode'))
+
+    def dal_factory(dal_args: CLIArgs = args) -> DAL:
+        backend = StorageBackendImpl(get_schema(), dal_args)
+        return DAL(backend, CommitSchedulerImpl(backend, dal_args))
+
+    generator = random.Random(args.get('bench_seed'))
+    samples = args.get('bench_samples')
+    timings = dict(
+        (workload, Timings()) for workload in (
+            'populate', 'connect_cold', 'connect_warm', 'query_day',
+            'query_month', 'aggregate_total', 'aggregate_day',
+            'aggregate_range', 'commit', 'aggregate_cached'
+        )
+    )
+
+    for user in users:
+        dal = dal_factory()
+        await dal.connect(user.name)
+        with timings['populate'].measure(len(user.events)):
+            for exercise in user.exercises:
+                await dal.create_exercise(exercise)
+            await dal.create_events(user.events)
+            await dal.commit()
+        await dal.disconnect()
+
+    for k in range(samples):
+        user = users[k%len(users)]
+
+        user_cache.clear()
+        dal = dal_factory()
+        with timings['connect_cold'].measure():
+            await dal.connect(user.name)
+        await dal.disconnect()
+
+        dal = dal_factory()
+        with timings['connect_warm'].measure():
+            await dal.connect(user.name)
+        await dal.disconnect()
+
+    sessions = list()
+    for user in users:
+        dal = dal_factory()
+        await dal.connect(user.name)
+        sessions.append((user, dal))
+
+    last = START + timedelta(days=args.get('bench_days'))
+    for k in range(samples):
+        user, dal = sessions[k%len(sessions)]
+        exercise = generator.choice(user.exercises)
+
+        day = random_day(generator, args)
+        with timings['query_day'].measure():
+            await dal.get_events(day=day)
+
+        start = random_day(generator, args)
+        with timings['query_month'].measure():
+            await dal.get_events(start=start, end=start + timedelta(days=30))
+
+        with timings['aggregate_total'].measure():
+            await dal.get_exercise_total(exercise)
+
+        with timings['aggregate_day'].measure():
+            await dal.get_exercise_total(exercise, day)
+
+        start, end = sorted((
+            random_day(generator, args), random_day(generator, args)
+        ))
+        with timings['aggregate_range'].measure():
+            await dal.get_exercise_total(exercise, start=start, end=end)
+
+        event = generate_event(generator, exercise, last + timedelta(
+            seconds=k
+        ))
+        with timings['commit'].measure():
+            await dal.create_event(event)
+            await dal.commit()
+
+    for _, dal in sessions:
+        await dal.disconnect()
+
+    # Totals read through the query cache, invalidated by a commit every
+    # few reads as a session logging events would.
+    cache_before = query_caches.stats()
+    sessions = list()
+    for user in users:
+        dal = dal_factory(cached_args)
+        await dal.connect(user.name)
+        sessions.append((user, dal))
+
+    for k in range(samples):
+        user, dal = sessions[k%len(sessions)]
+        exercise = user.exercises[k%min(len(user.exercises), 4)]
+
+        with timings['aggregate_cached'].measure():
+            await dal.get_exercise_total(exercise)
+
+        if not k%8:
+            await dal.create_event(generate_event(
+                generator, exercise, last + timedelta(seconds=samples + k)
+            ))
+            await dal.commit()
+
+    for _, dal in sessions:
+        await dal.disconnect()
+    cache_after = query_caches.stats()
+
+    # Peak memory is measured in a pass of its own, as tracing allocations
+    # slows the timed workloads down.
+    user_cache.clear()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        sessions = list()
+        for user in users:
+            dal = dal_factory()
+            await dal.connect(user.name)
+            await dal.get_events(day=random_day(generator, args))
+            sessions.append(dal)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    for dal in sessions:
+        await dal.disconnect()
+    user_cache.clear()
+
+    result = dict(
+        (workload, workload_timings.summarize())
+        for workload, workload_timings in timings.items()
+    )
+    result['peak_memory_mb'] = round(peak/2**20, 2)
+    result['disk_mb'] = round(disk_usage(args.get('storage_dest'))/2**20, 2)
+    result['query_cache'] = dict(
+        (counter, cache_after[counter] - cache_before[counter])
+        for counter in ('hits', 'misses', 'invalidations')
+    )
+    return result
+
+@suites.implementation('storage')
+async def storage_suite(args: CLIArgs) -> dict[str, Any]:
+    generator = random.Random(args.get('bench_seed'))
+    users = list(
+        generate_user(generator, 'bench-%d'%k, args)
+        for k in range(args.get('bench_users'))
+    )
+
+    names = storage_backends.names
+    if args.get('bench_storage') != 'all':
+        names = [args.get('bench_storage')]
+
+    root = tempfile.mkdtemp(prefix='latian-bench-', dir=args.get('bench_dir'))
+    results = dict()
+    try:
+        for name in names:
+            dest = os.path.join(root, name)
+            os.makedirs(dest)
+
+            arguments = ['--storage', name, '--storage-dest', dest]
+            backend_args = CLIArgs(
+                [*arguments, '--no-query-cache', *args.arguments],
+                args.schema
+            )
+            cached_args = CLIArgs([*arguments, *args.arguments], args.schema)
+            results[name] = await run_backend(
+                name, backend_args, cached_args, users
+            )
+    finally:
+        shutil.rmtree(root)
+
+    return results
@@ -0,0 +1,131 @@
+'''
+Benchmark suite registry and latency measurement.
+'''
+import math
+import time
+import tempfile
+from contextlib import contextmanager
+from typing import Callable, Coroutine, Any
+
+from ..cli import CLIArgs
+from ..dal import storage_backends
+from ..common import Implementations
+
+# Incremented when the report layout or a workload changes, as reports of
+# different versions are not comparable.
+BENCH_VERSION = 4
+
+# The command line options of benchmarks, on top of those of the
+# application.
+BENCH_ARGUMENTS = {
+    'bench_users': (
+        ('--bench-users',),
+        'synthetic users to generate',
+        {
+            'value': int,
+            'default': 4
+        }
+    ),
+    'bench_events': (
+        ('--bench-events',),
+        'events generated per user',
+        {
+            'value': int,
+            'default': 20000
+        }
+    ),
+    'bench_exercises': (
+        ('--bench-exercises',),
+        'exercises in each user\'s catalog',
+        {
+            'value': int,
+            'default': 12
+        }
+    ),
+    'bench_days': (
+        ('--bench-days',),
+        'days each user\'s events are spread over',
+        {
+            'value': int,
+            'default': 3*365
+        }
+    ),
+    'bench_samples': (
+        ('--bench-samples',),
+        'operations timed per workload',
+        {
+            'value': int,
+            'default': 200
+        }
+    ),
+    'bench_seed': (
+        ('--bench-seed',),
+        'seed of the generated data and operations',
+        {
+            'value': int,
+            'default': 1
+        }
+    ),
+    'bench_storage': (
+        ('--bench-storage',),
+        'storage type to benchmark',
+        {
+            'value': ['all', *storage_backends.names],
+            'default': 'all'
+        }
+    ),
+    'bench_dir': (
+        ('--bench-dir',),
+        'directory benchmark storage is created and removed in',
+        {
+            'value': str,
+            'default': lambda args: tempfile.gettempdir()
+        }
+    )
+}
+
+def percentile(samples: list[float], fraction: float) -> float:
+    '''The nearest-rank percentile of sorted samples.'''
+    if not samples:
+        return None
+
+    rank = math.ceil(fraction*len(samples)) - 1
+    return samples[max(rank, 0)]
+
+class Timings:
+    '''Latencies of the operations of one workload.'''
+    samples: list[float]
+    items: int
+
+    def __init__(self):
+        self.samples = list()
+        self.items = 0
+
+    @contextmanager
+    def measure(self, items: int = 1):
+        '''Time an operation processing `items` items.'''
+        start = time.perf_counter()
+        yield
+        self.samples.append(time.perf_counter() - start)
+        self.items += items
+
+    def summarize(self) -> dict[str, Any]:
+        samples = sorted(self.samples)
+        total = sum(samples)
+
+        def to_ms(seconds: float) -> float:
+            return round(seconds*1000, 3)
+
+        return {
+            'count': len(samples),
+            'items': self.items,
+            'throughput': round(self.items/total, 1) if total else None,
+            'p50_ms': to_ms(percentile(samples, 0.5)),
+            'p90_ms': to_ms(percentile(samples, 0.9)),
+            'p99_ms': to_ms(percentile(samples, 0.99)),
+            'max_ms': to_ms(samples[-1])
+        } if samples else { 'count': 0, 'items': 0 }
+
+SuiteFn = Callable[[CLIArgs], Coroutine[Any, Any, dict]]
+
+suites = Implementations[SuiteFn]()
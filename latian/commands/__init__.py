@@ -0,0 +1,18 @@
+'''
+Commands are one-off operations run in place of a runtime, selected by
+the first command line argument. They are implemented as asynchronous
+functions that take a DAL factory and the command line arguments as
+input.
+'''
+from typing import Callable, Coroutine
+
+from ..dal import DAL
+from ..cli import CLIArgs
+from ..common import Implementations
+
+CommandFn = Callable[[Callable[[], DAL], CLIArgs], Coroutine]
+
+commands = Implementations[CommandFn]()
+
+# Load command implementations.
+from . import transfer, migrate
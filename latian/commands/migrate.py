@@ -0,0 +1,202 @@
+'''
+Migration of every user from one storage backend to another.
+
+Users discovered in the source are migrated concurrently by a bounded
+pool of workers. Each collection of the schema is copied in batches, time
+series through a cursor so they are never read whole, replacing whatever
+the destination held for the user so an interrupted migration can be
+run again. Counts and aggregates are verified against the source
+afterwards.
+'''
+import sys
+import time
+import asyncio
+from typing import AsyncIterator, Callable, Type, Any
+
+from ..dal import DAL, StorageBackend, storage_backends, iterate
+from ..cli import CLIArgs
+from ..model import Model, get_schema
+from . import commands
+
+async def read_models(
+    backend: StorageBackend, Type: Type[Model], page_size: int
+) -> AsyncIterator[Model]:
+    field = Type.partition_by()
+    if field:
+        async for model in iterate(backend, Type, field, None, page_size):
+            yield model
+        return
+
+    for model in await backend.query(Type):
+        yield model
+
+async def read_batches(
+    models: AsyncIterator[Model], size: int
+) -> AsyncIterator[list[Model]]:
+    batch = list()
+    async for model in models:
+        batch.append(model)
+        if len(batch) >= size:
+            yield batch
+            batch = list()
+
+    if batch:
+        yield batch
+
+async def count_models(
+    backend: StorageBackend, Type: Type[Model], page_size: int
+) -> int:
+    count = 0
+    async for _ in read_models(backend, Type, page_size):
+        count += 1
+
+    return count
+
+async def copy_collection(
+    source: StorageBackend,
+    destination: StorageBackend,
+    Type: Type[Model],
+    page_size: int
+) -> tuple[int, list[dict[str, Any]]]:
+    '''
+    Replace the destination's models of `Type` with the source's. Return
+    how many were copied and filters of the aggregate groups seen, for
+    verification.
+    '''
+    await destination.delete(Type)
+
+    groupings = list(
+        groups[0] for groups in Type.aggregates().values()
+    )
+    keys = set()
+    count = 0
+    async for batch in read_batches(
+        read_models(source, Type, page_size), page_size
+    ):
+        await destination.create_many(batch)
+        count += len(batch)
+
+        for fields in groupings:
+            for model in batch:
+                keys.add(tuple(
+                    (field, getattr(model, field)) for field in fields
+                ))
+
+    return count, [None, *(dict(key) for key in keys)]
+
+async def verify_collection(
+    source: StorageBackend,
+    destination: StorageBackend,
+    Type: Type[Model],
+    count: int,
+    filters: list[dict[str, Any]],
+    page_size: int
+):
+    '''Raise `ValueError` if the copy of a collection is incomplete.'''
+    stored = await count_models(destination, Type, page_size)
+    if stored != count:
+        raise ValueError('%s: copied %d, stored %d'%(
+            Type.collection_name(), count, stored
+        ))
+
+    for field in Type.aggregates():
+        for filter in filters:
+            expected = await source.aggregate(Type, field, filter)
+            actual = await destination.aggregate(Type, field, filter)
+            if expected != actual:
+                raise ValueError('%s: %s total %s of %s, expected %s'%(
+                    Type.collection_name(), field, actual, filter or 'all',
+                    expected
+                ))
+
+async def migrate_user(
+    source: StorageBackend,
+    destination: StorageBackend,
+    user: str,
+    page_size: int
+) -> int:
+    '''Migrate and verify one user, returning the models copied.'''
+    schema = get_schema()
+
+    await source.connect(user)
+    try:
+        await destination.connect(user)
+        try:
+            copies = dict()
+            for collection_name, Type in schema.items():
+                copies[collection_name] = await copy_collection(
+                    source, destination, Type, page_size
+                )
+            await destination.commit()
+
+            for collection_name, Type in schema.items():
+                count, filters = copies[collection_name]
+                await verify_collection(
+                    source, destination, Type, count, filters, page_size
+                )
+        finally:
+            await destination.disconnect()
+    finally:
+        await source.disconnect()
+
+    return sum(count for count, _ in copies.values())
+
+@commands.implementation('migrate')
+async def migrate(dal_factory: Callable[[], DAL], args: CLIArgs):
+    started = time.monotonic()
+
+    source_name = args.get('migrate_from')
+    destination_name = args.get('migrate_to')
+    source_args = CLIArgs(
+        ['--storage', source_name, *args.arguments], args.schema
+    )
+    destination_args = CLIArgs(
+        [
+            '--storage', destination_name,
+            '--storage-dest', args.get('migrate_to_dest'),
+            *args.arguments
+        ],
+        args.schema
+    )
+    if source_name == destination_name and \
+            source_args.get('storage_dest') == \
+                destination_args.get('storage_dest'):
+        print('migrate: source and destination are the same', file=sys.stderr)
+        sys.exit(1)
+
+    SourceImpl = storage_backends.get(source_name)
+    DestinationImpl = storage_backends.get(destination_name)
+    page_size = args.get('transfer_batch')
+
+    users = await SourceImpl(get_schema(), source_args).discover_users()
+
+    workers = asyncio.Semaphore(args.get('migrate_workers'))
+    failures = list()
+    async def run_worker(user: str) -> int:
+        async with workers:
+            try:
+                count = await migrate_user(
+                    SourceImpl(get_schema(), source_args),
+                    DestinationImpl(get_schema(), destination_args),
+                    user, page_size
+                )
+            except Exception as ex:
+                failures.append(user)
+                print('failed %s: %s'%(user, ex), file=sys.stderr)
+                return 0
+
+            print('migrated %s: %d models'%(user, count), file=sys.stderr)
+            return count
+
+    counts = await asyncio.gather(*(run_worker(user) for user in users))
+
+    elapsed = time.monotonic() - started
+    print(
+        'migrated %d of %d users, %d models in %.2fs (%d models/s)'%(
+            len(users) - len(failures), len(users), sum(counts), elapsed,
+            sum(counts)/elapsed if elapsed else 0
+        ),
+        file=sys.stderr
+    )
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,208 @@
+'''
+Streaming export and import of a user's event history, as JSON lines or
+CSV.
+
+Events are streamed in bounded batches: exports read them through the
+`DAL.iter_events` cursor, and imports create them a batch at a time,
+committing periodically. Histories of millions of events are moved
+without being held in memory at once, beyond what the storage backend
+itself holds. Throughput is reported on standard error when done.
+'''
+import io
+import sys
+import csv
+import json
+import time
+from datetime import datetime
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, TextIO, Any
+
+from ..dal import DAL
+from ..cli import CLIArgs
+from ..model import EXERCISE_TYPES, Event, Exercise
+from . import commands
+
+FIELDS = tuple(Event.schema().keys())
+
+def encode_event(event: Event) -> dict[str, Any]:
+    return {
+        'type': event.type,
+        'exercise': event.exercise,
+        'value': event.value,
+        'when': event.when.isoformat() if event.when else None
+    }
+
+def decode_event(record: dict[str, Any]) -> Event:
+    '''Decode a record, raising `ValueError` if it isn't a valid event.'''
+    if not isinstance(record, dict):
+        raise ValueError('not an object')
+    for field in FIELDS:
+        # Undated events have a null time, or an empty one in CSV.
+        if field == 'when' and field in record:
+            continue
+        if record.get(field) in (None, str()):
+            raise ValueError('missing %s'%field)
+
+    if record['type'] not in EXERCISE_TYPES:
+        raise ValueError('unknown exercise type: %s'%record['type'])
+
+    try:
+        value = int(record['value'])
+    except (TypeError, ValueError):
+        raise ValueError('invalid value: %s'%record['value'])
+
+    when = None
+    if record['when'] not in (None, str()):
+        try:
+            when = datetime.fromisoformat(record['when'])
+        except (TypeError, ValueError):
+            raise ValueError('invalid time: %s'%record['when'])
+        # Times are stored as naive wall-clock times.
+        if when.tzinfo is not None:
+            raise ValueError('time has a UTC offset: %s'%record['when'])
+
+    return Event(
+        type=record['type'],
+        exercise=str(record['exercise']),
+        value=value,
+        when=when
+    )
+
+def read_jsonl(file_io: TextIO) -> Iterator[dict[str, Any]]:
+    for k, line in enumerate(file_io):
+        if not line.strip():
+            continue
+
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            raise ValueError('line %d: invalid JSON'%(k + 1))
+
+def read_csv(file_io: TextIO) -> Iterator[dict[str, Any]]:
+    yield from csv.DictReader(file_io)
+
+READERS = {
+    'jsonl': read_jsonl,
+    'csv': read_csv
+}
+
+def jsonl_writer(file_io: TextIO) -> Callable[[dict[str, Any]], None]:
+    def write(record: dict[str, Any]):
+        file_io.write('%s\n'%json.dumps(record))
+    return write
+
+def csv_writer(file_io: TextIO) -> Callable[[dict[str, Any]], None]:
+    writer = csv.DictWriter(file_io, FIELDS)
+    writer.writeheader()
+
+    return writer.writerow
+
+WRITERS = {
+    'jsonl': jsonl_writer,
+    'csv': csv_writer
+}
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    batch = list()
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = list()
+
+    if batch:
+        yield batch
+
+@contextmanager
+def open_stream(path: str, mode: str):
+    '''Open a file for streaming, or a standard stream for `-`.'''
+    if path == '-':
+        yield sys.stdin if mode == 'r' else sys.stdout
+        return
+
+    with io.open(path, mode, encoding='utf-8', newline='') as file_io:
+        yield file_io
+
+def report(verb: str, count: int, started: float):
+    elapsed = time.monotonic() - started
+    print(
+        '%s %d events in %.2fs (%d events/s)'%(
+            verb, count, elapsed, count/elapsed if elapsed else 0
+        ),
+        file=sys.stderr
+    )
+
+@commands.implementation('export')
+async def export_events(dal_factory: Callable[[], DAL], args: CLIArgs):
+    started = time.monotonic()
+    batch = args.get('transfer_batch')
+
+    dal = dal_factory()
+    await dal.connect(args.get('user'))
+    count = 0
+    try:
+        with open_stream(args.get('transfer_file'), 'w') as file_io:
+            write = WRITERS[args.get('transfer_format')](file_io)
+
+            async for event in dal.iter_events(page_size=batch):
+                write(encode_event(event))
+                count += 1
+    finally:
+        await dal.disconnect()
+
+    report('exported', count, started)
+
+@commands.implementation('import')
+async def import_events(dal_factory: Callable[[], DAL], args: CLIArgs):
+    started = time.monotonic()
+    commit_every = args.get('import_commit')
+
+    dal = dal_factory()
+    await dal.connect(args.get('user'))
+    count, uncommitted = 0, 0
+    error = None
+    try:
+        exercises = set()
+        for type in EXERCISE_TYPES:
+            for exercise in await dal.get_exercises(type):
+                exercises.add((exercise.type, exercise.name))
+
+        with open_stream(args.get('transfer_file'), 'r') as file_io:
+            records = READERS[args.get('transfer_format')](file_io)
+            for batch in batched(records, args.get('transfer_batch')):
+                # Decode the whole batch first, so a bad record leaves
+                # none of it created.
+                events = list()
+                for record in batch:
+                    try:
+                        events.append(decode_event(record))
+                    except ValueError as ex:
+                        raise ValueError('record %d: %s'%(
+                            count + len(events) + 1, ex
+                        ))
+
+                # Events of exercises not in the catalog add them to it.
+                for event in events:
+                    key = (event.type, event.exercise)
+                    if key not in exercises:
+                        exercises.add(key)
+                        await dal.create_exercise(
+                            Exercise(type=event.type, name=event.exercise)
+                        )
+
+                await dal.create_events(events)
+                count += len(events)
+                uncommitted += len(events)
+                if uncommitted >= commit_every:
+                    await dal.commit()
+                    uncommitted = 0
+    except ValueError as ex:
+        error = ex
+    finally:
+        await dal.commit()
+        await dal.disconnect()
+
+    report('imported', count, started)
+    if error:
+        print('import stopped: %s'%error, file=sys.stderr)
+        sys.exit(1)
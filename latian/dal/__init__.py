@@ -5,7 +5,11 @@ Persistant storage is comprised of two parts:
 `StorageBackend`s, the schema-aware persistance mechanisms.
 '''
 from .dal import DAL
-from .storage_backend import storage_backends
+from .storage_backend import StorageBackend, storage_backends
+from .cursor import iterate
+from .commit_scheduler import commit_modes
+from .user_cache import user_cache
+from .query_cache import query_caches
 
 # Load StorageBackend implementations.
-from . import file_system_backend
+from . import file_system_backend, sqlite_backend, memory_backend
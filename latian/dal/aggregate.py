@@ -0,0 +1,251 @@
+'''
+Materialised sums for storage backends that hold collections in memory.
+
+A `SumAggregate` keeps the total of one field grouped by a group of other
+fields, with `datetime` fields bucketed by day, so a filter naming exactly
+that group can be answered with a single lookup. When the last grouping
+field is bucketed, it also keeps running totals over the days of each
+group, so a range of days within a group is answered with two.
+'''
+from typing import Type, Any
+from bisect import bisect_left
+from datetime import datetime, date, timedelta
+
+from ..model import Model
+from .query import RANGE_OPERATORS, is_predicate
+from .index import day_of
+
+def day_window(condition: dict[str, Any]) -> tuple[date, date]:
+    '''
+    The days from `start` up to but excluding `end` a range predicate
+    with `date` operands matches, either of which may be `None` when
+    unbounded.
+    '''
+    start, end = None, None
+    def narrow(low: date, high: date):
+        nonlocal start, end
+        if low is not None and (start is None or low > start):
+            start = low
+        if high is not None and (end is None or high < end):
+            end = high
+
+    day = timedelta(days=1)
+    for operator, operand in condition.items():
+        if operator == 'gte':
+            narrow(operand, None)
+        elif operator == 'gt':
+            narrow(operand + day, None)
+        elif operator == 'lt':
+            narrow(None, operand)
+        elif operator == 'lte':
+            narrow(None, operand + day)
+        else:
+            narrow(operand[0], operand[1] + day)
+
+    return start, end
+
+class RunningTotals:
+    '''The cumulative sums of one group over its days, in order.'''
+    days: list[date]
+    # The total of every day up to and including each of `days`.
+    totals: list[int]
+
+    def __init__(self):
+        self.days = list()
+        self.totals = list()
+
+    def add(self, day: date, amount: int):
+        days = self.days
+        if not days or days[-1] < day:
+            self.totals.append(self.before(None) + amount)
+            days.append(day)
+            return
+
+        index = bisect_left(days, day)
+        if days[index] != day:
+            days.insert(index, day)
+            self.totals.insert(index, self.totals[index - 1] if index else 0)
+        # Out of order days shift the totals of every later day.
+        for later in range(index, len(days)):
+            self.totals[later] += amount
+
+    def before(self, day: date) -> int:
+        '''The total of the days before `day`, or of all of them.'''
+        index = len(self.days)
+        if day is not None:
+            index = bisect_left(self.days, day)
+
+        return self.totals[index - 1] if index else 0
+
+    def between(self, start: date, end: date) -> int:
+        if start is not None and end is not None and start >= end:
+            return 0
+
+        low = self.before(start) if start is not None else 0
+        return self.before(end) - low
+
+    def copy(self) -> 'RunningTotals':
+        copy = RunningTotals()
+        copy.days = list(self.days)
+        copy.totals = list(self.totals)
+
+        return copy
+
+class SumAggregate:
+    field: str
+    fields: tuple[str, ...]
+    bucketed: tuple[bool, ...]
+    sums: dict[tuple, int]
+    # Whether running totals are kept over the last grouping field.
+    ranged: bool
+    # Running totals, by the group key without its day.
+    running: dict[tuple, RunningTotals]
+
+    def __init__(
+        self, Type: Type[Model], field: str, fields: tuple[str, ...]
+    ):
+        schema = Type.schema()
+
+        self.field = field
+        self.fields = fields
+        self.bucketed = tuple(
+            schema[key] is datetime for key in fields
+        )
+        self.ranged = self.bucketed[-1]
+        self.sums = dict()
+        self.running = dict()
+
+    def covers(self, filter: dict[str, Any]) -> bool:
+        if len(filter) != len(self.fields):
+            return False
+
+        for key, bucketed in zip(self.fields, self.bucketed):
+            if key not in filter:
+                return False
+
+            condition = filter[key]
+            if is_predicate(condition):
+                if key != self.fields[-1] or not self.ranged:
+                    return False
+                if not self._covers_range(condition):
+                    return False
+            # An exact timestamp is narrower than a day bucket.
+            elif bucketed and type(condition) is not date:
+                return False
+
+        return True
+
+    def _covers_range(self, condition: dict[str, Any]) -> bool:
+        for operator, operand in condition.items():
+            if operator not in RANGE_OPERATORS:
+                return False
+
+            operands = operand if operator == 'between' else (operand,)
+            for operand in operands:
+                if type(operand) is not date:
+                    return False
+
+        return True
+
+    def key(self, values: tuple) -> tuple:
+        '''The group key for values of the grouping fields.'''
+        return tuple(
+            day_of(value) if bucketed else value
+            for value, bucketed in zip(values, self.bucketed)
+        )
+
+    def model_key(self, model: Model) -> tuple:
+        return self.key(
+            tuple(getattr(model, key) for key in self.fields)
+        )
+
+    def encode_key(self, key: tuple) -> list:
+        # Undated models are grouped under a `None` day.
+        return list(
+            value.isoformat() if bucketed and value is not None else value
+            for value, bucketed in zip(key, self.bucketed)
+        )
+
+    def add(self, model: Model):
+        self.add_values(
+            tuple(getattr(model, key) for key in self.fields),
+            getattr(model, self.field)
+        )
+
+    def add_values(self, values: tuple, amount: int):
+        '''Add `amount` to the group for values of the grouping fields.'''
+        key = self.key(values)
+
+        self.sums[key] = self.sums.get(key, 0) + amount
+        if self.ranged:
+            self._add_running(key, amount)
+
+    def _add_running(self, key: tuple, amount: int):
+        # Undated models fall in no range.
+        if key[-1] is None:
+            return
+
+        running = self.running.get(key[:-1])
+        if running is None:
+            running = self.running[key[:-1]] = RunningTotals()
+        running.add(key[-1], amount)
+
+    def lookup(self, filter: dict[str, Any]) -> int:
+        condition = filter[self.fields[-1]]
+        if is_predicate(condition):
+            running = self.running.get(self.key(tuple(
+                filter[key] for key in self.fields[:-1]
+            )))
+            if running is None:
+                return 0
+            return running.between(*day_window(condition))
+
+        key = self.key(tuple(filter[key] for key in self.fields))
+
+        return self.sums.get(key, 0)
+
+    def clear(self):
+        self.sums = dict()
+        self.running = dict()
+
+    def copy(self) -> 'SumAggregate':
+        copy = SumAggregate.__new__(SumAggregate)
+        copy.field = self.field
+        copy.fields = self.fields
+        copy.bucketed = self.bucketed
+        copy.ranged = self.ranged
+        copy.sums = dict(self.sums)
+        copy.running = dict(
+            (key, running.copy()) for key, running in self.running.items()
+        )
+
+        return copy
+
+    def rebuild(self, models: list[Model]):
+        self.clear()
+        for model in models:
+            self.add(model)
+
+    def dehydrate(self) -> list:
+        sums = list()
+        for key, total in self.sums.items():
+            sums.append([self.encode_key(key), total])
+
+        return sums
+
+    def hydrate(self, sums: list):
+        self.clear()
+        for key, total in sums:
+            key = tuple(
+                date.fromisoformat(value) \
+                    if bucketed and value is not None else value
+                for value, bucketed in zip(key, self.bucketed)
+            )
+            self.sums[key] = total
+
+        if self.ranged:
+            for key in sorted(
+                (key for key in self.sums if key[-1] is not None),
+                key=lambda key: key[-1]
+            ):
+                self._add_running(key, self.sums[key])
@@ -0,0 +1,332 @@
+'''
+Binary snapshot format for the file storage backend, opened with `mmap`.
+
+    header    `MAGIC`, format version, flags, journal sequence number,
+              the offset and length of the metadata and a CRC-32 of
+              everything after the header
+    records   for each time series collection, fixed-width little-endian
+              records in the column encoding of `ColumnarCollection`
+    metadata  JSON holding the other collections in `Codec` row form, the
+              stored aggregates, for each time series collection its
+              fields, record count, offset and per-field string tables,
+              and the manifests of partitioned collections
+
+Time series collections are those of columnar-encodable models with a
+`datetime` field. Their records are only decoded when a query touches
+them; everything else is decoded eagerly. The checksum is verified when a
+snapshot is mapped, so damaged records are never decoded.
+'''
+import io
+import json
+import mmap
+import zlib
+import struct
+from array import array
+from typing import Type, Any, BinaryIO
+from datetime import datetime
+
+from ..model import Model
+from .columnar import ColumnarCollection, StringDictionary
+
+MAGIC = b'LTNB'
+BINARY_FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sHHQQQI')
+# Headers by format version; version 1 had no checksum.
+HEADERS = {
+    1: struct.Struct('<4sHHQQQ'),
+    2: HEADER
+}
+PREFIX = struct.Struct('<4sH')
+CHECKSUM_CHUNK = 2**20
+# Fixed-width equivalents of the in-memory column typecodes.
+RECORD_TYPECODES = {
+    'q': 'q',
+    'd': 'd',
+    'L': 'I'
+}
+
+def is_time_series(Type: Type[Model]) -> bool:
+    return (
+        ColumnarCollection.supports(Type) and \
+        datetime in Type.schema().values()
+    )
+
+def _record_struct(collection: ColumnarCollection) -> struct.Struct:
+    return struct.Struct('<%s'%''.join(
+        RECORD_TYPECODES[collection.columns[field].typecode]
+        for field in collection.fields
+    ))
+
+class MappedColumn:
+    '''
+    A column read from fixed-width records in a mapped snapshot, followed
+    by an in-memory tail of values appended since it was opened.
+    '''
+    typecode: str
+    tail: Any
+
+    def __init__(
+        self,
+        buffer: mmap.mmap,
+        offset: int,
+        stride: int,
+        count: int,
+        typecode: str
+    ):
+        self.buffer = buffer
+        self.offset = offset
+        self.stride = stride
+        self.count = count
+        self.typecode = typecode
+        self.unpack = struct.Struct(
+            '<%s'%RECORD_TYPECODES[typecode]
+        ).unpack_from
+        self.tail = array(typecode)
+
+    def __len__(self) -> int:
+        return self.count + len(self.tail)
+
+    def __getitem__(self, row: int) -> Any:
+        if row < self.count:
+            return self.unpack(
+                self.buffer, self.offset + row*self.stride
+            )[0]
+
+        return self.tail[row - self.count]
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def append(self, value: Any):
+        self.tail.append(value)
+
+    def copy(self) -> 'MappedColumn':
+        copy = MappedColumn(
+            self.buffer, self.offset, self.stride, self.count,
+            self.typecode
+        )
+        copy.tail = self.tail[:]
+
+        return copy
+
+class MappedCollection(ColumnarCollection):
+    '''
+    A columnar collection over the records of a mapped snapshot. Its
+    indexes are built the first time a filtered query needs them.
+    '''
+    indexed: bool
+
+    def __init__(
+        self,
+        Type: Type[Model],
+        buffer: mmap.mmap,
+        meta: dict[str, Any],
+        aggregate_data: list = None
+    ):
+        super().__init__(Type)
+
+        record_fields = meta['fields']
+        record_struct = struct.Struct('<%s'%''.join(
+            RECORD_TYPECODES[self.columns[field].typecode]
+            for field in record_fields
+        ))
+        position = 0
+        offsets = dict()
+        for field in record_fields:
+            offsets[field] = position
+            position += struct.calcsize(
+                '<%s'%RECORD_TYPECODES[self.columns[field].typecode]
+            )
+
+        for field in self.fields:
+            self.columns[field] = MappedColumn(
+                buffer,
+                meta['offset'] + offsets[field],
+                record_struct.size,
+                meta['count'],
+                self.columns[field].typecode
+            )
+        for field, strings in meta['strings'].items():
+            dictionary = self.dictionaries[field] = StringDictionary()
+            for value in strings:
+                dictionary.encode(value)
+
+        self.indexed = False
+        if aggregate_data is not None and \
+                len(aggregate_data) == len(self.aggregates):
+            for aggregate, sums in zip(self.aggregates, aggregate_data):
+                aggregate.hydrate(sums)
+        else:
+            self._rebuild()
+
+    def _ensure_indexes(self):
+        if self.indexed:
+            return
+
+        for index in self.indexes:
+            index.clear()
+        for row in range(len(self)):
+            self._index_row(row, True, False)
+        self.indexed = True
+
+    def _rebuild(self, aggregates: bool = True):
+        super()._rebuild(aggregates)
+        self.indexed = True
+
+    def _rows(self, filter: dict[str, Any]):
+        if filter:
+            self._ensure_indexes()
+
+        return super()._rows(filter)
+
+    def _ordered_lookup(self, *args) -> list:
+        self._ensure_indexes()
+
+        return super()._ordered_lookup(*args)
+
+    def append(self, model: Model):
+        self._append_row(model)
+        self._index_row(len(self) - 1, self.indexed, True)
+
+class ChecksumWriter:
+    '''Passes writes through to a file, keeping a CRC-32 of them.'''
+    file_io: BinaryIO
+    checksum: int
+
+    def __init__(self, file_io: BinaryIO):
+        self.file_io = file_io
+        self.checksum = 0
+
+    def write(self, data: bytes):
+        self.checksum = zlib.crc32(data, self.checksum)
+        self.file_io.write(data)
+
+    def tell(self) -> int:
+        return self.file_io.tell()
+
+def write_binary_snapshot(
+    file_io: BinaryIO,
+    journal_seq: int,
+    aggregates: dict[str, list],
+    collections: dict[str, Any],
+    time_series: dict[str, ColumnarCollection],
+    partitions: dict[str, dict] = None
+):
+    '''
+    Write a snapshot of row form `collections` and columnar `time_series`
+    collections, with the manifests of any partitioned collections.
+    '''
+    file_io.write(bytes(HEADER.size))
+    body_io = ChecksumWriter(file_io)
+
+    records_meta = dict()
+    for collection_name, collection in time_series.items():
+        record_struct = _record_struct(collection)
+        columns = list(
+            collection.columns[field] for field in collection.fields
+        )
+
+        records_meta[collection_name] = {
+            'fields': collection.fields,
+            'count': len(collection),
+            'offset': body_io.tell(),
+            'strings': dict(
+                (field, dictionary.values)
+                for field, dictionary in collection.dictionaries.items()
+            )
+        }
+        for row in range(len(collection)):
+            body_io.write(record_struct.pack(
+                *(column[row] for column in columns)
+            ))
+
+    meta_offset = body_io.tell()
+    meta_data = json.dumps({
+        'aggregates': aggregates,
+        'collections': collections,
+        'records': records_meta,
+        'partitions': partitions or dict()
+    }, separators=(',', ':')).encode('utf-8')
+    body_io.write(meta_data)
+
+    file_io.seek(0)
+    file_io.write(HEADER.pack(
+        MAGIC, BINARY_FORMAT_VERSION, 0,
+        journal_seq, meta_offset, len(meta_data), body_io.checksum
+    ))
+
+def _read_header(buffer: Any, path: str) -> tuple:
+    magic, version = PREFIX.unpack_from(buffer, 0)
+    if magic != MAGIC or version not in HEADERS:
+        raise ValueError('unsupported snapshot: %s'%path)
+
+    return HEADERS[version].unpack_from(buffer, 0)
+
+def _check_buffer(buffer: mmap.mmap, header: tuple, path: str):
+    '''
+    Raise `ValueError` if a mapped snapshot doesn't match its checksum,
+    or, for snapshots without one, if its metadata lies past its end.
+    '''
+    _, version, _, _, meta_offset, meta_length = header[:6]
+    if meta_offset + meta_length > len(buffer):
+        raise ValueError('truncated snapshot: %s'%path)
+    if len(header) < 7:
+        return
+
+    body = memoryview(buffer)[HEADERS[version].size:]
+    try:
+        checksum = zlib.crc32(body)
+    finally:
+        body.release()
+    if checksum != header[6]:
+        raise ValueError('checksum mismatch: %s'%path)
+
+def read_binary_snapshot(path: str) -> tuple[int, dict, mmap.mmap]:
+    '''
+    Map a snapshot, returning its journal sequence and metadata. Raise
+    `ValueError` if it is damaged.
+    '''
+    with io.open(path, 'rb') as file_io:
+        buffer = mmap.mmap(file_io.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        header = _read_header(buffer, path)
+        _check_buffer(buffer, header, path)
+
+        _, _, _, journal_seq, meta_offset, meta_length = header[:6]
+        meta = json.loads(
+            buffer[meta_offset:meta_offset + meta_length].decode('utf-8')
+        )
+    except BaseException:
+        buffer.close()
+        raise
+
+    return journal_seq, meta, buffer
+
+def binary_snapshot_version(path: str) -> int:
+    with io.open(path, 'rb') as file_io:
+        return _read_header(file_io.read(HEADER.size), path)[1]
+
+def verify_binary_snapshot(path: str) -> bool:
+    '''
+    Check a snapshot against its checksum. Snapshots written before
+    checksums were stored are taken as valid if their header is.
+    '''
+    with io.open(path, 'rb') as file_io:
+        try:
+            header = _read_header(file_io.read(HEADER.size), path)
+        except (ValueError, struct.error):
+            return False
+        if len(header) < 7:
+            return True
+
+        file_io.seek(HEADERS[header[1]].size)
+        checksum = 0
+        while True:
+            chunk = file_io.read(CHECKSUM_CHUNK)
+            if not chunk:
+                break
+            checksum = zlib.crc32(chunk, checksum)
+
+        return checksum == header[6]
@@ -0,0 +1,280 @@
+'''
+Codecs between models and their serialised form, compiled once per
+`Model` subclass.
+
+The current (v2) form of a model is a row: a list of its field values in
+schema order, with `datetime`s as integer seconds since `EPOCH` and
+nested models as rows themselves. Collections of rows may replace the
+values of string fields with codes into per-field tables, so repeated
+strings are stored once. The legacy (v1) form is a dictionary keyed by field
+name, with `datetime`s formatted as `LEGACY_DATETIME_FORMAT`.
+'''
+from typing import Callable, Iterable, Type, Any
+from datetime import datetime, date, timedelta
+
+from ..model import Model
+from .query import is_predicate
+
+LEGACY_DATETIME_FORMAT = '%d/%m/%Y %H:%M'
+# Datetimes are naive wall-clock times, so they are counted from a naive
+# epoch rather than converted through the local timezone.
+EPOCH = datetime(1970, 1, 1)
+
+def encode_datetime(value: datetime) -> int:
+    return int((value - EPOCH).total_seconds())
+
+def decode_datetime(value: int) -> datetime:
+    return EPOCH + timedelta(seconds=value)
+
+def decode_legacy_datetime(value: str) -> datetime:
+    return datetime.strptime(value, LEGACY_DATETIME_FORMAT)
+
+class Codec:
+    codecs: dict[Type[Model], 'Codec'] = dict()
+    Type: Type[Model]
+    fields: tuple[str, ...]
+    encoders: dict[str, Callable]
+    decoders: dict[str, Callable]
+    encode: Callable[[Model], list]
+    decode: Callable[[list], Model]
+    decode_legacy: Callable[[dict], Model]
+
+    @classmethod
+    def get(cls, Type: Type[Model]) -> 'Codec':
+        codec = cls.codecs.get(Type)
+        if not codec:
+            codec = cls.codecs[Type] = cls(Type)
+
+        return codec
+
+    def __init__(self, Type: Type[Model]):
+        self.Type = Type
+
+        schema = Type.schema()
+        self.fields = tuple(schema.keys())
+
+        encoders, decoders, legacy_decoders = dict(), dict(), dict()
+        for key, field_type in schema.items():
+            if type(field_type) is list:
+                if issubclass(field_type[0], Model):
+                    inner = Codec.get(field_type[0])
+                    encoders[key] = self._list_of(inner.encode)
+                    decoders[key] = self._list_of(inner.decode)
+                    legacy_decoders[key] = self._list_of(
+                        inner.decode_legacy
+                    )
+                else:
+                    encoders[key] = decoders[key] = list
+                    legacy_decoders[key] = list
+            elif field_type is datetime:
+                encoders[key] = encode_datetime
+                decoders[key] = decode_datetime
+                legacy_decoders[key] = decode_legacy_datetime
+        self.encoders = encoders
+        self.decoders = decoders
+
+        self.encode = self._compile(
+            'lambda model: [%s]',
+            'model.%s', encoders
+        )
+        self.decode = self._compile(
+            'lambda row: Type(%s)',
+            'row[%d]', decoders
+        )
+        self.decode_legacy = self._compile(
+            'lambda data: Type(%s)',
+            'data[%r]', legacy_decoders
+        )
+
+    def _list_of(self, convert: Callable) -> Callable:
+        def convert_list(values: list) -> list:
+            return list(convert(value) for value in values)
+
+        return convert_list
+
+    def _compile(
+        self,
+        template: str,
+        access_format: str,
+        converters: dict[str, Callable]
+    ) -> Callable:
+        '''
+        Build a function that converts each field with straight-line
+        code, rather than looping over the schema for every model.
+        '''
+        namespace = { 'Type': self.Type }
+        parts = list()
+        for k, key in enumerate(self.fields):
+            access = access_format%(k if '%d' in access_format else key)
+            if key not in converters:
+                parts.append(access)
+                continue
+
+            name = '_convert_%d'%k
+            namespace[name] = converters[key]
+            parts.append(
+                '(None if %s is None else %s(%s))'%(access, name, access)
+            )
+
+        return eval(template%', '.join(parts), namespace)
+
+    def decode_rows(self, fields: list[str], rows: list[list]):
+        '''
+        Decode rows stored with the field order `fields`, which may
+        differ from the current schema.
+        '''
+        if tuple(fields) == self.fields:
+            return map(self.decode, rows)
+
+        positions = list(
+            fields.index(key) if key in fields else None
+            for key in self.fields
+        )
+        return map(self.decode, (
+            list(
+                None if position is None else row[position]
+                for position in positions
+            )
+            for row in rows
+        ))
+
+    def encode_collection(self, models: Iterable[Model]) -> dict[str, Any]:
+        '''Encode models as rows, with string fields coded into tables.'''
+        schema = self.Type.schema()
+        tables = dict(
+            (k, dict()) for k, key in enumerate(self.fields)
+            if schema[key] is str
+        )
+
+        rows = list()
+        for model in models:
+            row = self.encode(model)
+            for k, table in tables.items():
+                value = row[k]
+                if value is None:
+                    continue
+
+                code = table.get(value)
+                if code is None:
+                    code = table[value] = len(table)
+                row[k] = code
+            rows.append(row)
+
+        return {
+            'fields': self.fields,
+            'rows': rows,
+            'strings': dict(
+                (self.fields[k], list(table)) for k, table in tables.items()
+            )
+        }
+
+    def decode_collection(self, collection_data: dict[str, Any]):
+        fields = collection_data['fields']
+        rows = collection_data['rows']
+
+        strings = collection_data.get('strings')
+        if strings:
+            tables = list(
+                (fields.index(key), values)
+                for key, values in strings.items()
+            )
+
+            def decode_strings(row: list) -> list:
+                for k, values in tables:
+                    if row[k] is not None:
+                        row[k] = values[row[k]]
+                return row
+            rows = map(decode_strings, rows)
+
+        return self.decode_rows(fields, rows)
+
+    def _encode_operand(self, value: Any) -> Any:
+        if isinstance(value, (list, tuple, set)):
+            return list(self._encode_operand(item) for item in value)
+        if isinstance(value, datetime):
+            return encode_datetime(value)
+        if isinstance(value, date):
+            return value.isoformat()
+
+        return value
+
+    def _decode_operand(self, value: Any) -> Any:
+        if isinstance(value, list):
+            return list(self._decode_operand(item) for item in value)
+        if isinstance(value, (int, float)):
+            return decode_datetime(value)
+        if '/' in value:
+            return decode_legacy_datetime(value)
+
+        return date.fromisoformat(value)
+
+    def encode_filter(self, filter: dict[str, Any]) -> dict[str, Any]:
+        '''
+        Encode a filter; `datetime` operands become epoch seconds and
+        `date` operands ISO format strings.
+        '''
+        if filter is None:
+            return None
+
+        schema = self.Type.schema()
+        filter_data = dict()
+        for key, condition in filter.items():
+            encode = lambda operand: operand
+            if schema[key] is datetime:
+                encode = self._encode_operand
+            elif is_predicate(condition):
+                encode = lambda operand: list(operand) \
+                    if isinstance(operand, (tuple, set)) else operand
+
+            if is_predicate(condition):
+                condition = dict(
+                    (operator, encode(operand))
+                    for operator, operand in condition.items()
+                )
+            else:
+                condition = encode(condition)
+
+            filter_data[key] = condition
+
+        return filter_data
+
+    def encode_changes(self, changes: dict[str, Any]) -> dict[str, Any]:
+        '''Encode field values to update, as they are encoded in rows.'''
+        changes_data = dict()
+        for key, value in changes.items():
+            if value is not None and key in self.encoders:
+                value = self.encoders[key](value)
+            changes_data[key] = value
+
+        return changes_data
+
+    def decode_changes(
+        self, changes_data: dict[str, Any]
+    ) -> dict[str, Any]:
+        changes = dict()
+        for key, value in changes_data.items():
+            if value is not None and key in self.decoders:
+                value = self.decoders[key](value)
+            changes[key] = value
+
+        return changes
+
+    def decode_filter(self, filter_data: dict[str, Any]) -> dict[str, Any]:
+        if filter_data is None:
+            return None
+
+        schema = self.Type.schema()
+        filter = dict()
+        for key, condition in filter_data.items():
+            if schema[key] is datetime:
+                if is_predicate(condition):
+                    condition = dict(
+                        (operator, self._decode_operand(operand))
+                        for operator, operand in condition.items()
+                    )
+                else:
+                    condition = self._decode_operand(condition)
+
+            filter[key] = condition
+
+        return filter
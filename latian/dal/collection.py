@@ -0,0 +1,266 @@
+'''
+In-memory collections of models for storage backends that hold their data
+in memory, together with the indexes and materialised aggregates the model
+declares.
+'''
+import sys
+from dataclasses import replace
+from typing import Callable, Sequence, Type, Any, Iterable
+
+from ..model import Model
+from .index import Index
+from .aggregate import SumAggregate
+from .query import matches, sort_models
+
+# Models sampled when estimating the memory a collection holds.
+SIZE_SAMPLE = 64
+# Bytes per reference in lists and index buckets.
+REFERENCE_SIZE = 8
+# Approximate bytes per materialised aggregate group.
+AGGREGATE_ENTRY_SIZE = 160
+
+class Collection:
+    Type: Type[Model]
+    models: list[Model]
+    indexes: list[Index]
+    aggregates: list[SumAggregate]
+
+    def __init__(self, Type: Type[Model]):
+        self.Type = Type
+        self.models = list()
+        self.indexes = list(
+            Index(Type, fields) for fields in Type.indexes()
+        )
+        self.aggregates = list()
+        for field, groups in Type.aggregates().items():
+            for fields in groups:
+                self.aggregates.append(
+                    SumAggregate(Type, field, fields)
+                )
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    def __iter__(self):
+        return iter(self.models)
+
+    def _rebuild(self, aggregates: bool = True):
+        for index in self.indexes:
+            index.rebuild(self.models)
+        if aggregates:
+            for aggregate in self.aggregates:
+                aggregate.rebuild(self.models)
+
+    def load(self, models: Iterable[Model], aggregate_data: list = None):
+        '''
+        Replace the contents of the collection, reusing previously stored
+        aggregates when they are supplied.
+        '''
+        self.models = list(models)
+
+        reuse = (
+            aggregate_data is not None and \
+            len(aggregate_data) == len(self.aggregates)
+        )
+        if reuse:
+            for aggregate, sums in zip(self.aggregates, aggregate_data):
+                aggregate.hydrate(sums)
+
+        self._rebuild(aggregates=not reuse)
+
+    def snapshot(self) -> 'Collection':
+        '''
+        A copy of the contents and aggregates, without indexes, that can be
+        serialised off the event loop while this collection keeps changing.
+        '''
+        copy = Collection.__new__(Collection)
+        copy.Type = self.Type
+        copy.models = list(self.models)
+        copy.indexes = list()
+        copy.aggregates = list(
+            aggregate.copy() for aggregate in self.aggregates
+        )
+
+        return copy
+
+    def dehydrate_aggregates(self) -> list:
+        return list(
+            aggregate.dehydrate() for aggregate in self.aggregates
+        )
+
+    def _index_size(self) -> int:
+        size = 0
+        for index in self.indexes:
+            for bucket in index.buckets.values():
+                size += len(bucket)*REFERENCE_SIZE
+        for aggregate in self.aggregates:
+            size += len(aggregate.sums)*AGGREGATE_ENTRY_SIZE
+
+        return size
+
+    def estimate_size(self) -> int:
+        '''
+        An estimate of the memory held by the collection, sizing models
+        from a sample of them.
+        '''
+        count = len(self.models)
+        if not count:
+            return self._index_size()
+
+        fields = tuple(self.Type.schema().keys())
+        sample = self.models[:SIZE_SAMPLE]
+        sample_size = 0
+        for model in sample:
+            sample_size += sys.getsizeof(model) + REFERENCE_SIZE
+            for field in fields:
+                sample_size += sys.getsizeof(getattr(model, field))
+
+        return count*sample_size//len(sample) + self._index_size()
+
+    def _lookup(self, filter: dict[str, Any]) -> list[Model]:
+        # Narrow to the smallest bucket of any index the filter covers.
+        result = self.models
+        for index in self.indexes:
+            if not index.covers(filter):
+                continue
+
+            bucket = index.lookup(filter)
+            if len(bucket) < len(result):
+                result = bucket
+
+        return result
+
+    def _filter(
+        self, models: list[Model], filter: dict[str, Any]
+    ) -> list[Model]:
+        result = list()
+        for model in models:
+            if matches(model, filter):
+                result.append(model)
+
+        return result
+
+    def append(self, model: Model):
+        self.models.append(model)
+        for index in self.indexes:
+            index.add(model)
+        for aggregate in self.aggregates:
+            aggregate.add(model)
+
+    def extend(self, models: Iterable[Model]):
+        for model in models:
+            self.append(model)
+
+    def delete(self, filter: dict[str, Any] = None) -> int:
+        '''Delete the models matching `filter`, returning how many.'''
+        count = len(self.models)
+        if not filter:
+            self.models = list()
+        else:
+            # Models compare by value, so match them by identity.
+            delete = set(map(id, self._filter(self._lookup(filter), filter)))
+            if not delete:
+                return 0
+
+            self.models = list(
+                model for model in self.models if id(model) not in delete
+            )
+
+        self._rebuild()
+        return count - len(self.models)
+
+    def update(
+        self, filter: dict[str, Any], changes: dict[str, Any]
+    ) -> int:
+        '''
+        Replace the models matching `filter` with copies that have
+        `changes` applied, returning how many. Models already returned
+        by queries are left as they were.
+        '''
+        update = set(map(id, self.query(filter)))
+        if not update:
+            return 0
+
+        for k, model in enumerate(self.models):
+            if id(model) in update:
+                self.models[k] = replace(model, **changes)
+
+        self._rebuild()
+        return len(update)
+
+    def _ordered_lookup(
+        self,
+        filter: dict[str, Any],
+        order_by: str,
+        limit: int,
+        select: Callable[[Sequence], list]
+    ) -> list:
+        '''
+        Answer a limited query ordered on a `datetime` field indexed on
+        its own by walking the days of the index in order until the limit
+        is met, or return `None` if there is no such index. `select`
+        returns the matching items of a bucket in order.
+        '''
+        field = order_by.lstrip('-')
+        for index in self.indexes:
+            if index.fields != (field,) or not index.bucketed[0]:
+                continue
+
+            days = index.ordered_days(filter.get(field) if filter else None)
+            if days is None:
+                return None
+            if order_by.startswith('-'):
+                days = reversed(days)
+
+            result = list()
+            for day in days:
+                bucket = index.buckets.get((day,))
+                if bucket:
+                    result.extend(select(bucket))
+                if len(result) >= limit:
+                    break
+
+            return result[:limit]
+
+        return None
+
+    def query(
+        self,
+        filter: dict[str, Any] = None,
+        order_by: str = None,
+        limit: int = None
+    ) -> list[Model]:
+        if order_by and limit is not None:
+            result = self._ordered_lookup(
+                filter, order_by, limit,
+                lambda bucket: sort_models(
+                    self._filter(bucket, filter) if filter else bucket,
+                    order_by
+                )
+            )
+            if result is not None:
+                return result
+
+        result = self.models
+        if filter:
+            result = self._filter(self._lookup(filter), filter)
+        if order_by:
+            result = sort_models(result, order_by)
+        if limit is not None:
+            result = result[:limit]
+
+        return result
+
+    def aggregate(
+        self, field: str, filter: dict[str, Any] = None
+    ) -> int:
+        filter = filter or dict()
+        for aggregate in self.aggregates:
+            if aggregate.field == field and aggregate.covers(filter):
+                return aggregate.lookup(filter)
+
+        total = 0
+        for model in self.query(filter):
+            total += getattr(model, field)
+
+        return total
@@ -0,0 +1,475 @@
+'''
+A columnar in-memory collection.
+
+Each field is held in an `array`: integers directly, timestamps as epoch
+seconds and strings as codes into a per-field dictionary. Indexes hold
+row numbers rather than models, and models are only materialised for the
+rows a query returns, so large collections cost a few bytes per field per
+row and aggregate scans run over the arrays.
+'''
+import sys
+from array import array
+from typing import Callable, Type, Any, Iterable
+from datetime import datetime, date, timedelta
+
+from ..model import Model
+from .query import condition_matches
+from .codec import EPOCH
+from .collection import REFERENCE_SIZE, Collection
+
+EPOCH_DAY = EPOCH.date()
+SECONDS_PER_DAY = 86400
+# Stands in for `None` in integer columns.
+NULL_INT = -2**63
+
+COLUMN_TYPECODES = {
+    int: 'q',
+    bool: 'q',
+    datetime: 'd',
+    str: 'L'
+}
+
+class StringDictionary:
+    '''Dictionary encoding for the values of a string column.'''
+    values: list[str]
+    codes: dict[str, int]
+
+    def __init__(self):
+        self.values = list()
+        self.codes = dict()
+
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+
+        return code
+
+    def copy(self) -> 'StringDictionary':
+        copy = StringDictionary()
+        copy.values = list(self.values)
+        copy.codes = dict(self.codes)
+
+        return copy
+
+class ColumnarCollection(Collection):
+    fields: tuple[str, ...]
+    kinds: tuple[type, ...]
+    columns: dict[str, array]
+    dictionaries: dict[str, StringDictionary]
+
+    @classmethod
+    def supports(cls, Type: Type[Model]) -> bool:
+        for field_type in Type.schema().values():
+            if type(field_type) is list or \
+                    field_type not in COLUMN_TYPECODES:
+                return False
+
+        return True
+
+    def __init__(self, Type: Type[Model]):
+        super().__init__(Type)
+
+        schema = Type.schema()
+        self.fields = tuple(schema.keys())
+        self.kinds = tuple(schema.values())
+        for index in self.indexes:
+            index.bucket_factory = lambda: array('q')
+
+        self._clear_columns()
+
+    @classmethod
+    def encoded(
+        cls, Type: Type[Model], models: Iterable[Model]
+    ) -> 'ColumnarCollection':
+        '''Encode models into columns without building indexes.'''
+        collection = cls(Type)
+        for model in models:
+            collection._append_row(model)
+
+        return collection
+
+    def _clear_columns(self):
+        self.columns = dict()
+        self.dictionaries = dict()
+        for field, kind in zip(self.fields, self.kinds):
+            self.columns[field] = array(COLUMN_TYPECODES[kind])
+            if kind is str:
+                self.dictionaries[field] = StringDictionary()
+
+    def snapshot(self) -> 'ColumnarCollection':
+        copy = ColumnarCollection.__new__(ColumnarCollection)
+        copy.Type = self.Type
+        copy.models = list()
+        copy.fields = self.fields
+        copy.kinds = self.kinds
+        copy.indexes = list()
+        copy.aggregates = list(
+            aggregate.copy() for aggregate in self.aggregates
+        )
+        copy.dictionaries = dict(
+            (field, dictionary.copy())
+            for field, dictionary in self.dictionaries.items()
+        )
+        copy.columns = dict()
+        for field, column in self.columns.items():
+            # Mapped columns copy their own in-memory part.
+            copy_column = getattr(column, 'copy', None)
+            copy.columns[field] = (
+                copy_column() if copy_column else column[:]
+            )
+
+        return copy
+
+    def __len__(self) -> int:
+        return len(self.columns[self.fields[0]])
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self._materialise(row)
+
+    def estimate_size(self) -> int:
+        size = self._index_size()
+        for column in self.columns.values():
+            # Only the tail of a mapped column is held in memory.
+            resident = getattr(column, 'tail', column)
+            size += len(resident)*resident.itemsize
+        for dictionary in self.dictionaries.values():
+            for value in dictionary.values:
+                size += sys.getsizeof(value) + 2*REFERENCE_SIZE
+
+        return size
+
+    # Encoding.
+    def _encode(self, field: str, kind: type, value: Any) -> Any:
+        if kind is str:
+            return self.dictionaries[field].encode(value)
+        if kind is datetime:
+            if value is None:
+                return float('nan')
+            return (value - EPOCH).total_seconds()
+        if value is None:
+            return NULL_INT
+
+        return int(value)
+
+    def _decode(self, field: str, kind: type, raw: Any) -> Any:
+        if kind is str:
+            return self.dictionaries[field].values[raw]
+        if kind is datetime:
+            if raw != raw:
+                return None
+            return EPOCH + timedelta(seconds=raw)
+        if raw == NULL_INT:
+            return None
+        if kind is bool:
+            return bool(raw)
+
+        return raw
+
+    def _decoder(self, field: str, key: bool = False) -> Callable:
+        '''
+        Decode raw values of a field as `_decode` does, resolved once for
+        a loop over rows. With `key`, timestamps decode to their day, as
+        indexes key them.
+        '''
+        kind = self.kinds[self.fields.index(field)]
+        if kind is str:
+            return self.dictionaries[field].values.__getitem__
+        if kind is datetime and key:
+            def decode(raw: float) -> date:
+                if raw != raw:
+                    return None
+                return EPOCH_DAY + timedelta(
+                    days=int(raw//SECONDS_PER_DAY)
+                )
+            return decode
+        if kind is datetime:
+            def decode(raw: float) -> datetime:
+                if raw != raw:
+                    return None
+                return EPOCH + timedelta(seconds=raw)
+            return decode
+        if kind is bool:
+            return lambda raw: None if raw == NULL_INT else bool(raw)
+
+        return lambda raw: None if raw == NULL_INT else raw
+
+    def _key_readers(self) -> dict[str, tuple[Any, Callable]]:
+        '''The column and key decoder of each field indexes group by.'''
+        fields = set()
+        for group in self.indexes + self.aggregates:
+            fields.update(group.fields)
+
+        return dict(
+            (field, (self.columns[field], self._decoder(field, True)))
+            for field in fields
+        )
+
+    def _materialise(self, row: int) -> Model:
+        return self.Type(*(
+            self._decode(field, kind, self.columns[field][row])
+            for field, kind in zip(self.fields, self.kinds)
+        ))
+
+    # Maintenance.
+    def _append_row(self, model: Model):
+        for field, kind in zip(self.fields, self.kinds):
+            self.columns[field].append(
+                self._encode(field, kind, getattr(model, field))
+            )
+
+    def _index_row(
+        self,
+        row: int,
+        indexes: bool,
+        aggregates: bool,
+        readers: dict[str, tuple[Any, Callable]] = None
+    ):
+        '''
+        Add a row to indexes and aggregates, reading its values through
+        `readers` from `_key_readers` when indexing many rows.
+        '''
+        readers = readers or self._key_readers()
+        values = dict()
+        def value_of(field: str) -> Any:
+            if field not in values:
+                column, decode = readers[field]
+                values[field] = decode(column[row])
+            return values[field]
+
+        if indexes:
+            for index in self.indexes:
+                index.add_values(
+                    tuple(value_of(field) for field in index.fields), row
+                )
+        if aggregates:
+            for aggregate in self.aggregates:
+                amount = self.columns[aggregate.field][row]
+                if amount == NULL_INT:
+                    continue
+
+                aggregate.add_values(
+                    tuple(value_of(field) for field in aggregate.fields),
+                    amount
+                )
+
+    def _rebuild(self, aggregates: bool = True):
+        for index in self.indexes:
+            index.clear()
+        if aggregates:
+            for aggregate in self.aggregates:
+                aggregate.clear()
+
+        readers = self._key_readers()
+        for row in range(len(self)):
+            self._index_row(row, True, aggregates, readers)
+
+    def load(self, models: Iterable[Model], aggregate_data: list = None):
+        self._clear_columns()
+        for model in models:
+            self._append_row(model)
+
+        reuse = (
+            aggregate_data is not None and \
+            len(aggregate_data) == len(self.aggregates)
+        )
+        if reuse:
+            for aggregate, sums in zip(self.aggregates, aggregate_data):
+                aggregate.hydrate(sums)
+
+        self._rebuild(aggregates=not reuse)
+
+    def append(self, model: Model):
+        self._append_row(model)
+        self._index_row(len(self) - 1, True, True)
+
+    # Queries.
+    def _rows(self, filter: dict[str, Any]) -> Iterable[int]:
+        rows = range(len(self))
+        if not filter:
+            return rows
+
+        # Narrow to the smallest bucket of any index the filter covers.
+        for index in self.indexes:
+            if not index.covers(filter):
+                continue
+
+            bucket = index.lookup(filter)
+            if len(bucket) < len(rows):
+                rows = bucket
+
+        return self._filter_rows(rows, filter)
+
+    def _filter_rows(
+        self, rows: Iterable[int], filter: dict[str, Any]
+    ) -> list[int]:
+        result = list()
+        conditions = list(
+            (self.columns[field], self._decoder(field), condition)
+            for field, condition in filter.items()
+        )
+        for row in rows:
+            for column, decode, condition in conditions:
+                if not condition_matches(decode(column[row]), condition):
+                    break
+            else:
+                result.append(row)
+
+        return result
+
+    def select(self, filter: dict[str, Any] = None) -> 'ColumnarCollection':
+        '''
+        Copy the rows matching `filter` into plain arrays, as a collection
+        sharing this one's dictionaries but without indexes or aggregates,
+        for scans that outlive later changes to this one.
+        '''
+        rows = self._rows(filter) if filter else None
+
+        copy = ColumnarCollection.__new__(ColumnarCollection)
+        copy.Type = self.Type
+        copy.models = list()
+        copy.fields = self.fields
+        copy.kinds = self.kinds
+        copy.indexes = list()
+        copy.aggregates = list()
+        copy.dictionaries = self.dictionaries
+        copy.columns = dict()
+        for field, column in self.columns.items():
+            if rows is not None:
+                column = array(
+                    column.typecode, (column[row] for row in rows)
+                )
+            elif isinstance(column, array):
+                column = column[:]
+            else:
+                column = array(column.typecode, column)
+            copy.columns[field] = column
+
+        return copy
+
+    def extend_columns(self, other: 'ColumnarCollection'):
+        '''
+        Append the rows of another collection of the same type, re-encoding
+        its strings, without indexing them.
+        '''
+        for field, column in other.columns.items():
+            if field in self.dictionaries:
+                dictionary = self.dictionaries[field]
+                codes = list(
+                    dictionary.encode(value)
+                    for value in other.dictionaries[field].values
+                )
+                column = (codes[code] for code in column)
+
+            self.columns[field].extend(column)
+
+    def _own_columns(self):
+        '''Copy columns held elsewhere, such as mapped ones, into arrays.'''
+        for field, column in self.columns.items():
+            if not isinstance(column, array):
+                self.columns[field] = array(column.typecode, column)
+
+    def delete(self, filter: dict[str, Any] = None) -> int:
+        count = len(self)
+        if not filter:
+            self._clear_columns()
+            self._rebuild()
+            return count
+
+        delete = set(self._rows(filter))
+        if not delete:
+            return 0
+
+        retain = list(row for row in range(len(self)) if row not in delete)
+        for field in self.fields:
+            column = self.columns[field]
+            self.columns[field] = array(
+                column.typecode, (column[row] for row in retain)
+            )
+
+        self._rebuild()
+        return len(delete)
+
+    def update(
+        self, filter: dict[str, Any], changes: dict[str, Any]
+    ) -> int:
+        rows = list(self._rows(filter))
+        if not rows:
+            return 0
+
+        self._own_columns()
+        for field, value in changes.items():
+            kind = self.kinds[self.fields.index(field)]
+            raw = self._encode(field, kind, value)
+
+            column = self.columns[field]
+            for row in rows:
+                column[row] = raw
+
+        self._rebuild()
+        return len(rows)
+
+    def query(
+        self,
+        filter: dict[str, Any] = None,
+        order_by: str = None,
+        limit: int = None
+    ) -> list[Model]:
+        key = None
+        if order_by:
+            field = order_by.lstrip('-')
+            column = self.columns[field]
+            key = column.__getitem__
+            if field in self.dictionaries:
+                values = self.dictionaries[field].values
+                key = lambda row: values[column[row]]
+
+        rows = None
+        if order_by and limit is not None:
+            rows = self._ordered_lookup(
+                filter, order_by, limit,
+                lambda bucket: sorted(
+                    self._filter_rows(bucket, filter) if filter else bucket,
+                    key=key, reverse=order_by.startswith('-')
+                )
+            )
+        if rows is None:
+            rows = self._rows(filter)
+            if order_by:
+                rows = sorted(
+                    rows, key=key, reverse=order_by.startswith('-')
+                )
+            if limit is not None:
+                rows = rows[:limit]
+
+        return list(self._materialise(row) for row in rows)
+
+    def aggregate(
+        self, field: str, filter: dict[str, Any] = None
+    ) -> int:
+        filter = filter or dict()
+        for aggregate in self.aggregates:
+            if aggregate.field == field and aggregate.covers(filter):
+                return aggregate.lookup(filter)
+
+        column = self.columns[field]
+        rows = self._rows(filter) if filter else range(len(self))
+        # `None` values are stored as `NULL_INT` and add nothing.
+        return sum(
+            column[row] for row in rows if column[row] != NULL_INT
+        )
+
+def as_columns(
+    collection: Collection, filter: dict[str, Any] = None
+) -> ColumnarCollection:
+    '''The models of any collection matching `filter`, in columns.'''
+    # Columnar and partitioned collections select columns themselves.
+    select = getattr(collection, 'select', None)
+    if select:
+        return select(filter)
+
+    return ColumnarCollection.encoded(
+        collection.Type, collection.query(filter)
+    )
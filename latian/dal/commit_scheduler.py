@@ -0,0 +1,91 @@
+'''
+Abstract base and implementation registry of commit schedulers, which
+decide when `DAL.commit` calls reach the storage backend.
+
+Modes trade a bounded window of unpersisted mutations for fewer writes:
+
+`strict` persists on every commit.
+`batched` coalesces commits until a time window passes or enough
+mutations accumulate.
+`on-exit` persists only when the DAL disconnects.
+'''
+import sys
+import asyncio
+from typing import Type
+
+from ..cli import CLIArgs
+from ..common import Implementations
+from .storage_backend import StorageBackend
+
+class CommitScheduler:
+    backend: StorageBackend
+    args: CLIArgs
+    unpersisted: int
+
+    def __init__(self, backend: StorageBackend, args: CLIArgs):
+        self.backend = backend
+        self.args = args
+        self.unpersisted = 0
+
+    def mutated(self, count: int = 1):
+        self.unpersisted += count
+
+    async def commit(self):
+        raise NotImplementedError()
+
+    async def flush(self):
+        '''Persist any unpersisted mutations now.'''
+        if not self.unpersisted:
+            return
+
+        self.unpersisted = 0
+        await self.backend.flush()
+
+commit_modes = Implementations[Type[CommitScheduler]]()
+
+@commit_modes.implementation('strict')
+class StrictCommitScheduler(CommitScheduler):
+
+    async def commit(self):
+        self.unpersisted = 0
+        await self.backend.commit()
+
+@commit_modes.implementation('batched')
+class BatchedCommitScheduler(CommitScheduler):
+    window_seconds: float
+    batch_size: int
+    timer: asyncio.Task
+
+    def __init__(self, backend: StorageBackend, args: CLIArgs):
+        super().__init__(backend, args)
+        self.window_seconds = args.get('commit_window_ms')/1000
+        self.batch_size = args.get('commit_batch')
+        self.timer = None
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window_seconds)
+
+        self.timer = None
+        try:
+            await self.flush()
+        except Exception as ex:
+            print('batched commit failed: %s'%ex, file=sys.stderr)
+
+    async def commit(self):
+        if self.unpersisted >= self.batch_size:
+            await self.flush()
+        elif self.unpersisted and not self.timer:
+            self.timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self):
+        if self.timer and self.timer is not asyncio.current_task():
+            self.timer.cancel()
+            self.timer = None
+
+        await super().flush()
+
+@commit_modes.implementation('on-exit')
+class OnExitCommitScheduler(CommitScheduler):
+
+    async def commit(self):
+        pass
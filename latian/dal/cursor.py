@@ -0,0 +1,69 @@
+'''
+Keyset cursors over the collections of storage backends.
+
+A cursor reads the models of a collection in order of a field a page at a
+time. Each page resumes from the value of that field last read, skipping
+the models with that value already read, so models tying on it are
+neither repeated nor lost across pages as long as the backend orders ties
+consistently.
+'''
+from typing import AsyncIterator, Type, Any
+
+from .query import is_predicate
+from .storage_backend import T, StorageBackend
+
+async def iterate(
+    backend: StorageBackend,
+    Target: Type[T],
+    order_by: str,
+    filter: dict[str, Any] = None,
+    page_size: int = 1000
+) -> AsyncIterator[T]:
+    '''
+    Iterate over the models of `Target` matching `filter` in order of the
+    `order_by` field, descending when it is prefixed with `-`, querying
+    `page_size` of them at a time.
+    '''
+    field = order_by.lstrip('-')
+    # The bound a page resumes from replaces those on the same side, as
+    # the model it was read from already satisfied them.
+    resume, replaced = 'gte', ('gte', 'gt')
+    if order_by.startswith('-'):
+        resume, replaced = 'lte', ('lte', 'lt')
+
+    filter = filter or dict()
+    # An exact condition on the field leaves nothing to resume from.
+    resumable = field not in filter or is_predicate(filter[field])
+
+    cursor, seen = None, 0
+    while True:
+        page_filter = dict(filter)
+        if resumable and cursor is not None:
+            condition = dict(
+                (operator, operand)
+                for operator, operand in (filter.get(field) or dict()).items()
+                if operator not in replaced
+            )
+            condition[resume] = cursor
+            page_filter[field] = condition
+
+        page = await backend.query(
+            Target,
+            filter=page_filter or None,
+            order_by=order_by,
+            limit=page_size + seen
+        )
+        for model in page[seen:]:
+            yield model
+
+        if len(page) < page_size + seen:
+            return
+
+        if resumable:
+            cursor, seen = getattr(page[-1], field), 0
+            for model in reversed(page):
+                if getattr(model, field) != cursor:
+                    break
+                seen += 1
+        else:
+            seen = len(page)
@@ -1,97 +1,279 @@
 '''
 The domain-aware Data Access Layer for application logic.
 '''
+import os
 from datetime import date
+from typing import Callable, Awaitable, AsyncIterator, Hashable, Type, Any
 
-from ..model import Event, Config, Exercise, SessionPlan
+from ..model import Model, Event, Config, Exercise, SessionPlan
+from .columnar import ColumnarCollection
 from .storage_backend import StorageBackend
+from .cursor import iterate
+from .commit_scheduler import CommitScheduler, commit_modes
+from .query_cache import QueryCache, query_caches
 
 class DAL:
     _backend: StorageBackend
+    _scheduler: CommitScheduler
+    # The reads cached for the connected user, if caching is enabled.
+    _cache: QueryCache
+    _cache_key: Hashable
 
-    def __init__(self, backend: StorageBackend):
+    def __init__(
+        self, backend: StorageBackend, scheduler: CommitScheduler = None
+    ):
         self._backend = backend
+        self._scheduler = scheduler or commit_modes.get('strict')(
+            backend, backend.args
+        )
+        self._cache = None
+        self._cache_key = None
 
     async def connect(self, user: str):
         await self._backend.connect(user)
 
+        if not self._backend.args.get('no_query_cache'):
+            self._cache_key = (
+                self._backend.__class__,
+                os.path.abspath(self._backend.args.get('storage_dest')),
+                user
+            )
+            self._cache = query_caches.acquire(self._cache_key)
+
     async def disconnect(self):
-        await self._backend.disconnect()
+        try:
+            await self._scheduler.flush()
+        finally:
+            if self._cache is not None:
+                self._cache = None
+                query_caches.release(self._cache_key)
+
+            await self._backend.disconnect()
+
+    def cache_stats(self) -> dict[str, int]:
+        '''
+        The hit, miss and invalidation counters of the connected user's
+        query cache, or `None` if caching is disabled.
+        '''
+        if self._cache is None:
+            return None
+
+        return self._cache.stats()
+
+    async def _cached(
+        self,
+        Target: Type[Model],
+        query: str,
+        filter: dict[str, Any],
+        read: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        '''Read through the query cache, copying cached lists.'''
+        if self._cache is None:
+            return await read()
+
+        self._cache.sync(self._backend.revision())
+
+        collection_name = Target.collection_name()
+        entry = self._cache.get(collection_name, query, filter)
+        if entry is not None:
+            result = entry.result
+        else:
+            generation = self._cache.generation(collection_name)
+            result = await read()
+            self._cache.put(
+                collection_name, query, filter, result, generation
+            )
+
+        if isinstance(result, list):
+            return list(result)
+        return result
+
+    def _created(self, models: list[Model]):
+        if self._cache is not None and models:
+            self._cache.created(models[0].__class__.collection_name(), models)
+
+    def _changed(
+        self,
+        Target: Type[Model],
+        filter: dict[str, Any],
+        changes: dict[str, Any] = None
+    ):
+        if self._cache is not None:
+            self._cache.changed(Target.collection_name(), filter, changes)
 
     async def commit(self):
-        await self._backend.commit()
+        await self._scheduler.commit()
+
+    async def maintain(self) -> dict:
+        return await self._backend.maintain()
 
     # Getters.
     async def get_config(self) -> Config:
-        configs = await self._backend.query(Config)
+        configs = await self._cached(
+            Config, 'query', None, lambda: self._backend.query(Config)
+        )
         if not len(configs):
             return None
         
         return configs[0]
 
-    async def get_events(self, day: date = None) -> list[Event]:
-        # TODO: Use query filter.
-        events = await self._backend.query(Event)
-
+    def _events_filter(
+        self, day: date = None, start: date = None, end: date = None
+    ) -> dict:
         if day:
-            day_events = list()
-            for event in events:
-                if event.when.date() == day:
-                    day_events.append(event)
-            return day_events
-        
-        return events
+            return { 'when': day }
+        if start or end:
+            window = dict()
+            if start:
+                window['gte'] = start
+            if end:
+                window['lt'] = end
+            return { 'when': window }
+
+        return None
+
+    async def get_events(
+        self, day: date = None, start: date = None, end: date = None
+    ) -> list[Event]:
+        '''
+        Return events, either on `day` or in the window of days from
+        `start` up to but excluding `end`.
+        '''
+        return await self._backend.query(
+            Event, filter=self._events_filter(day, start, end)
+        )
     
+    async def iter_events(
+        self,
+        start: date = None,
+        end: date = None,
+        order: str = 'asc',
+        page_size: int = 1000
+    ) -> AsyncIterator[Event]:
+        '''
+        Iterate over the events in the window of days from `start` up to
+        but excluding `end`, oldest first, or newest first when `order` is
+        `desc`, reading `page_size` of them at a time. Without a window,
+        undated events are included first, or last when newest first.
+        '''
+        if order not in ('asc', 'desc'):
+            raise ValueError('unknown order %s'%order)
+
+        # Backends don't order undated events alike, and the cursor can't
+        # resume from one, so they are read apart from the dated ones.
+        filter = self._events_filter(None, start, end)
+        undated = list()
+        if filter is None:
+            undated = await self._backend.query(Event, { 'when': None })
+            filter = { 'when': { 'gte': date.min } }
+
+        if order == 'asc':
+            for event in undated:
+                yield event
+        async for event in iterate(
+            self._backend, Event, 'when' if order == 'asc' else '-when',
+            filter, page_size
+        ):
+            yield event
+        if order == 'desc':
+            for event in undated:
+                yield event
+
+    async def get_event_columns(
+        self, day: date = None, start: date = None, end: date = None
+    ) -> ColumnarCollection:
+        '''Return events, selected as by `get_events`, in columns.'''
+        return await self._backend.columns(
+            Event, self._events_filter(day, start, end)
+        )
+
     async def get_exercises(self, type: str) -> list[Exercise]:
-        return await self._backend.query(
-            Exercise,
-            filter={ 'type': type }
+        filter = { 'type': type }
+
+        return await self._cached(
+            Exercise, 'query', filter,
+            lambda: self._backend.query(Exercise, filter=filter)
         )
     
     async def get_session_plans(self) -> list[SessionPlan]:
-        return await self._backend.query(SessionPlan)
-
-    async def get_exercise_total(
-        self, exercise: Exercise, day: date = None
-    ):
-        events = await self._backend.query(
-            Event,
-            filter={
-                'type': exercise.type,
-                'exercise': exercise.name
-            }
+        return await self._cached(
+            SessionPlan, 'query', None,
+            lambda: self._backend.query(SessionPlan)
         )
-        total = 0
-        for event in events:
-            # TODO: Use query filter.
-            if day and event.when.date() != day:
-                continue
 
-            total += event.value
+    async def get_exercise_total(
+        self,
+        exercise: Exercise,
+        day: date = None,
+        start: date = None,
+        end: date = None
+    ) -> int:
+        '''
+        Return the total of an exercise's events, selected as by
+        `get_events`. Any window of days is answered from materialised
+        running totals, at the same cost whatever its width.
+        '''
+        filter = {
+            'type': exercise.type,
+            'exercise': exercise.name
+        }
+        window = self._events_filter(day, start, end)
+        if window:
+            filter.update(window)
 
-        return total
+        return await self._cached(
+            Event, 'sum:value', filter,
+            lambda: self._backend.aggregate(Event, 'value', filter=filter)
+        )
 
     # Mutations.
     async def create_event(self, event: Event):
         await self._backend.create(event)
+        self._created([event])
+        self._scheduler.mutated()
+
+    async def create_events(self, events: list[Event]):
+        await self._backend.create_many(events)
+        self._created(events)
+        self._scheduler.mutated(len(events))
+
+    async def delete_events(
+        self, day: date = None, start: date = None, end: date = None
+    ):
+        '''Delete events, selected as by `get_events`.'''
+        filter = self._events_filter(day, start, end)
+
+        await self._backend.delete(Event, filter)
+        self._changed(Event, filter)
+        self._scheduler.mutated()
 
     async def create_exercise(self, exercise: Exercise):
         await self._backend.create(exercise)
+        self._created([exercise])
+        self._scheduler.mutated()
 
     async def create_session_plan(self, plan: SessionPlan):
         await self._backend.create(plan)
+        self._created([plan])
+        self._scheduler.mutated()
 
     async def update_session_plan(self, plan: SessionPlan):
-        await self._backend.delete(
-            SessionPlan, { 'name': plan.name }
-        )
-        await self._backend.create(plan)
+        filter = { 'name': plan.name }
+        changes = { 'exercises': plan.exercises }
+
+        await self._backend.update(SessionPlan, filter, changes)
+        self._changed(SessionPlan, filter, changes)
+        self._scheduler.mutated()
 
     async def delete_session_plan(self, plan: SessionPlan):
-        await self._backend.delete(
-            SessionPlan, { 'name': plan.name }
-        )
+        filter = { 'name': plan.name }
+
+        await self._backend.delete(SessionPlan, filter)
+        self._changed(SessionPlan, filter)
+        self._scheduler.mutated()
 
     async def set_config(self, config: Config):
         await self._backend.delete(Config)
         await self._backend.create(config)
+        self._changed(Config, None)
+        self._scheduler.mutated()
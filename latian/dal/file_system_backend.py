@@ -1,177 +1,1130 @@
 '''
 Storage backend implementation using a JSON file.
+
+When journaling is enabled, mutations since the last commit are appended
+to a per-user JSONL journal instead of rewriting the whole file. The base
+snapshot is only rewritten when the journal is compacted.
+
+Collections are held in memory with the indexes and aggregates each model
+declares, optionally in columnar form. Aggregates are stored in the
+snapshot so they need not be recomputed on load.
+
+JSON snapshots are written in the row format of `Codec`, without
+whitespace and after a header line holding the format version and a
+CRC-32 of the body; files in older formats are read and rewritten on the
+next commit.
+Binary snapshots are mapped into memory and decode time series records
+lazily, as described in `binary_snapshot`.
+
+With partitioning enabled, collections of models declaring a partition
+field are stored as one file per month, referenced from the snapshot by a
+manifest holding their aggregates. Only the current month is loaded on
+connect; see `partition`.
+
+Commits copy the state to persist on the event loop and serialise it on a
+worker thread. Snapshots are written aside and moved into place, so an
+interrupted write never leaves a truncated file. The snapshot replaced is
+kept as the newest of a bounded number of previous snapshots, which are
+read instead if the current one is corrupt.
+
+The loaded state of each user is held in the process-wide `user_cache`,
+so concurrent sessions of a user share collections and pending writes,
+and a returning user is served without reading their files again unless
+another process has written them since.
+
+Commits from different processes are serialised by a per-user lock file.
+If a user's files changed since they were last read, pending operations
+are rebased onto the newer data: creates and deletes are replayed on it,
+dropping creates that collide with a model's unique fields.
+
+`maintain` walks the storage directory on worker threads, verifying
+checksums, recovering corrupt snapshots, pruning files nothing refers to
+and rewriting the files of idle users in the current format.
 '''
 import io
+import os
+import glob
 import json
+import time
+import zlib
+import shutil
+import struct
+import asyncio
 import os.path
-from typing import Union, Type, Any
+import itertools
 from datetime import datetime
+from contextlib import contextmanager
+from typing import Callable, Iterable, Union, Type, Any, BinaryIO
 
 from ..cli import CLIArgs
 from ..model import Model
+from .codec import Codec
+from .collection import Collection
+from .columnar import ColumnarCollection, as_columns
+from .partition import PartitionedCollection, partition_key
+from .binary_snapshot import (
+    BINARY_FORMAT_VERSION, MappedCollection, is_time_series,
+    read_binary_snapshot, write_binary_snapshot, binary_snapshot_version,
+    verify_binary_snapshot
+)
+from .query import validate_filter
 from .storage_backend import T, StorageBackend, storage_backends
+from .user_cache import UserState, user_cache
+
+try:
+    import fcntl
+except ImportError:
+    # Without advisory locks, only writes within a process are serialised.
+    fcntl = None
+
+# Revisions of loaded user data, unique within the process.
+_revisions = itertools.count()
+
+FORMAT_VERSION = 3
+# Errors reading a damaged snapshot.
+CORRUPTION_ERRORS = (ValueError, KeyError, IndexError, struct.error)
+# File extensions by snapshot format.
+SNAPSHOT_FORMATS = {
+    'json': 'json',
+    'binary': 'bin'
+}
+
+class FileUserState(UserState):
+    '''
+    The collections of one user and the writes pending against their
+    files, shared by all of their sessions.
+    '''
+    data: dict[str, Collection]
+    pending: list[tuple[str, str, Any]]
+    # The version of the data: the sequence number of the last persisted
+    # operation.
+    seq: int
+    journal_length: int
+    upgrade: bool
+    # The state of the files when they were last read or written.
+    fingerprint: tuple
+    # Changes whenever the data is replaced by a read of the files.
+    revision: int
+    commit_lock: asyncio.Lock
+
+    def __init__(self):
+        self.data = dict()
+        self.pending = list()
+        self.seq = 0
+        self.journal_length = 0
+        self.upgrade = False
+        self.fingerprint = None
+        self.revision = next(_revisions)
+        self.commit_lock = asyncio.Lock()
+
+    def estimate_size(self) -> int:
+        return sum(
+            collection.estimate_size()
+            for collection in self.data.values()
+        )
 
-DATETIME_FORMAT = '%d/%m/%Y %H:%M'
+    def evictable(self) -> bool:
+        return not self.pending and not self.upgrade
 
 @storage_backends.implementation('file')
 class FileSystemStorageBackend(StorageBackend):
-    data: dict
     user: str
+    state: FileUserState
 
     def __init__(
         self, schema: dict[str, Type[Model]], args: CLIArgs
     ):
         super().__init__(schema, args)
-        self.data = None
         self.user = None
+        self.state = None
+
+    def _snapshot_format(self) -> str:
+        return self.args.get('snapshot_format')
+
+    def _get_file_path(self, format: str = None):
+        return '%s/%s.db.%s'%(
+            self.args.get('storage_dest'),
+            self.user,
+            SNAPSHOT_FORMATS[format or self._snapshot_format()]
+        )
 
-    def _get_file_path(self):
-        return '%s/%s.db.json'%(
+    def _get_journal_path(self):
+        return '%s/%s.journal.jsonl'%(
             self.args.get('storage_dest'),
             self.user
         )
 
-    def _hydrate_model(
-        self, Type: Type[Model], model_data: dict[str, Any]
-    ) -> Model:
-        model = Type()
-        model_schema = Type.schema()
-        for key in model_schema:
-            value = model_data[key]
-            if type(model_schema[key]) is list:
-                inner_type = model_schema[key][0]
-
-                hydrated_value = list()
-                for item in value:
-                    if issubclass(inner_type, Model):
-                        item = self._hydrate_model(
-                            inner_type, item
-                        )
-                    
-                    hydrated_value.append(item)
-                value = hydrated_value
-
-            if model_schema[key] is datetime:
-                value = datetime.strptime(value, DATETIME_FORMAT)
-            
-            setattr(model, key, value)
-
-        return model
-
-    def _dehydrate_model(
-        self, Type: Type[Model], model: Model
+    def _get_lock_path(self):
+        return '%s/%s.lock'%(
+            self.args.get('storage_dest'),
+            self.user
+        )
+
+    def _fingerprint(self) -> tuple:
+        '''Identify the current versions of the files without reading them.'''
+        paths = list(
+            self._get_file_path(format) for format in SNAPSHOT_FORMATS
+        )
+        paths.append(self._get_journal_path())
+
+        fingerprint = list()
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                fingerprint.append(None)
+                continue
+
+            fingerprint.append(
+                (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            )
+
+        return tuple(fingerprint)
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+
+        with io.open(self._get_lock_path(), 'a') as lock_io:
+            fcntl.flock(lock_io.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_io.fileno(), fcntl.LOCK_UN)
+
+    def _encode_journal_record(
+        self, seq: int, op: str, collection_name: str, payload: Any
     ) -> dict[str, Any]:
-        model_data = dict()
-        model_schema = Type.schema()
-        for key in model_schema:
-            value = getattr(model, key)
-            if type(model_schema[key]) is list:
-                inner_type = model_schema[key][0]
-
-                dehydrated_value = list()
-                for item in value:
-                    if issubclass(inner_type, Model):
-                        item = self._dehydrate_model(
-                            inner_type, item
-                        )
-                    
-                    dehydrated_value.append(item)
-                value = dehydrated_value
-            if model_schema[key] is datetime:
-                value = value.strftime(DATETIME_FORMAT)
-
-            model_data[key] = value
-
-        return model_data
-    
-    def _filter(
-        self, models: list[Model], filter: dict[str, Any]
+        codec = Codec.get(self.schema[collection_name])
+
+        record = {
+            'seq': seq,
+            'op': op,
+            'collection': collection_name
+        }
+        if op == 'create':
+            record['row'] = codec.encode(payload)
+        elif op == 'update':
+            filter, changes = payload
+            record['filter'] = codec.encode_filter(filter)
+            record['changes'] = codec.encode_changes(changes)
+        else:
+            record['filter'] = codec.encode_filter(payload)
+
+        return record
+
+    def _replay_journal_record(
+        self, state: FileUserState, record: dict[str, Any]
     ):
-        result = list()
-        for model in models:
-            for key in filter:
-                if getattr(model, key) != filter[key]:
-                    break
+        op = record['op']
+        collection_name = record['collection']
+        codec = Codec.get(self.schema[collection_name])
+
+        payload = None
+        if op == 'create':
+            if 'row' in record:
+                payload = codec.decode(record['row'])
             else:
-                result.append(model)
+                payload = codec.decode_legacy(record['data'])
+        elif op == 'update':
+            payload = (
+                codec.decode_filter(record['filter']),
+                codec.decode_changes(record['changes'])
+            )
+        else:
+            payload = codec.decode_filter(record['filter'])
 
-        return result
+        self._apply(state.data, (op, collection_name, payload))
 
-    async def initialize(self):
-        print('no initialization required')
+    def _create_collection(self, Type: Type[Model]) -> Collection:
+        if self.args.get('columnar') and ColumnarCollection.supports(Type):
+            return ColumnarCollection(Type)
 
-    async def connect(self, user: str) -> bool:
-        self.user = user
+        return Collection(Type)
+
+    def _partition_loader(
+        self, collection_name: str
+    ) -> Callable[[str], Collection]:
+        directory = self.args.get('storage_dest')
+
+        def load(file_name: str) -> Collection:
+            collections = {
+                collection_name: self._create_collection(
+                    self.schema[collection_name]
+                )
+            }
+            self._read_snapshot_file(
+                os.path.join(directory, file_name), collections
+            )
+
+            return collections[collection_name]
+        return load
+
+    def _load_snapshot(self, state: FileUserState):
+        for collection_name, Type in self.schema.items():
+            state.data[collection_name] = self._create_collection(Type)
+
+        # Prefer the configured format, but read a snapshot written in the
+        # other one so switching formats keeps existing data.
+        formats = list(SNAPSHOT_FORMATS)
+        formats.sort(key=lambda format: format != self._snapshot_format())
+        manifests = None
+        for format in formats:
+            manifests = self._read_latest_snapshot(
+                state, self._get_file_path(format)
+            )
+            if manifests is not None:
+                break
+        manifests = manifests or dict()
 
-        file_path = self._get_file_path()
+        current = partition_key(datetime.now())
+        for collection_name, Type in self.schema.items():
+            manifest = manifests.get(collection_name)
+            partition = self.args.get('partition') and Type.partition_by()
+            if manifest is None and not partition:
+                continue
+
+            collection = PartitionedCollection(
+                Type,
+                lambda Type=Type: self._create_collection(Type),
+                self._partition_loader(collection_name)
+            )
+            collection.restore(manifest or dict(), (current,))
+
+            # Move models between the snapshot and partition files when
+            # partitioning was switched on or off.
+            unpartitioned = state.data[collection_name]
+            if not partition:
+                unpartitioned.load(list(unpartitioned) + list(collection))
+                state.upgrade = True
+                continue
+            if len(unpartitioned):
+                for model in unpartitioned:
+                    collection.append(model)
+                state.upgrade = True
+
+            state.data[collection_name] = collection
+
+    def _get_rotated_paths(self, file_path: str) -> list[str]:
+        '''Previous snapshots kept beside `file_path`, newest first.'''
+        rotated = list()
+        for path in glob.glob('%s.*'%glob.escape(file_path)):
+            suffix = path[len(file_path) + 1:]
+            if suffix.isdigit():
+                rotated.append((int(suffix), path))
+        rotated.sort()
+
+        return list(path for _, path in rotated)
+
+    def _read_latest_snapshot(
+        self, state: FileUserState, file_path: str
+    ) -> dict[str, dict]:
+        '''
+        Read the snapshot at `file_path` into a state, falling back to the
+        newest readable previous snapshot if it is corrupt. Return its
+        partition manifests, or `None` if there was none to read. Raise
+        `ValueError` if there was one but no copy of it is readable, so
+        the user's data isn't taken to be empty.
+        '''
+        # Previous snapshots left without a current one belong to a format
+        # no longer in use.
         if not os.path.isfile(file_path):
-            self.data = dict()
-            for collection_name in self.schema:
-                self.data[collection_name] = list()
+            return None
+        paths = [file_path] + self._get_rotated_paths(file_path)
+
+        for path in paths:
+            collections = dict(
+                (collection_name, self._create_collection(Type))
+                for collection_name, Type in self.schema.items()
+            )
+            try:
+                seq, outdated, manifests = self._read_snapshot_file(
+                    path, collections
+                )
+            except CORRUPTION_ERRORS:
+                continue
+
+            state.data.update(collections)
+            state.seq = seq
+            # Rewrite outdated or recovered files on the next commit.
+            state.upgrade = outdated or path != file_path
+            return manifests
+
+        raise ValueError('no readable snapshot: %s'%file_path)
+
+    def _is_binary_path(self, file_path: str) -> bool:
+        '''Whether a snapshot, current or previous, is in binary format.'''
+        base, _, suffix = file_path.rpartition('.')
+        if suffix.isdigit():
+            file_path = base
+
+        return file_path.endswith('.%s'%SNAPSHOT_FORMATS['binary'])
+
+    def _read_snapshot_file(
+        self, file_path: str, collections: dict[str, Collection]
+    ) -> tuple[int, bool, dict[str, dict]]:
+        '''
+        Read a snapshot file into `collections`, returning its journal
+        sequence number, whether it is in an outdated format, and its
+        partition manifests.
+        '''
+        if self._is_binary_path(file_path):
+            return self._read_binary_snapshot(file_path, collections)
+
+        return self._read_json_snapshot(file_path, collections)
+
+    def _read_json_file(self, file_path: str) -> tuple[int, dict]:
+        '''
+        Read a JSON snapshot, returning its format version and contents.
+        Raise `ValueError` if it doesn't match its checksum.
+        '''
+        raw = None
+        with io.open(file_path, 'rb') as file_io:
+            raw = file_io.read()
+
+        # Current snapshots have a header line; older ones are a single
+        # document.
+        header = None
+        newline = raw.find(b'\n')
+        if newline >= 0:
+            try:
+                header = json.loads(raw[:newline])
+            except ValueError:
+                pass
+        if not isinstance(header, dict) or 'checksum' not in header:
+            raw_data = json.loads(raw)
+            return raw_data.get('version', 1), raw_data
+
+        body = raw[newline + 1:]
+        if zlib.crc32(body) != header['checksum']:
+            raise ValueError('checksum mismatch: %s'%file_path)
+
+        return header['version'], json.loads(body)
+
+    def _read_json_snapshot(
+        self, file_path: str, collections: dict[str, Collection]
+    ) -> tuple[int, bool, dict[str, dict]]:
+        version, raw_data = self._read_json_file(file_path)
+
+        collections_data = raw_data
+        if version >= 2:
+            collections_data = raw_data['collections']
+
+        raw_aggregates = raw_data.get('aggregates', dict())
+        for collection_name, collection in collections.items():
+            codec = Codec.get(collection.Type)
+
+            models = None
+            if version >= 2:
+                collection_data = collections_data.get(collection_name)
+                models = codec.decode_collection(
+                    collection_data
+                ) if collection_data else tuple()
+            else:
+                models = map(
+                    codec.decode_legacy,
+                    collections_data.get(collection_name, list())
+                )
+
+            collection.load(models, raw_aggregates.get(collection_name))
 
+        return (
+            raw_data.get('journal_seq', 0),
+            version < FORMAT_VERSION,
+            raw_data.get('partitions', dict())
+        )
+
+    def _read_binary_snapshot(
+        self, file_path: str, collections: dict[str, Collection]
+    ) -> tuple[int, bool, dict[str, dict]]:
+        seq, meta, buffer = read_binary_snapshot(file_path)
+
+        raw_aggregates = meta['aggregates']
+        for collection_name, collection in collections.items():
+            Type = collection.Type
+            aggregate_data = raw_aggregates.get(collection_name)
+
+            if collection_name in meta['records']:
+                collections[collection_name] = MappedCollection(
+                    Type, buffer, meta['records'][collection_name],
+                    aggregate_data
+                )
+                continue
+
+            collection_data = meta['collections'].get(collection_name)
+            models = Codec.get(Type).decode_collection(
+                collection_data
+            ) if collection_data else tuple()
+            collection.load(models, aggregate_data)
+
+        outdated = (
+            binary_snapshot_version(file_path) < BINARY_FORMAT_VERSION
+        )
+        return seq, outdated, meta.get('partitions', dict())
+
+    def _verify_snapshot(self, file_path: str) -> bool:
+        if self._is_binary_path(file_path):
+            return verify_binary_snapshot(file_path)
+
+        try:
+            self._read_json_file(file_path)
+        except (ValueError, OSError):
+            return False
+        return True
+
+    def _load_journal(self, state: FileUserState):
+        journal_path = self._get_journal_path()
+        if not os.path.isfile(journal_path):
             return
 
-        raw_data: dict = None
-        with io.open(file_path, encoding='utf-8') as file_io:
-            raw_data = json.load(file_io)
+        with io.open(journal_path, encoding='utf-8') as journal_io:
+            for line in journal_io:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn trailing write from an interrupted commit.
+                    break
 
-        self.data = dict()
+                state.journal_length += 1
+                # Records already folded into the snapshot by a compaction
+                # that was interrupted before the journal was removed.
+                if record['seq'] <= state.seq:
+                    continue
+
+                self._replay_journal_record(state, record)
+                state.seq = record['seq']
+
+    def _rotate(self, file_path: str, keep: int):
+        '''Keep the current file as the newest of `keep` previous ones.'''
+        for n in range(keep - 1, 0, -1):
+            rotated = '%s.%d'%(file_path, n)
+            if os.path.isfile(rotated):
+                os.replace(rotated, '%s.%d'%(file_path, n + 1))
+
+        newest = '%s.1'%file_path
+        if os.path.isfile(newest):
+            os.remove(newest)
+        try:
+            os.link(file_path, newest)
+        except OSError:
+            shutil.copyfile(file_path, newest)
+
+    def _publish(
+        self,
+        file_path: str,
+        write: Callable[[BinaryIO], None],
+        keep: int = 0
+    ):
+        '''
+        Write a file aside and move it into place, so readers and mapped
+        snapshots never see a partial file. The file replaced is kept as
+        the newest of `keep` previous ones.
+        '''
+        temp_path = '%s.tmp'%file_path
+        with io.open(temp_path, 'wb') as file_io:
+            write(file_io)
+
+            if self.args.get('fsync'):
+                file_io.flush()
+                os.fsync(file_io.fileno())
+        if keep and os.path.isfile(file_path):
+            self._rotate(file_path, keep)
+        os.replace(temp_path, file_path)
+
+    def _write_snapshot_file(
+        self,
+        file_path: str,
+        format: str,
+        seq: int,
+        data: dict[str, Collection],
+        manifests: dict[str, dict] = None,
+        keep: int = 0
+    ):
+        raw_aggregates = dict()
+        for collection_name, collection in data.items():
+            raw_aggregates[collection_name] = (
+                collection.dehydrate_aggregates()
+            )
+
+        collections_data = dict()
+        time_series = dict()
+        for collection_name, collection in data.items():
+            Type = collection.Type
+            if format == 'binary' and is_time_series(Type):
+                if not isinstance(collection, ColumnarCollection):
+                    collection = ColumnarCollection.encoded(Type, collection)
+
+                time_series[collection_name] = collection
+                continue
+
+            collections_data[collection_name] = (
+                Codec.get(Type).encode_collection(collection)
+            )
+
+        def write(file_io: BinaryIO):
+            if format == 'binary':
+                write_binary_snapshot(
+                    file_io, seq, raw_aggregates,
+                    collections_data, time_series, manifests
+                )
+                return
+
+            raw_data = {
+                'journal_seq': seq,
+                'aggregates': raw_aggregates,
+                'collections': collections_data,
+                'partitions': manifests or dict()
+            }
+            body = json.dumps(
+                raw_data, separators=(',', ':')
+            ).encode('utf-8')
+            header = json.dumps({
+                'version': FORMAT_VERSION,
+                'checksum': zlib.crc32(body),
+                'length': len(body)
+            })
+            file_io.write(b'%s\n%s'%(header.encode('utf-8'), body))
+        self._publish(file_path, write, keep)
+
+    def _write_snapshot(self, seq: int, data: dict[str, Collection]):
+        format = self._snapshot_format()
+        directory = self.args.get('storage_dest')
+
+        # Partitions are written to new files first, so the snapshot
+        # referencing them is only published once they are complete.
+        unpartitioned = dict()
+        manifests = dict()
+        for collection_name, collection in data.items():
+            if not isinstance(collection, PartitionedCollection):
+                unpartitioned[collection_name] = collection
+                continue
+
+            for partition in collection.dirty():
+                partition.file_name = '%s.%s.%s.%d.%s'%(
+                    self.user, collection_name, partition.key, seq,
+                    SNAPSHOT_FORMATS[format]
+                )
+                self._write_snapshot_file(
+                    os.path.join(directory, partition.file_name),
+                    format, seq, { collection_name: partition.collection }
+                )
+            manifests[collection_name] = collection.manifest()
+
+        self._write_snapshot_file(
+            self._get_file_path(format), format, seq,
+            unpartitioned, manifests, self.args.get('snapshot_keep')
+        )
+
+        for other_format in SNAPSHOT_FORMATS:
+            other_path = self._get_file_path(other_format)
+            if other_format != format and os.path.isfile(other_path):
+                os.remove(other_path)
+        self._remove_stale_partitions(manifests)
+
+    def _get_partition_paths(self) -> list[str]:
+        directory = self.args.get('storage_dest')
+
+        paths = list()
         for collection_name, Type in self.schema.items():
-            models = list()
-            for model_data in raw_data.get(collection_name, list()):
-                models.append(
-                    self._hydrate_model(Type, model_data)
+            if Type.partition_by():
+                paths.extend(glob.glob(os.path.join(
+                    glob.escape(directory),
+                    '%s.%s.*'%(glob.escape(self.user), collection_name)
+                )))
+
+        return paths
+
+    def _remove_stale_partitions(self, manifests: dict[str, dict]) -> int:
+        '''
+        Remove partition files referenced by neither `manifests` nor a
+        previous snapshot, returning the bytes freed. Nothing is removed
+        if a previous snapshot can't be read, as the files it refers to
+        are unknown.
+        '''
+        def add_references(manifests: dict[str, dict]):
+            for manifest in manifests.values():
+                for entry in manifest.values():
+                    referenced.add(entry['file'])
+
+        referenced = set()
+        add_references(manifests)
+        stale = list(
+            path for path in self._get_partition_paths()
+            if os.path.basename(path) not in referenced
+        )
+        if not stale:
+            return 0
+
+        for format in SNAPSHOT_FORMATS:
+            for path in self._get_rotated_paths(self._get_file_path(format)):
+                try:
+                    add_references(self._read_snapshot_file(path, dict())[2])
+                except CORRUPTION_ERRORS:
+                    return 0
+
+        freed = 0
+        for path in stale:
+            if os.path.basename(path) not in referenced:
+                freed += os.path.getsize(path)
+                os.remove(path)
+
+        return freed
+
+    def _write_journal(self, seq: int, pending: list[tuple[str, str, Any]]):
+        lines = list()
+        for op, collection_name, payload in pending:
+            seq += 1
+            record = self._encode_journal_record(
+                seq, op, collection_name, payload
+            )
+            lines.append('%s\n'%json.dumps(record))
+
+        journal_path = self._get_journal_path()
+        with io.open(journal_path, 'a', encoding='utf-8') as journal_io:
+            journal_io.write(str().join(lines))
+
+            if self.args.get('fsync'):
+                journal_io.flush()
+                os.fsync(journal_io.fileno())
+
+    def _compact(self, seq: int, data: dict[str, Collection]):
+        self._write_snapshot(seq, data)
+
+        journal_path = self._get_journal_path()
+        if os.path.isfile(journal_path):
+            os.remove(journal_path)
+
+    def _apply(
+        self,
+        data: dict[str, Collection],
+        operation: tuple[str, str, Any],
+        merging: bool = False
+    ) -> bool:
+        '''
+        Apply a pending operation to collections. When merging into data
+        written elsewhere, creates colliding with a unique group of fields
+        are dropped; return whether the operation was applied.
+        '''
+        op, collection_name, payload = operation
+        collection = data[collection_name]
+        if op == 'delete':
+            collection.delete(payload)
+            return True
+        if op == 'update':
+            collection.update(*payload)
+            return True
+
+        if merging:
+            for fields in payload.__class__.unique():
+                filter = dict(
+                    (field, getattr(payload, field)) for field in fields
                 )
+                if collection.query(filter, None, 1):
+                    return False
+
+        collection.append(payload)
+        return True
+
+    def _persist(
+        self,
+        state: FileUserState,
+        pending: list[tuple[str, str, Any]],
+        data: dict[str, Collection]
+    ) -> tuple[FileUserState, dict[str, Collection], int, int, tuple]:
+        '''
+        Write pending operations under the user's file lock, compacting
+        when `data` is given. If the files changed since they were last
+        read, the operations are first rebased onto their contents, which
+        are returned.
+
+        Return the rebased state, if any, the data compacted, and the
+        resulting sequence number, journal length and fingerprint.
+        '''
+        with self._file_lock():
+            rebased = None
+            seq = state.seq
+            journal_length = state.journal_length
+            if self._fingerprint() != state.fingerprint:
+                rebased = self._read_state()
+                pending = list(
+                    operation for operation in pending
+                    if self._apply(rebased.data, operation, True)
+                )
+                seq = rebased.seq
+                journal_length = rebased.journal_length
+                if data is not None:
+                    data = dict(
+                        (collection_name, collection.snapshot())
+                        for collection_name, collection in \
+                            rebased.data.items()
+                    )
+
+            if data is None:
+                self._write_journal(seq, pending)
+                seq += len(pending)
+                journal_length += len(pending)
+            else:
+                seq += len(pending)
+                self._compact(seq, data)
+                journal_length = 0
+
+            return rebased, data, seq, journal_length, self._fingerprint()
+
+    async def _run_off_loop(self, fn: Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(None, fn, *args)
+
+    async def initialize(self):
+        print('no initialization required')
+
+    # Maintenance.
+    def _discover_users(self) -> list[str]:
+        suffixes = list(
+            '.db.%s'%extension for extension in SNAPSHOT_FORMATS.values()
+        )
+        suffixes.append('.journal.jsonl')
+
+        users = set()
+        for name in os.listdir(self.args.get('storage_dest')):
+            for suffix in suffixes:
+                if name.endswith(suffix):
+                    users.add(name[:-len(suffix)])
+
+        return sorted(users)
+
+    async def discover_users(self) -> list[str]:
+        return await self._run_off_loop(self._discover_users)
+
+    def _get_user_paths(self) -> list[str]:
+        paths = list()
+        for format in SNAPSHOT_FORMATS:
+            file_path = self._get_file_path(format)
+            if os.path.isfile(file_path):
+                paths.append(file_path)
+            paths.extend(self._get_rotated_paths(file_path))
+        if os.path.isfile(self._get_journal_path()):
+            paths.append(self._get_journal_path())
+        paths.extend(self._get_partition_paths())
+
+        return paths
+
+    def _disk_usage(self) -> int:
+        # Rotated snapshots may be links to the same file.
+        sizes = dict()
+        for path in self._get_user_paths():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            sizes[(stat.st_dev, stat.st_ino)] = stat.st_size
+
+        return sum(sizes.values())
 
-            self.data[collection_name] = models
+    def _check_files(self) -> dict[str, Any]:
+        '''
+        Verify the user's snapshots, restoring the newest valid previous
+        snapshot over a corrupt one, and remove files nothing refers to.
+        Report what was found, the bytes of corrupt snapshots recovery
+        dropped, and whether the files should be rewritten in the current
+        format. A corrupt snapshot that can't be recovered leaves every
+        file in place, as what it refers to is unknown. Runs on a worker
+        thread.
+        '''
+        result = {
+            'verified': 0,
+            'corrupt': 0,
+            'recovered': 0,
+            'bytes_dropped': 0,
+            'rewrite': False
+        }
+        with self._file_lock():
+            keep = self.args.get('snapshot_keep')
+            manifests = dict()
+            readable = True
+            for format in SNAPSHOT_FORMATS:
+                file_path = self._get_file_path(format)
+                rotated = self._get_rotated_paths(file_path)
+                for path in rotated[keep:]:
+                    os.remove(path)
+                rotated = rotated[:keep]
+
+                if os.path.isfile('%s.tmp'%file_path):
+                    os.remove('%s.tmp'%file_path)
+                if not os.path.isfile(file_path):
+                    continue
+
+                result['verified'] += 1
+                if not self._verify_snapshot(file_path):
+                    result['corrupt'] += 1
+                    for path in rotated:
+                        if self._verify_snapshot(path):
+                            usage = self._disk_usage()
+                            os.replace(path, file_path)
+                            result['recovered'] += 1
+                            result['bytes_dropped'] += max(
+                                0, usage - self._disk_usage()
+                            )
+                            break
+                    else:
+                        readable = False
+                        continue
+
+                _, outdated, file_manifests = self._read_snapshot_file(
+                    file_path, dict()
+                )
+                for collection_name, manifest in file_manifests.items():
+                    manifests['%s/%s'%(format, collection_name)] = manifest
+                result['rewrite'] = (
+                    result['rewrite'] or outdated or \
+                    format != self._snapshot_format()
+                )
+
+            if not readable:
+                # A rewrite would start from the unreadable snapshot.
+                result['rewrite'] = False
+                return result
+
+            for path in self._get_partition_paths():
+                if path.endswith('.tmp'):
+                    os.remove(path)
+            self._remove_stale_partitions(manifests)
+
+            if os.path.isfile(self._get_journal_path()):
+                result['rewrite'] = True
+
+        return result
+
+    async def maintain(self) -> dict[str, Any]:
+        '''
+        Verify, repair and compact the files of every user without a
+        session, one user at a time on a worker thread.
+        '''
+        started = time.monotonic()
+        metrics = {
+            'users': 0,
+            'skipped': 0,
+            'verified': 0,
+            'corrupt': 0,
+            'recovered': 0,
+            'rewritten': 0,
+            'bytes_reclaimed': 0,
+            # Corrupt snapshots replaced by recovery, kept apart from
+            # space reclaimed by compaction.
+            'bytes_dropped': 0
+        }
+
+        for user in await self._run_off_loop(self._discover_users):
+            metrics['users'] += 1
+
+            backend = self.__class__(self.schema, self.args)
+            backend.user = user
+            key = backend._cache_key()
+            # Live users' files are kept in shape by their own commits.
+            # Idle cached users are reloaded on connect if their files
+            # change, unless they hold writes yet to be persisted.
+            entry = user_cache.entries.get(key)
+            if key in user_cache.loading or (entry and (
+                entry.references or entry.state.pending
+            )):
+                metrics['skipped'] += 1
+                continue
+
+            usage = await self._run_off_loop(backend._disk_usage)
+            result = await self._run_off_loop(backend._check_files)
+            for name in (
+                'verified', 'corrupt', 'recovered', 'bytes_dropped'
+            ):
+                metrics[name] += result[name]
+
+            if result['rewrite']:
+                await backend.connect(user)
+                try:
+                    backend.state.upgrade = True
+                    await backend.commit()
+                finally:
+                    await backend.disconnect()
+                    user_cache.discard(key)
+                metrics['rewritten'] += 1
+
+            metrics['bytes_reclaimed'] += max(0, (
+                usage - result['bytes_dropped'] - \
+                    await self._run_off_loop(backend._disk_usage)
+            ))
+
+        metrics['seconds'] = time.monotonic() - started
+        return metrics
+
+    def _cache_key(self) -> str:
+        return 'file:%s/%s'%(
+            os.path.abspath(self.args.get('storage_dest')), self.user
+        )
+
+    def _read_state(self) -> FileUserState:
+        state = FileUserState()
+        # Taken first, so a write racing the read is seen as a change.
+        state.fingerprint = self._fingerprint()
+        self._load_snapshot(state)
+        self._load_journal(state)
+
+        return state
+
+    async def _load_state(self) -> FileUserState:
+        return await self._run_off_loop(self._read_state)
+
+    async def _refresh(self, state: FileUserState):
+        '''
+        Reload a cached state if its files changed since they were last
+        read or written, replaying the pending operations onto the newer
+        data as a commit would.
+        '''
+        async with state.commit_lock:
+            if await self._run_off_loop(self._fingerprint) == \
+                    state.fingerprint:
+                return
+
+            fresh = await self._load_state()
+            state.pending = list(
+                operation for operation in state.pending
+                if self._apply(fresh.data, operation, True)
+            )
+            state.data = fresh.data
+            state.seq = fresh.seq
+            state.journal_length = fresh.journal_length
+            state.upgrade = state.upgrade or fresh.upgrade
+            state.fingerprint = fresh.fingerprint
+            state.revision = fresh.revision
+
+    async def connect(self, user: str) -> bool:
+        self.user = user
+        self.state = await user_cache.acquire(
+            self._cache_key(), self._load_state
+        )
+        # The cached state may predate writes of another process.
+        try:
+            await self._refresh(self.state)
+        except BaseException:
+            await self.disconnect()
+            raise
 
     async def disconnect(self):
-        pass
+        if self.state is None:
+            return
+
+        self.state = None
+        user_cache.release(self._cache_key())
 
     async def commit(self):
-        raw_data = dict()
-        for collection_name, Type in self.schema.items():
-            collection_data = list()
-            for model in self.data[collection_name]:
-                collection_data.append(
-                    self._dehydrate_model(Type, model)
+        '''
+        Take a cheap copy of the state to persist on the event loop, then
+        serialise and write it on a worker thread.
+        '''
+        state = self.state
+        async with state.commit_lock:
+            if not state.pending and not state.upgrade:
+                return
+
+            pending = state.pending
+            state.pending = list()
+
+            compact = (
+                not self.args.get('journal') or \
+                state.upgrade or \
+                state.journal_length + len(pending) >= \
+                    self.args.get('journal_compact')
+            )
+            data = None
+            if compact:
+                data = dict(
+                    (collection_name, collection.snapshot())
+                    for collection_name, collection in state.data.items()
+                )
+
+            rebased, data, seq, journal_length, fingerprint = \
+                await self._run_off_loop(
+                    self._persist, state, pending, data
                 )
 
-            raw_data[collection_name] = collection_data
+            if rebased:
+                # Operations made while writing went to the replaced data.
+                for operation in state.pending:
+                    self._apply(rebased.data, operation)
+                state.data = rebased.data
+                state.upgrade = rebased.upgrade
+                state.revision = rebased.revision
+            if compact:
+                state.upgrade = False
+                for collection_name, written in data.items():
+                    collection = state.data[collection_name]
+                    if isinstance(collection, PartitionedCollection):
+                        collection.persisted(written)
+            state.seq = seq
+            state.journal_length = journal_length
+            state.fingerprint = fingerprint
 
-        file_path = self._get_file_path()
-        with io.open(file_path, 'w', encoding='utf-8') as file_io:
-            json.dump(raw_data, file_io)
+    def revision(self) -> int:
+        return self.state.revision
 
     async def query(
         self,
         Target: Type[T],
-        filter: dict[str, Any] = None
+        filter: dict[str, Any] = None,
+        order_by: str = None,
+        limit: int = None
     ) -> Union[list[T], int]:
-        collection_name = Target.collection_name()
+        validate_filter(filter)
 
-        result = self.data[collection_name]
-        if filter:
-            result = self._filter(result, filter)
+        return self.state.data[Target.collection_name()].query(
+            filter, order_by, limit
+        )
 
-        return result
+    async def aggregate(
+        self, Target: Type[T], field: str, filter: dict[str, Any] = None
+    ) -> int:
+        validate_filter(filter)
+
+        return self.state.data[Target.collection_name()].aggregate(
+            field, filter
+        )
     
+    async def columns(
+        self, Target: Type[T], filter: dict[str, Any] = None
+    ) -> ColumnarCollection:
+        validate_filter(filter)
+
+        return as_columns(
+            self.state.data[Target.collection_name()], filter
+        )
+
     async def create(self, model: Model):
-        collection_name = model.__class__.collection_name()
+        operation = ('create', model.__class__.collection_name(), model)
+
+        self._apply(self.state.data, operation)
+        self.state.pending.append(operation)
 
-        self.data[collection_name].append(model)
+    async def create_many(self, models: Iterable[Model]):
+        for model in models:
+            await self.create(model)
     
     async def delete(
         self, Target: Type[T], filter: dict[str, Any] = None
     ):
-        collection_name = Target.collection_name()
+        operation = ('delete', Target.collection_name(), filter)
+        validate_filter(filter)
  
-        retain = list()
-        if filter:
-            existing = self.data[collection_name]
-            delete = self._filter(existing, filter)
-            for item in existing:
-                if item not in delete:
-                    retain.append(item)
-
-        self.data[collection_name] = retain
+        self._apply(self.state.data, operation)
+        self.state.pending.append(operation)
+
+    async def update(
+        self,
+        Target: Type[T],
+        filter: dict[str, Any],
+        changes: dict[str, Any]
+    ):
+        operation = ('update', Target.collection_name(), (filter, changes))
+        validate_filter(filter)
+
+        self._apply(self.state.data, operation)
+        self.state.pending.append(operation)
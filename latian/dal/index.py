@@ -0,0 +1,150 @@
+'''
+In-memory hash indexes for storage backends that hold collections in
+memory.
+
+`datetime` fields are bucketed by day, and keep their distinct days
+sorted so range predicates can be answered by walking the buckets in the
+range. Lookups may return a superset of the matching models; callers
+still apply the full filter to the result.
+'''
+from typing import Callable, MutableSequence, Type, Any
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from itertools import product
+
+from ..model import Model
+from .query import is_predicate, condition_bounds
+
+def day_of(value: Any) -> Any:
+    '''The day bucket for a `datetime` or `date` value.'''
+    if isinstance(value, datetime):
+        return value.date()
+
+    return value
+
+class Index:
+    fields: tuple[str, ...]
+    bucketed: tuple[bool, ...]
+    bucket_factory: Callable[[], MutableSequence]
+    buckets: dict[tuple, MutableSequence]
+    days: dict[int, list]
+
+    def __init__(
+        self,
+        Type: Type[Model],
+        fields: tuple[str, ...],
+        bucket_factory: Callable[[], MutableSequence] = list
+    ):
+        schema = Type.schema()
+
+        self.fields = fields
+        self.bucketed = tuple(
+            schema[field] is datetime for field in fields
+        )
+        self.bucket_factory = bucket_factory
+        self.buckets = dict()
+        self.days = dict()
+        for k, bucketed in enumerate(self.bucketed):
+            if bucketed:
+                self.days[k] = list()
+
+    def _candidates(self, k: int, condition: Any) -> list:
+        '''Key values for field `k` a condition can match, or `None`.'''
+        bucketed = self.bucketed[k]
+        if not is_predicate(condition):
+            return [day_of(condition) if bucketed else condition]
+
+        if set(condition) == {'in'}:
+            if bucketed:
+                return list(set(day_of(item) for item in condition['in']))
+            return list(condition['in'])
+        if not bucketed or 'in' in condition:
+            return None
+
+        days = self.days[k]
+        low, high = condition_bounds(condition)
+        start, end = 0, len(days)
+        if low is not None:
+            start = bisect_left(days, day_of(low))
+        if high is not None:
+            end = bisect_right(days, day_of(high))
+
+        return days[start:end]
+
+    def ordered_days(self, condition: Any = None) -> list:
+        '''
+        The days a condition on the single field of a bucketed index can
+        match, in order, or `None` if they can't be enumerated.
+        '''
+        if condition is None:
+            return self.days[0]
+
+        days = self._candidates(0, condition)
+        if days is None:
+            return None
+
+        return sorted(days)
+
+    def covers(self, filter: dict[str, Any]) -> bool:
+        for k, field in enumerate(self.fields):
+            if field not in filter:
+                return False
+            if self._candidates(k, filter[field]) is None:
+                return False
+
+        return True
+
+    def _insert_day(self, k: int, day: Any):
+        days = self.days[k]
+        if not days or days[-1] < day:
+            days.append(day)
+            return
+
+        index = bisect_left(days, day)
+        if days[index] != day:
+            days.insert(index, day)
+
+    def add(self, model: Model):
+        self.add_values(
+            tuple(getattr(model, field) for field in self.fields), model
+        )
+
+    def add_values(self, values: tuple, item: Any):
+        '''Index `item` under values of the indexed fields.'''
+        key = list()
+        for k, value in enumerate(values):
+            if self.bucketed[k] and value is not None:
+                value = day_of(value)
+                self._insert_day(k, value)
+
+            key.append(value)
+        key = tuple(key)
+
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = self.bucket_factory()
+        bucket.append(item)
+
+    def lookup(self, filter: dict[str, Any]) -> list:
+        candidates = list(
+            self._candidates(k, filter[field])
+            for k, field in enumerate(self.fields)
+        )
+
+        result = list()
+        for key in product(*candidates):
+            bucket = self.buckets.get(key)
+            if bucket:
+                result.extend(bucket)
+
+        return result
+
+    def clear(self):
+        self.buckets = dict()
+        for k in self.days:
+            self.days[k] = list()
+
+    def rebuild(self, models: list[Model]):
+        self.clear()
+        for model in models:
+            self.add(model)
@@ -0,0 +1,261 @@
+'''
+Storage backend implementation holding all data in process memory.
+
+The collections of each user are held in the process-wide `user_cache`, so
+every session of a user shares them, and commits never touch disk. This
+gives an I/O-free baseline for comparing other backends and for
+throughput tests of the runtimes and I/O sources.
+
+With snapshots enabled, users' data is written to the storage location
+in the snapshot format of the file storage backend, at most once per
+interval on commit, whenever it is flushed and on `maintain`, and read
+back on first connect. Users are only evicted from the cache once their
+data is persisted. As with file storage, the process is assumed to be the
+only writer of that location.
+'''
+import os
+import time
+import asyncio
+from typing import Iterable, Union, Type, Any
+
+from ..cli import CLIArgs
+from ..model import Model
+from .collection import Collection
+from .columnar import ColumnarCollection, as_columns
+from .partition import PartitionedCollection
+from .query import validate_filter
+from .storage_backend import T, StorageBackend, storage_backends
+from .user_cache import UserState, user_cache
+
+# Prefix of the keys of memory backend users in the user cache.
+CACHE_PREFIX = 'memory:'
+
+class MemoryUserState(UserState):
+    '''The collections of one user, shared by all of their sessions.'''
+    data: dict[str, Collection]
+    # Mutations since the data was last snapshotted.
+    changes: int
+    seq: int
+    snapshot_time: float
+    snapshot_lock: asyncio.Lock
+    persistent: bool
+
+    def __init__(self, persistent: bool):
+        self.data = dict()
+        self.changes = 0
+        self.seq = 0
+        self.snapshot_time = time.monotonic()
+        self.snapshot_lock = asyncio.Lock()
+        self.persistent = persistent
+
+    def estimate_size(self) -> int:
+        return sum(
+            collection.estimate_size()
+            for collection in self.data.values()
+        )
+
+    def evictable(self) -> bool:
+        return self.persistent and not self.changes
+
+@storage_backends.implementation('memory')
+class MemoryStorageBackend(StorageBackend):
+    user: str
+    state: MemoryUserState
+    # The file storage backend snapshots are read and written through.
+    files: StorageBackend
+
+    def __init__(
+        self, schema: dict[str, Type[Model]], args: CLIArgs
+    ):
+        super().__init__(schema, args)
+        self.user = None
+        self.state = None
+        self.files = storage_backends.get('file')(schema, args)
+
+    def _persistent(self) -> bool:
+        return bool(self.args.get('memory_snapshot'))
+
+    def _cache_prefix(self) -> str:
+        '''The prefix of the cache keys of users of this location.'''
+        return '%s%s/'%(
+            CACHE_PREFIX, os.path.abspath(self.args.get('storage_dest'))
+        )
+
+    def _cache_key(self) -> str:
+        return '%s%s'%(self._cache_prefix(), self.user)
+
+    async def _load_state(self) -> MemoryUserState:
+        state = MemoryUserState(self._persistent())
+        if not state.persistent:
+            for collection_name, Type in self.schema.items():
+                state.data[collection_name] = \
+                    self.files._create_collection(Type)
+            return state
+
+        loop = asyncio.get_running_loop()
+        file_state = await loop.run_in_executor(None, self.files._read_state)
+        state.data = file_state.data
+        state.seq = file_state.seq
+        # Data left in an older format or a journal is persisted anew.
+        if file_state.upgrade or file_state.journal_length:
+            state.changes = 1
+
+        return state
+
+    def _write_snapshot(self, seq: int, data: dict[str, Collection]):
+        with self.files._file_lock():
+            self.files._compact(seq, data)
+
+    async def _snapshot(self, state: MemoryUserState):
+        '''Write a user's data to disk if it changed since last written.'''
+        async with state.snapshot_lock:
+            if not state.changes:
+                return
+
+            changes = state.changes
+            data = dict(
+                (collection_name, collection.snapshot())
+                for collection_name, collection in state.data.items()
+            )
+
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                None, self._write_snapshot, state.seq, data
+            )
+
+            state.changes -= changes
+            state.snapshot_time = time.monotonic()
+            for collection_name, written in data.items():
+                collection = state.data[collection_name]
+                if isinstance(collection, PartitionedCollection):
+                    collection.persisted(written)
+
+    def _mutated(self):
+        self.state.changes += 1
+        self.state.seq += 1
+
+    async def initialize(self):
+        pass
+
+    async def maintain(self) -> dict[str, Any]:
+        '''Snapshot every user changed since last written.'''
+        started = time.monotonic()
+        metrics = {
+            'users': 0,
+            'snapshots': 0
+        }
+
+        if self._persistent():
+            prefix = self._cache_prefix()
+            for key, entry in list(user_cache.entries.items()):
+                if not key.startswith(prefix):
+                    continue
+                metrics['users'] += 1
+
+                if entry.state.changes:
+                    backend = self.__class__(self.schema, self.args)
+                    backend.files.user = key[len(prefix):]
+                    await backend._snapshot(entry.state)
+                    metrics['snapshots'] += 1
+
+        metrics['seconds'] = time.monotonic() - started
+        return metrics
+
+    async def discover_users(self) -> list[str]:
+        prefix = self._cache_prefix()
+        users = set(
+            key[len(prefix):] for key in user_cache.entries
+            if key.startswith(prefix)
+        )
+        if self._persistent():
+            users.update(await self.files.discover_users())
+
+        return sorted(users)
+
+    async def connect(self, user: str):
+        self.user = user
+        self.files.user = user
+        self.state = await user_cache.acquire(
+            self._cache_key(), self._load_state
+        )
+
+    async def disconnect(self):
+        if self.state is None:
+            return
+
+        try:
+            await self.flush()
+        finally:
+            self.state = None
+            user_cache.release(self._cache_key())
+
+    async def commit(self):
+        if not self._persistent():
+            return
+
+        elapsed = time.monotonic() - self.state.snapshot_time
+        if elapsed >= self.args.get('memory_snapshot_interval'):
+            await self._snapshot(self.state)
+
+    async def flush(self):
+        '''Snapshot regardless of the interval.'''
+        if self._persistent():
+            await self._snapshot(self.state)
+
+    async def query(
+        self,
+        Target: Type[T],
+        filter: dict[str, Any] = None,
+        order_by: str = None,
+        limit: int = None
+    ) -> Union[list[T], int]:
+        validate_filter(filter)
+
+        return self.state.data[Target.collection_name()].query(
+            filter, order_by, limit
+        )
+
+    async def aggregate(
+        self, Target: Type[T], field: str, filter: dict[str, Any] = None
+    ) -> int:
+        validate_filter(filter)
+
+        return self.state.data[Target.collection_name()].aggregate(
+            field, filter
+        )
+
+    async def columns(
+        self, Target: Type[T], filter: dict[str, Any] = None
+    ) -> ColumnarCollection:
+        validate_filter(filter)
+
+        return as_columns(
+            self.state.data[Target.collection_name()], filter
+        )
+
+    async def create(self, model: Model):
+        self.state.data[model.__class__.collection_name()].append(model)
+        self._mutated()
+
+    async def create_many(self, models: Iterable[Model]):
+        for model in models:
+            await self.create(model)
+
+    async def delete(
+        self, Target: Type[T], filter: dict[str, Any] = None
+    ):
+        validate_filter(filter)
+
+        self.state.data[Target.collection_name()].delete(filter)
+        self._mutated()
+
+    async def update(
+        self,
+        Target: Type[T],
+        filter: dict[str, Any],
+        changes: dict[str, Any]
+    ):
+        validate_filter(filter)
+
+        self.state.data[Target.collection_name()].update(filter, changes)
+        self._mutated()
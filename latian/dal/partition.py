@@ -0,0 +1,339 @@
+'''
+Collections partitioned by month for the file storage backend.
+
+Models declaring a partition field are split into one collection per
+month of that field. Each partition is persisted in its own file, and
+only loaded when a query or write touches its month; the sums of the
+aggregates the model declares are kept for unloaded partitions, so totals
+that span every month do not load them.
+'''
+from dataclasses import replace
+from typing import Callable, Type, Any, Iterable
+
+from ..model import Model
+from .collection import Collection
+from .columnar import ColumnarCollection, as_columns
+from .aggregate import SumAggregate
+from .query import is_predicate, condition_bounds, sort_models
+
+# The partition of models whose partition field is unset.
+UNDATED = '0000-00'
+
+def partition_key(value: Any) -> str:
+    '''The month partition for a `datetime` or `date` value.'''
+    if value is None:
+        return UNDATED
+
+    return '%04d-%02d'%(value.year, value.month)
+
+class Partition:
+    key: str
+    # The file holding the persisted partition, if any.
+    file_name: str
+    count: int
+    # The loaded partition, or `None`.
+    collection: Collection
+    # Stored sums, for answering aggregates while unloaded.
+    aggregates: list[SumAggregate]
+    # Incremented on every change since the partition was persisted.
+    version: int
+
+    def __init__(self, key: str):
+        self.key = key
+        self.file_name = None
+        self.count = 0
+        self.collection = None
+        self.aggregates = list()
+        self.version = 0
+
+    def __len__(self) -> int:
+        if self.collection is not None:
+            return len(self.collection)
+
+        return self.count
+
+class PartitionedCollection:
+    Type: Type[Model]
+    field: str
+    partitions: dict[str, Partition]
+    factory: Callable[[], Collection]
+    loader: Callable[[str], Collection]
+
+    def __init__(
+        self,
+        Type: Type[Model],
+        factory: Callable[[], Collection],
+        loader: Callable[[str], Collection]
+    ):
+        self.Type = Type
+        self.field = Type.partition_by()
+        self.partitions = dict()
+        self.factory = factory
+        self.loader = loader
+
+    def __len__(self) -> int:
+        return sum(len(partition) for partition in self.partitions.values())
+
+    def __iter__(self):
+        for key in sorted(self.partitions):
+            yield from self._load(self.partitions[key])
+
+    def _create_aggregates(self) -> list[SumAggregate]:
+        aggregates = list()
+        for field, groups in self.Type.aggregates().items():
+            for fields in groups:
+                aggregates.append(SumAggregate(self.Type, field, fields))
+
+        return aggregates
+
+    def restore(self, manifest: dict[str, dict], eager: Iterable[str] = ()):
+        '''
+        Restore unloaded partitions from a manifest of their files, loading
+        those in `eager` now.
+        '''
+        self.partitions = dict()
+        for key, entry in manifest.items():
+            partition = self.partitions[key] = Partition(key)
+            partition.file_name = entry['file']
+            partition.count = entry['count']
+            partition.aggregates = self._create_aggregates()
+            if len(entry['aggregates']) != len(partition.aggregates):
+                partition.aggregates = list()
+                continue
+
+            for aggregate, sums in zip(
+                partition.aggregates, entry['aggregates']
+            ):
+                aggregate.hydrate(sums)
+
+        for key in eager:
+            if key in self.partitions:
+                self._load(self.partitions[key])
+
+    def manifest(self) -> dict[str, dict]:
+        '''Describe persisted partitions, for storing with the snapshot.'''
+        manifest = dict()
+        for key, partition in self.partitions.items():
+            if not len(partition):
+                continue
+
+            aggregates = partition.aggregates
+            if partition.collection is not None:
+                aggregates = partition.collection.aggregates
+            manifest[key] = {
+                'file': partition.file_name,
+                'count': len(partition),
+                'aggregates': list(
+                    aggregate.dehydrate() for aggregate in aggregates
+                )
+            }
+
+        return manifest
+
+    def _load(self, partition: Partition) -> Collection:
+        if partition.collection is None:
+            if partition.file_name:
+                partition.collection = self.loader(partition.file_name)
+            else:
+                partition.collection = self.factory()
+            partition.aggregates = list()
+
+        return partition.collection
+
+    def _partition(self, key: str) -> Partition:
+        partition = self.partitions.get(key)
+        if partition is None:
+            partition = self.partitions[key] = Partition(key)
+
+        return partition
+
+    def _matching(self, filter: dict[str, Any]) -> list[Partition]:
+        '''The partitions, in order, a filter can match models in.'''
+        keys = sorted(self.partitions)
+        if not filter or self.field not in filter:
+            return list(self.partitions[key] for key in keys)
+
+        condition = filter[self.field]
+        if condition is None:
+            keys = list(key for key in keys if key == UNDATED)
+        elif is_predicate(condition) and 'in' in condition:
+            months = set(partition_key(item) for item in condition['in'])
+            keys = list(key for key in keys if key in months)
+        else:
+            low, high = condition_bounds(condition)
+            if low is not None:
+                low = partition_key(low)
+            if high is not None:
+                high = partition_key(high)
+            keys = list(
+                key for key in keys
+                if (low is None or key >= low) and \
+                    (high is None or key <= high)
+            )
+
+        return list(self.partitions[key] for key in keys)
+
+    def load(self, models: Iterable[Model], aggregate_data: list = None):
+        '''Replace the contents, splitting models into partitions.'''
+        self.partitions = dict()
+        for model in models:
+            self.append(model)
+
+    def snapshot(self) -> 'PartitionedCollection':
+        '''
+        A copy for writing off the event loop, holding snapshots of the
+        partitions changed since they were last persisted.
+        '''
+        copy = PartitionedCollection(self.Type, self.factory, self.loader)
+        for key, partition in self.partitions.items():
+            copy_partition = copy.partitions[key] = Partition(key)
+            copy_partition.file_name = partition.file_name
+            copy_partition.count = len(partition)
+            copy_partition.version = partition.version
+            if partition.collection is None:
+                copy_partition.aggregates = list(
+                    aggregate.copy() for aggregate in partition.aggregates
+                )
+            elif partition.version or not partition.file_name:
+                copy_partition.collection = partition.collection.snapshot()
+            else:
+                copy_partition.aggregates = list(
+                    aggregate.copy()
+                    for aggregate in partition.collection.aggregates
+                )
+
+        return copy
+
+    def persisted(self, written: 'PartitionedCollection'):
+        '''
+        Record the files a snapshot was written to. Partitions changed
+        again since the snapshot was taken stay dirty.
+        '''
+        for key, written_partition in written.partitions.items():
+            partition = self.partitions.get(key)
+            if partition is None:
+                continue
+
+            partition.file_name = written_partition.file_name
+            if partition.version == written_partition.version:
+                partition.version = 0
+
+    def dirty(self) -> list[Partition]:
+        '''Partitions of a snapshot that must be written.'''
+        return list(
+            partition for partition in self.partitions.values()
+            if partition.collection is not None and len(partition)
+        )
+
+    def estimate_size(self) -> int:
+        size = 0
+        for partition in self.partitions.values():
+            if partition.collection is not None:
+                size += partition.collection.estimate_size()
+
+        return size
+
+    def append(self, model: Model):
+        partition = self._partition(
+            partition_key(getattr(model, self.field))
+        )
+
+        self._load(partition).append(model)
+        partition.version += 1
+
+    def extend(self, models: Iterable[Model]):
+        for model in models:
+            self.append(model)
+
+    def delete(self, filter: dict[str, Any] = None) -> int:
+        count = 0
+        for partition in self._matching(filter):
+            deleted = self._load(partition).delete(filter)
+            if deleted:
+                partition.version += 1
+                count += deleted
+
+        return count
+
+    def update(
+        self, filter: dict[str, Any], changes: dict[str, Any]
+    ) -> int:
+        if self.field in changes:
+            # Updated models may move to other partitions.
+            models = self.query(filter)
+            self.delete(filter)
+            self.extend(replace(model, **changes) for model in models)
+            return len(models)
+
+        count = 0
+        for partition in self._matching(filter):
+            updated = self._load(partition).update(filter, changes)
+            if updated:
+                partition.version += 1
+                count += updated
+
+        return count
+
+    def query(
+        self,
+        filter: dict[str, Any] = None,
+        order_by: str = None,
+        limit: int = None
+    ) -> list[Model]:
+        partitions = self._matching(filter)
+
+        # Ordered on the partition field, a limit can be met from the
+        # first partitions in that order alone.
+        ordered = order_by in (self.field, '-%s'%self.field)
+        if ordered and order_by.startswith('-'):
+            partitions.reverse()
+
+        result = list()
+        for partition in partitions:
+            if ordered and limit is not None and len(result) >= limit:
+                break
+
+            result.extend(self._load(partition).query(
+                filter,
+                order_by if ordered else None,
+                limit if ordered else None
+            ))
+
+        if order_by and not ordered:
+            result = sort_models(result, order_by)
+        if limit is not None:
+            result = result[:limit]
+
+        return result
+
+    def select(self, filter: dict[str, Any] = None) -> ColumnarCollection:
+        '''The models matching `filter` in columns, oldest month first.'''
+        result = ColumnarCollection.encoded(self.Type, ())
+        for partition in self._matching(filter):
+            result.extend_columns(
+                as_columns(self._load(partition), filter)
+            )
+
+        return result
+
+    def aggregate(
+        self, field: str, filter: dict[str, Any] = None
+    ) -> int:
+        filter = filter or dict()
+
+        total = 0
+        for partition in self._matching(filter):
+            if partition.collection is None:
+                stored = None
+                for aggregate in partition.aggregates:
+                    if aggregate.field == field and aggregate.covers(filter):
+                        stored = aggregate
+                        break
+
+                if stored:
+                    total += stored.lookup(filter)
+                    continue
+
+            total += self._load(partition).aggregate(field, filter)
+
+        return total
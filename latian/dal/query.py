@@ -0,0 +1,114 @@
+'''
+The filter language understood by every storage backend.
+
+A filter maps field names to either a literal value, matched by equality,
+or a predicate dictionary combining any of the operators:
+
+    { 'gte': x }, { 'gt': x }, { 'lte': x }, { 'lt': x }
+    { 'in': [x, y, ...] }
+    { 'between': (x, y) }   # Inclusive of both bounds.
+
+For example `{ 'when': { 'gte': start, 'lt': end }, 'type': 'rep' }`.
+
+A `date` operand for a `datetime` field is compared against the day of
+the field value, so `{ 'when': some_day }` matches any time on that day.
+'''
+from typing import Callable, Any
+from datetime import datetime, date
+
+from ..model import Model
+
+OPERATORS: dict[str, Callable[[Any, Any], bool]] = {
+    'gte': lambda value, operand: value >= operand,
+    'gt': lambda value, operand: value > operand,
+    'lte': lambda value, operand: value <= operand,
+    'lt': lambda value, operand: value < operand,
+    'in': lambda value, operand: value in operand,
+    'between': lambda value, operand: operand[0] <= value <= operand[1]
+}
+RANGE_OPERATORS = ('gte', 'gt', 'lte', 'lt', 'between')
+
+def is_predicate(condition: Any) -> bool:
+    return isinstance(condition, dict)
+
+def is_day_operand(operand: Any) -> bool:
+    if isinstance(operand, (list, tuple, set)):
+        return any(is_day_operand(item) for item in operand)
+
+    return type(operand) is date
+
+def _coerce(value: Any, operand: Any) -> Any:
+    if isinstance(value, datetime) and is_day_operand(operand):
+        return value.date()
+
+    return value
+
+def validate_filter(filter: dict[str, Any]):
+    if not filter:
+        return
+
+    for key, condition in filter.items():
+        if not is_predicate(condition):
+            continue
+
+        for operator in condition:
+            if operator not in OPERATORS:
+                raise ValueError(
+                    'unknown operator %s on %s'%(operator, key)
+                )
+
+def condition_matches(value: Any, condition: Any) -> bool:
+    if not is_predicate(condition):
+        return _coerce(value, condition) == condition
+
+    if value is None:
+        return False
+    for operator, operand in condition.items():
+        if not OPERATORS[operator](_coerce(value, operand), operand):
+            return False
+
+    return True
+
+def matches(model: Model, filter: dict[str, Any]) -> bool:
+    for key, condition in filter.items():
+        if not condition_matches(getattr(model, key), condition):
+            return False
+
+    return True
+
+def condition_bounds(condition: Any) -> tuple[Any, Any]:
+    '''
+    The inclusive `(low, high)` bounds implied by a condition, either of
+    which may be `None` when unbounded. Exclusive bounds are widened to
+    inclusive ones, so callers must still apply the condition itself.
+    '''
+    if not is_predicate(condition):
+        return condition, condition
+
+    low, high = None, None
+    for operator, operand in condition.items():
+        if operator in ('gte', 'gt'):
+            low = operand if low is None else max(low, operand)
+        elif operator in ('lte', 'lt'):
+            high = operand if high is None else min(high, operand)
+        elif operator == 'between':
+            low = operand[0] if low is None else max(low, operand[0])
+            high = operand[1] if high is None else min(high, operand[1])
+        elif operator == 'in' and len(operand):
+            low = min(operand) if low is None else max(low, min(operand))
+            high = max(operand) if high is None else min(high, max(operand))
+
+    return low, high
+
+def sort_models(
+    models: list[Model], order_by: str
+) -> list[Model]:
+    '''Sort on a field name, descending when prefixed with `-`.'''
+    reverse = order_by.startswith('-')
+    field = order_by.lstrip('-')
+
+    return sorted(
+        models,
+        key=lambda model: getattr(model, field),
+        reverse=reverse
+    )
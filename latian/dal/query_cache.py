@@ -0,0 +1,221 @@
+'''
+A process-wide cache of the results of `DAL` reads, shared by every
+session of the same user on the same storage.
+
+Results are keyed by collection and query. Mutations made through the
+`DAL` invalidate exactly the cached results they can change: created
+models drop the results whose filter they match, and updates and deletes
+drop those whose filter can overlap theirs. Writes made elsewhere, such
+as by another process sharing file storage, are seen through the
+backend's `revision`: when it changes, every result of the user is
+dropped. Backends that report no revision, like SQLite, are assumed to be
+written only through this process.
+'''
+from typing import Callable, Hashable, Iterable, Any
+
+from ..model import Model
+from .query import is_predicate, matches
+
+def _freeze(value: Any) -> Hashable:
+    '''A hashable equivalent of a filter or condition.'''
+    if isinstance(value, dict):
+        return tuple(sorted(
+            (key, _freeze(item)) for key, item in value.items()
+        ))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(item) for item in value)
+
+    return value
+
+def _disjoint(a: dict[str, Any], b: dict[str, Any]) -> bool:
+    '''Whether no model can match both filters, as far as can be told.'''
+    if not a or not b:
+        return False
+
+    for field, condition in a.items():
+        if field not in b:
+            continue
+
+        other = b[field]
+        if is_predicate(condition) or is_predicate(other):
+            continue
+        # A `date` can match a `datetime` on that day.
+        if type(condition) is type(other) and condition != other:
+            return True
+
+    return False
+
+class QueryCacheEntry:
+    filter: dict[str, Any]
+    result: Any
+
+    def __init__(self, filter: dict[str, Any], result: Any):
+        self.filter = filter
+        self.result = result
+
+class QueryCache:
+    '''The cached reads of one user, by collection and query.'''
+    collections: dict[str, dict[Hashable, QueryCacheEntry]]
+    # Incremented on every mutation of a collection, so reads that were
+    # in flight across one are not cached.
+    generations: dict[str, int]
+    # The revision of the storage the results were read from.
+    revision: Any
+    hits: int
+    misses: int
+    invalidations: int
+
+    def __init__(self):
+        self.collections = dict()
+        self.generations = dict()
+        self.revision = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def generation(self, collection_name: str) -> int:
+        return self.generations.get(collection_name, 0)
+
+    def _key(self, query: str, filter: dict[str, Any]) -> Hashable:
+        return (query, _freeze(filter))
+
+    def get(
+        self, collection_name: str, query: str, filter: dict[str, Any]
+    ) -> QueryCacheEntry:
+        '''
+        Return the entry for a query of a collection, or `None`. `query`
+        names the kind of read, such as an aggregated field.
+        '''
+        entries = self.collections.get(collection_name, dict())
+        entry = entries.get(self._key(query, filter))
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return entry
+
+    def put(
+        self,
+        collection_name: str,
+        query: str,
+        filter: dict[str, Any],
+        result: Any,
+        generation: int
+    ):
+        '''
+        Cache the result of a query read at `generation` of the
+        collection, unless it has been mutated since.
+        '''
+        if generation != self.generation(collection_name):
+            return
+
+        entries = self.collections.setdefault(collection_name, dict())
+        entries[self._key(query, filter)] = QueryCacheEntry(filter, result)
+
+    def _invalidate(
+        self,
+        collection_name: str,
+        stale: Callable[[dict[str, Any]], bool]
+    ):
+        self.generations[collection_name] = \
+            self.generation(collection_name) + 1
+
+        entries = self.collections.get(collection_name)
+        if not entries:
+            return
+
+        for key, entry in list(entries.items()):
+            if stale(entry.filter):
+                del entries[key]
+                self.invalidations += 1
+
+    def created(self, collection_name: str, models: Iterable[Model]):
+        '''Drop the results models created in a collection change.'''
+        models = list(models)
+
+        self._invalidate(collection_name, lambda filter: (
+            not filter or any(matches(model, filter) for model in models)
+        ))
+
+    def changed(
+        self,
+        collection_name: str,
+        filter: dict[str, Any],
+        changes: dict[str, Any] = None
+    ):
+        '''
+        Drop the results an update of the models matching `filter` with
+        `changes`, or a delete of them, can change.
+        '''
+        # Updated models match the filter with the changes applied.
+        updated = dict(filter or dict(), **(changes or dict()))
+
+        self._invalidate(collection_name, lambda other: not (
+            _disjoint(filter, other) and \
+            (changes is None or _disjoint(updated, other))
+        ))
+
+    def sync(self, revision: Any):
+        '''
+        Drop every result if the storage is no longer at the revision
+        they were read from.
+        '''
+        if revision == self.revision:
+            return
+
+        self.revision = revision
+        for collection_name in set(self.collections) | set(self.generations):
+            self._invalidate(collection_name, lambda filter: True)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'entries': sum(
+                len(entries) for entries in self.collections.values()
+            )
+        }
+
+class QueryCaches:
+    '''The query caches of the users with sessions, reference-counted.'''
+    caches: dict[Hashable, QueryCache]
+    references: dict[Hashable, int]
+    # The counters of caches already released.
+    released: QueryCache
+
+    def __init__(self):
+        self.caches = dict()
+        self.references = dict()
+        self.released = QueryCache()
+
+    def acquire(self, key: Hashable) -> QueryCache:
+        '''Every acquisition must be paired with a `release`.'''
+        if key not in self.caches:
+            self.caches[key] = QueryCache()
+            self.references[key] = 0
+
+        self.references[key] += 1
+        return self.caches[key]
+
+    def release(self, key: Hashable):
+        self.references[key] -= 1
+        if not self.references[key]:
+            cache = self.caches.pop(key)
+            del self.references[key]
+
+            self.released.hits += cache.hits
+            self.released.misses += cache.misses
+            self.released.invalidations += cache.invalidations
+
+    def stats(self) -> dict[str, int]:
+        '''The counters of every cache, including released ones.'''
+        stats = self.released.stats()
+        for cache in self.caches.values():
+            for key, value in cache.stats().items():
+                stats[key] += value
+
+        return stats
+
+query_caches = QueryCaches()
@@ -0,0 +1,681 @@
+'''
+Storage backend implementation using an SQLite database.
+
+All users share one database file with a table per collection, keyed by
+a `user` column. The sums declared in `Model.aggregates` are materialised
+in an `_aggregates` table, maintained in the same transaction as each
+mutation. Blocking SQLite calls run on worker threads through a
+small connection pool, so they never stall the event loop. Mutations are
+written through in their own transaction, which leaves `commit` with
+nothing to do.
+'''
+import os
+import json
+import time
+import sqlite3
+import asyncio
+from dataclasses import replace
+from typing import Callable, Iterable, Type, Any
+from datetime import datetime, date, timedelta
+
+from ..cli import CLIArgs
+from ..model import Model
+from .query import is_predicate, is_day_operand, validate_filter
+from .codec import EPOCH
+from .aggregate import SumAggregate, day_window
+from .storage_backend import T, StorageBackend, storage_backends
+
+DATABASE_NAME = 'latian.db'
+AGGREGATES_TABLE = '_aggregates'
+
+COLUMN_TYPES = {
+    str: 'TEXT',
+    int: 'INTEGER',
+    bool: 'INTEGER',
+    datetime: 'REAL'
+}
+
+def _quote(identifier: str) -> str:
+    return '"%s"'%identifier
+
+def _day_start(day: date) -> float:
+    return (datetime(day.year, day.month, day.day) - EPOCH).total_seconds()
+
+class ConnectionPool:
+    '''
+    A bounded pool of SQLite connections. Calls are run on a worker thread
+    with a connection checked out for their duration.
+    '''
+    pools: dict[str, 'ConnectionPool'] = dict()
+    path: str
+    _idle: list[sqlite3.Connection]
+    _semaphore: asyncio.Semaphore
+
+    @classmethod
+    def get(cls, path: str, size: int) -> 'ConnectionPool':
+        pool = cls.pools.get(path)
+        if not pool:
+            pool = cls.pools[path] = cls(path, size)
+
+        return pool
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self._idle = list()
+        self._semaphore = asyncio.Semaphore(size)
+
+    def _open(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+
+        return connection
+
+    def _call(
+        self, fn: Callable[[sqlite3.Connection], Any]
+    ) -> tuple[Any, BaseException]:
+        # Connections are checked out and returned on the worker thread, so
+        # one is returned even if the awaiting call is cancelled.
+        try:
+            connection = self._idle.pop()
+        except IndexError:
+            connection = self._open()
+
+        try:
+            return fn(connection), None
+        except BaseException as ex:
+            connection.rollback()
+            return None, ex
+        finally:
+            self._idle.append(connection)
+
+    async def run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            result, error = await loop.run_in_executor(None, self._call, fn)
+
+        if error:
+            raise error
+        return result
+
+@storage_backends.implementation('sqlite')
+class SQLiteStorageBackend(StorageBackend):
+    initialized: set[str] = set()
+    pool: ConnectionPool
+    aggregates: dict[str, list[SumAggregate]]
+    user: str
+
+    def __init__(
+        self, schema: dict[str, Type[Model]], args: CLIArgs
+    ):
+        super().__init__(schema, args)
+        self.pool = ConnectionPool.get(
+            self._get_database_path(), args.get('storage_pool')
+        )
+        self.user = None
+
+        self.aggregates = dict()
+        for collection_name, Type in schema.items():
+            self.aggregates[collection_name] = list()
+            for field, groups in Type.aggregates().items():
+                for fields in groups:
+                    self.aggregates[collection_name].append(
+                        SumAggregate(Type, field, fields)
+                    )
+
+    def _get_database_path(self) -> str:
+        return '%s/%s'%(self.args.get('storage_dest'), DATABASE_NAME)
+
+    def _to_column(self, field_type: Any, value: Any) -> Any:
+        if value is None:
+            return None
+        if type(field_type) is list:
+            return json.dumps(list(
+                self._to_column_data(field_type[0], item)
+                for item in value
+            ))
+        if field_type is datetime:
+            return (value - EPOCH).total_seconds()
+        if field_type is bool:
+            return int(value)
+
+        return value
+
+    def _to_column_data(self, field_type: Any, value: Any) -> Any:
+        if not issubclass(field_type, Model):
+            return value
+
+        data = dict()
+        for key, inner_type in field_type.schema().items():
+            data[key] = self._to_column_data(
+                inner_type, getattr(value, key)
+            )
+        return data
+
+    def _from_column(self, field_type: Any, value: Any) -> Any:
+        if value is None:
+            return None
+        if type(field_type) is list:
+            return list(
+                self._from_column_data(field_type[0], item)
+                for item in json.loads(value)
+            )
+        if field_type is datetime:
+            return EPOCH + timedelta(seconds=value)
+        if field_type is bool:
+            return bool(value)
+
+        return value
+
+    def _from_column_data(self, field_type: Any, value: Any) -> Any:
+        if not issubclass(field_type, Model):
+            return value
+
+        model = field_type()
+        for key, inner_type in field_type.schema().items():
+            setattr(model, key, self._from_column_data(
+                inner_type, value[key]
+            ))
+        return model
+
+    def _hydrate_row(self, Target: Type[T], row: tuple) -> T:
+        model = Target()
+        for (key, field_type), value in zip(
+            Target.schema().items(), row
+        ):
+            setattr(model, key, self._from_column(field_type, value))
+
+        return model
+
+    def _condition_sql(
+        self, field_type: Any, column: str, operator: str, operand: Any
+    ) -> tuple[str, list]:
+        if operator == 'in':
+            if not len(operand):
+                return '0', list()
+
+            clauses, params = list(), list()
+            for item in operand:
+                clause, item_params = self._condition_sql(
+                    field_type, column, 'eq', item
+                )
+                clauses.append('(%s)'%clause)
+                params.extend(item_params)
+            return '(%s)'%' OR '.join(clauses), params
+        if operator == 'between':
+            low, low_params = self._condition_sql(
+                field_type, column, 'gte', operand[0]
+            )
+            high, high_params = self._condition_sql(
+                field_type, column, 'lte', operand[1]
+            )
+            return '%s AND %s'%(low, high), low_params + high_params
+
+        if operand is None:
+            # `None` matches only by equality, as in `query`.
+            if operator != 'eq':
+                return '0', list()
+            return '%s IS NULL'%column, list()
+        if field_type is datetime and is_day_operand(operand):
+            # Compare against the day of the timestamp.
+            start = _day_start(operand)
+            end = _day_start(operand + timedelta(days=1))
+            if operator == 'eq':
+                return '%s >= ? AND %s < ?'%(column, column), [start, end]
+            operator, operand = {
+                'gte': ('gte', start),
+                'gt': ('gte', end),
+                'lte': ('lt', end),
+                'lt': ('lt', start)
+            }[operator]
+        else:
+            operand = self._to_column(field_type, operand)
+
+        sql_operator = {
+            'eq': '=', 'gte': '>=', 'gt': '>', 'lte': '<=', 'lt': '<'
+        }[operator]
+        return '%s %s ?'%(column, sql_operator), [operand]
+
+    def _where_sql(
+        self, Target: Type[T], filter: dict[str, Any]
+    ) -> tuple[str, list]:
+        clauses = ['"user" = ?']
+        params = [self.user]
+        if not filter:
+            return ' AND '.join(clauses), params
+
+        schema = Target.schema()
+        for key, condition in filter.items():
+            conditions = condition
+            if not is_predicate(condition):
+                conditions = { 'eq': condition }
+
+            for operator, operand in conditions.items():
+                clause, clause_params = self._condition_sql(
+                    schema[key], _quote(key), operator, operand
+                )
+                clauses.append(clause)
+                params.extend(clause_params)
+
+        return ' AND '.join(clauses), params
+
+    def _update_aggregates(
+        self,
+        connection: sqlite3.Connection,
+        collection_name: str,
+        models: list[Model],
+        sign: int
+    ):
+        deltas = dict()
+        for aggregate in self.aggregates[collection_name]:
+            grouping = ','.join(aggregate.fields)
+            for model in models:
+                key = (
+                    aggregate.field, grouping,
+                    json.dumps(aggregate.encode_key(
+                        aggregate.model_key(model)
+                    ))
+                )
+                deltas[key] = (
+                    deltas.get(key, 0) +
+                    sign*getattr(model, aggregate.field)
+                )
+
+        connection.executemany(
+            'INSERT INTO %s VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT ("user", "collection", "field", "grouping", "key") '
+            'DO UPDATE SET "value" = "value" + excluded."value"'%(
+                AGGREGATES_TABLE
+            ),
+            list(
+                (self.user, collection_name, *key, delta)
+                for key, delta in deltas.items()
+            )
+        )
+
+    def _backfill_aggregates(self, connection: sqlite3.Connection):
+        for collection_name, aggregates in self.aggregates.items():
+            for aggregate in aggregates:
+                columns = list()
+                for key, bucketed in zip(
+                    aggregate.fields, aggregate.bucketed
+                ):
+                    column = _quote(key)
+                    if bucketed:
+                        column = "date(%s, 'unixepoch')"%column
+                    columns.append(column)
+
+                rows = connection.execute(
+                    'SELECT "user", %s, SUM(%s) FROM %s GROUP BY "user", %s'%(
+                        ', '.join(columns),
+                        _quote(aggregate.field),
+                        _quote(collection_name),
+                        ', '.join(columns)
+                    )
+                ).fetchall()
+                connection.executemany(
+                    'INSERT INTO %s VALUES (?, ?, ?, ?, ?, ?)'%(
+                        AGGREGATES_TABLE
+                    ),
+                    list(
+                        (
+                            row[0], collection_name, aggregate.field,
+                            ','.join(aggregate.fields),
+                            json.dumps(list(row[1:-1])), row[-1]
+                        )
+                        for row in rows
+                    )
+                )
+
+    def _create_tables(self, connection: sqlite3.Connection):
+        with connection:
+            for collection_name, Type in self.schema.items():
+                schema = Type.schema()
+
+                columns = ['"user" TEXT NOT NULL']
+                for key, field_type in schema.items():
+                    column_type = 'TEXT'
+                    if type(field_type) is not list:
+                        column_type = COLUMN_TYPES.get(field_type, 'TEXT')
+
+                    columns.append('%s %s'%(_quote(key), column_type))
+                connection.execute('CREATE TABLE IF NOT EXISTS %s (%s)'%(
+                    _quote(collection_name), ', '.join(columns)
+                ))
+
+                # Trailing timestamp columns let indexed lookups also
+                # answer time-window predicates.
+                timestamps = tuple(
+                    key for key, field_type in schema.items()
+                    if field_type is datetime
+                )
+                index_groups = [tuple()]
+                for fields in Type.indexes():
+                    index_groups.append(fields + tuple(
+                        key for key in timestamps if key not in fields
+                    ))
+                for fields in index_groups:
+                    index_name = '_'.join((collection_name, 'user', *fields))
+                    connection.execute(
+                        'CREATE INDEX IF NOT EXISTS %s ON %s (%s)'%(
+                            _quote(index_name),
+                            _quote(collection_name),
+                            ', '.join(_quote(key) for key in ('user', *fields))
+                        )
+                    )
+
+            exists = connection.execute(
+                'SELECT 1 FROM sqlite_master WHERE name = ?',
+                (AGGREGATES_TABLE,)
+            ).fetchone()
+            if exists:
+                return
+
+            connection.execute(
+                'CREATE TABLE %s ('
+                '"user" TEXT NOT NULL, "collection" TEXT NOT NULL, '
+                '"field" TEXT NOT NULL, "grouping" TEXT NOT NULL, '
+                '"key" TEXT NOT NULL, "value" INTEGER NOT NULL, '
+                'PRIMARY KEY '
+                '("user", "collection", "field", "grouping", "key")'
+                ')'%AGGREGATES_TABLE
+            )
+            self._backfill_aggregates(connection)
+
+    async def initialize(self):
+        path = self._get_database_path()
+        if path in self.initialized:
+            return
+
+        await self.pool.run(self._create_tables)
+        self.initialized.add(path)
+
+    async def connect(self, user: str):
+        await self.initialize()
+
+        self.user = user
+
+    async def disconnect(self):
+        pass
+
+    def _disk_usage(self) -> int:
+        usage = 0
+        for suffix in ('', '-wal'):
+            path = '%s%s'%(self._get_database_path(), suffix)
+            if os.path.isfile(path):
+                usage += os.path.getsize(path)
+
+        return usage
+
+    async def maintain(self) -> dict[str, Any]:
+        '''
+        Check the database, refresh query planner statistics and fold the
+        write-ahead log back into the database.
+        '''
+        started = time.monotonic()
+        usage = self._disk_usage()
+
+        def execute(connection: sqlite3.Connection) -> bool:
+            result = connection.execute('PRAGMA quick_check').fetchone()
+            connection.execute('PRAGMA optimize')
+            connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+            return result[0] == 'ok'
+        valid = await self.pool.run(execute)
+
+        return {
+            'verified': 1,
+            'corrupt': 0 if valid else 1,
+            'bytes_reclaimed': max(0, usage - self._disk_usage()),
+            'seconds': time.monotonic() - started
+        }
+
+    async def discover_users(self) -> list[str]:
+        await self.initialize()
+
+        sql = ' UNION '.join(
+            'SELECT DISTINCT "user" FROM %s'%_quote(collection_name)
+            for collection_name in self.schema
+        )
+        rows = await self.pool.run(
+            lambda connection: connection.execute(sql).fetchall()
+        )
+        return sorted(row[0] for row in rows)
+
+    async def commit(self):
+        pass
+
+    async def query(
+        self,
+        Target: Type[T],
+        filter: dict[str, Any] = None,
+        order_by: str = None,
+        limit: int = None
+    ) -> list[T]:
+        validate_filter(filter)
+
+        where, params = self._where_sql(Target, filter)
+        sql = 'SELECT %s FROM %s WHERE %s'%(
+            ', '.join(_quote(key) for key in Target.schema()),
+            _quote(Target.collection_name()),
+            where
+        )
+        if order_by:
+            # Ties stay in insertion order, so pages of cursors are stable.
+            sql = '%s ORDER BY %s %s, rowid'%(
+                sql,
+                _quote(order_by.lstrip('-')),
+                'DESC' if order_by.startswith('-') else 'ASC'
+            )
+        else:
+            sql = '%s ORDER BY rowid'%sql
+        if limit is not None:
+            sql = '%s LIMIT ?'%sql
+            params.append(limit)
+
+        rows = await self.pool.run(
+            lambda connection: connection.execute(sql, params).fetchall()
+        )
+        return list(self._hydrate_row(Target, row) for row in rows)
+
+    async def aggregate(
+        self, Target: Type[T], field: str, filter: dict[str, Any] = None
+    ) -> int:
+        validate_filter(filter)
+
+        filter = filter or dict()
+        collection_name = Target.collection_name()
+        for aggregate in self.aggregates[collection_name]:
+            if aggregate.field != field or not aggregate.covers(filter):
+                continue
+
+            condition = filter[aggregate.fields[-1]]
+            if is_predicate(condition):
+                return await self._aggregate_range(
+                    aggregate, collection_name, filter, condition
+                )
+
+            key = aggregate.key(
+                tuple(filter[key] for key in aggregate.fields)
+            )
+            params = (
+                self.user, collection_name, field,
+                ','.join(aggregate.fields),
+                json.dumps(aggregate.encode_key(key))
+            )
+            row = await self.pool.run(
+                lambda connection: connection.execute(
+                    'SELECT "value" FROM %s WHERE "user" = ? AND '
+                    '"collection" = ? AND "field" = ? AND "grouping" = ? '
+                    'AND "key" = ?'%AGGREGATES_TABLE,
+                    params
+                ).fetchone()
+            )
+            return row[0] if row else 0
+
+        where, params = self._where_sql(Target, filter)
+        row = await self.pool.run(
+            lambda connection: connection.execute(
+                'SELECT COALESCE(SUM(%s), 0) FROM %s WHERE %s'%(
+                    _quote(field), _quote(collection_name), where
+                ),
+                params
+            ).fetchone()
+        )
+        return row[0]
+
+    async def _aggregate_range(
+        self,
+        aggregate: SumAggregate,
+        collection_name: str,
+        filter: dict[str, Any],
+        condition: dict[str, Any]
+    ) -> int:
+        '''
+        Sum the stored days of a group in a range of days. Keys of a group
+        differ only in their trailing ISO day, so the range is one scan of
+        the primary key.
+        '''
+        start, end = day_window(condition)
+        if start is not None and end is not None and start >= end:
+            return 0
+
+        group = aggregate.encode_key(aggregate.key(
+            tuple(filter[key] for key in aggregate.fields[:-1])
+        ))
+        params = [
+            self.user, collection_name, aggregate.field,
+            ','.join(aggregate.fields),
+            json.dumps(group + [(start or date.min).isoformat()])
+        ]
+        upper = '"key" <= ?'
+        params.append(json.dumps(group + [date.max.isoformat()]))
+        if end is not None:
+            upper = '"key" < ?'
+            params[-1] = json.dumps(group + [end.isoformat()])
+
+        row = await self.pool.run(
+            lambda connection: connection.execute(
+                'SELECT COALESCE(SUM("value"), 0) FROM %s WHERE "user" = ? '
+                'AND "collection" = ? AND "field" = ? AND "grouping" = ? '
+                'AND "key" >= ? AND %s'%(AGGREGATES_TABLE, upper),
+                params
+            ).fetchone()
+        )
+        return row[0]
+
+    def _row_params(self, model: Model) -> list:
+        params = [self.user]
+        for key, field_type in model.__class__.schema().items():
+            params.append(
+                self._to_column(field_type, getattr(model, key))
+            )
+
+        return params
+
+    async def create(self, model: Model):
+        await self.create_many((model,))
+
+    async def create_many(self, models: Iterable[Model]):
+        '''Insert models in a single transaction per collection.'''
+        by_type = dict()
+        for model in models:
+            by_type.setdefault(model.__class__, list()).append(model)
+
+        def execute(connection: sqlite3.Connection):
+            with connection:
+                for Type, type_models in by_type.items():
+                    schema = Type.schema()
+                    sql = 'INSERT INTO %s (%s) VALUES (%s)'%(
+                        _quote(Type.collection_name()),
+                        ', '.join(_quote(key) for key in ('user', *schema)),
+                        ', '.join('?' for _ in range(len(schema) + 1))
+                    )
+
+                    connection.executemany(
+                        sql, list(map(self._row_params, type_models))
+                    )
+                    self._update_aggregates(
+                        connection, Type.collection_name(), type_models, 1
+                    )
+        await self.pool.run(execute)
+
+    async def delete(
+        self, Target: Type[T], filter: dict[str, Any] = None
+    ):
+        validate_filter(filter)
+
+        where, params = self._where_sql(Target, filter)
+        sql = 'DELETE FROM %s WHERE %s'%(
+            _quote(Target.collection_name()), where
+        )
+
+        collection_name = Target.collection_name()
+        select_sql = 'SELECT %s FROM %s WHERE %s'%(
+            ', '.join(_quote(key) for key in Target.schema()),
+            _quote(collection_name),
+            where
+        )
+
+        def execute(connection: sqlite3.Connection):
+            with connection:
+                if self.aggregates[collection_name]:
+                    deleted = list(
+                        self._hydrate_row(Target, row)
+                        for row in connection.execute(select_sql, params)
+                    )
+                    self._update_aggregates(
+                        connection, collection_name, deleted, -1
+                    )
+
+                connection.execute(sql, params)
+        await self.pool.run(execute)
+
+    async def update(
+        self,
+        Target: Type[T],
+        filter: dict[str, Any],
+        changes: dict[str, Any]
+    ):
+        validate_filter(filter)
+
+        collection_name = Target.collection_name()
+        schema = Target.schema()
+        where, params = self._where_sql(Target, filter)
+        sql = 'UPDATE %s SET %s WHERE %s'%(
+            _quote(collection_name),
+            ', '.join('%s = ?'%_quote(key) for key in changes),
+            where
+        )
+        params = list(
+            self._to_column(schema[key], value)
+            for key, value in changes.items()
+        ) + params
+
+        select_sql = 'SELECT %s FROM %s WHERE %s'%(
+            ', '.join(_quote(key) for key in schema),
+            _quote(collection_name),
+            where
+        )
+        select_params = params[len(changes):]
+
+        def execute(connection: sqlite3.Connection):
+            with connection:
+                if self.aggregates[collection_name]:
+                    updated = list(
+                        self._hydrate_row(Target, row)
+                        for row in connection.execute(
+                            select_sql, select_params
+                        )
+                    )
+                    self._update_aggregates(
+                        connection, collection_name, updated, -1
+                    )
+                    self._update_aggregates(
+                        connection, collection_name,
+                        list(replace(model, **changes) for model in updated),
+                        1
+                    )
+
+                connection.execute(sql, params)
+        await self.pool.run(execute)
@@ -1,15 +1,16 @@
 '''
 Abstract base and implementation registry of storage backends.
 
-Storage backends connect in the context of a user.
+Storage backends connect in the context of a user, and evaluate the
+filter language defined in `query`.
 '''
-from typing import TypeVar, Type, Any
+from typing import TypeVar, Iterable, Type, Any
 
 from ..cli import CLIArgs
 from ..model import Model
 from ..common import Implementations
+from .columnar import ColumnarCollection
 
-# TODO: Update support.
 T = TypeVar('T')
 class StorageBackend:
     schema: dict[str, Type[Model]]
@@ -31,19 +32,98 @@ class StorageBackend:
     async def commit(self):
         raise NotImplementedError()
 
+    async def flush(self):
+        '''
+        Persist everything committed so far, as when the DAL disconnects.
+        Backends that defer some commits persist them here.
+        '''
+        await self.commit()
+
+    def revision(self) -> Any:
+        '''
+        A value that changes whenever the data of the connected user is
+        replaced by writes made elsewhere, so reads made before it
+        changed may be stale. Backends that see no such writes return
+        `None`.
+        '''
+        return None
+
+    async def maintain(self) -> dict[str, Any]:
+        '''
+        Check and compact stored data without connecting as a user,
+        returning metrics of the work done. Runs alongside live sessions,
+        so must not block the event loop.
+        '''
+        raise NotImplementedError()
+
+    async def discover_users(self) -> list[str]:
+        '''The users with data stored, without connecting as any of them.'''
+        raise NotImplementedError()
+
     async def query(
         self,
         Target: Type[T],
-        filter: dict[str, Any] = None
+        filter: dict[str, Any] = None,
+        order_by: str = None,
+        limit: int = None
     ) -> list[T]:
+        '''
+        Return the models in the collection of `Target` matching `filter`,
+        expressed in the language described in `query`. Results are
+        sorted on the `order_by` field, descending when it is prefixed
+        with `-`, and truncated to `limit` models.
+        '''
+        raise NotImplementedError()
+
+    async def aggregate(
+        self, Target: Type[T], field: str, filter: dict[str, Any] = None
+    ) -> int:
+        '''
+        Return the sum of `field` over the models matching `filter`.
+        Backends keep the groupings declared in `Model.aggregates`
+        materialised, so a filter naming exactly one of them is answered
+        without a scan.
+        '''
         raise NotImplementedError()
 
+    async def columns(
+        self, Target: Type[T], filter: dict[str, Any] = None
+    ) -> ColumnarCollection:
+        '''
+        Return the models matching `filter` encoded in columns, for scans
+        over many of them. Unless a backend holds columns itself, they are
+        queried and encoded.
+        '''
+        return ColumnarCollection.encoded(
+            Target, await self.query(Target, filter)
+        )
+
     async def create(self, model: Model):
         raise NotImplementedError()
+
+    async def create_many(self, models: Iterable[Model]):
+        '''Create models in bulk, more cheaply than one at a time.'''
+        raise NotImplementedError()
+
+    async def update(
+        self,
+        Target: Type[T],
+        filter: dict[str, Any],
+        changes: dict[str, Any]
+    ):
+        '''
+        Set the fields in `changes` on every model in the collection of
+        `Target` matching `filter`.
+        '''
+        raise NotImplementedError()
     
     async def delete(
         self, Target: Type[T], filter: dict[str, Any] = None
     ):
+        '''
+        Delete the models matching `filter`, or every model in the
+        collection of `Target` when there is none.
+        '''
         raise NotImplementedError()
 
 storage_backends = Implementations[Type[StorageBackend]]()
@@ -0,0 +1,118 @@
+'''
+A process-wide cache of the state storage backends load for each user,
+shared by every session of the same user.
+
+Entries are reference-counted while sessions hold them. Idle entries stay
+loaded so a returning user connects without reading storage again, and
+the least recently used of them are evicted whenever the estimated size of
+all entries exceeds the memory budget. Backends whose storage other
+processes can write must check entries against it before serving them.
+'''
+import asyncio
+from collections import OrderedDict
+from typing import Callable, Awaitable
+
+# Default memory budget, in megabytes.
+DEFAULT_BUDGET_MB = 256
+
+class UserState:
+    '''The loaded state of one user, as held by the cache.'''
+
+    def estimate_size(self) -> int:
+        '''An estimate of the memory held, in bytes.'''
+        raise NotImplementedError()
+
+    def evictable(self) -> bool:
+        '''Whether the state can be dropped without losing writes.'''
+        return True
+
+class UserCacheEntry:
+    state: UserState
+    references: int
+    size: int
+
+    def __init__(self, state: UserState):
+        self.state = state
+        self.references = 0
+        self.size = state.estimate_size()
+
+class UserCache:
+    budget: int
+    entries: OrderedDict[str, UserCacheEntry]
+    loading: dict[str, asyncio.Future]
+
+    def __init__(self, budget_mb: int = DEFAULT_BUDGET_MB):
+        self.budget = budget_mb*2**20
+        self.entries = OrderedDict()
+        self.loading = dict()
+
+    def configure(self, budget_mb: int):
+        self.budget = budget_mb*2**20
+        self._evict()
+
+    def size(self) -> int:
+        return sum(entry.size for entry in self.entries.values())
+
+    async def _load(
+        self, key: str, load: Callable[[], Awaitable[UserState]]
+    ):
+        try:
+            self.entries[key] = UserCacheEntry(await load())
+        finally:
+            del self.loading[key]
+
+    async def acquire(
+        self, key: str, load: Callable[[], Awaitable[UserState]]
+    ) -> UserState:
+        '''
+        Return the state cached under `key`, loading it with `load` if it
+        isn't cached. Concurrent sessions of a user share a single load.
+        Every acquisition must be paired with a `release`.
+        '''
+        # An entry loaded for us could be evicted before we resume.
+        while key not in self.entries:
+            task = self.loading.get(key)
+            if task is None:
+                task = self.loading[key] = asyncio.ensure_future(
+                    self._load(key, load)
+                )
+            await task
+
+        entry = self.entries[key]
+        entry.references += 1
+        self.entries.move_to_end(key)
+
+        return entry.state
+
+    def release(self, key: str):
+        entry = self.entries[key]
+        entry.references -= 1
+        entry.size = entry.state.estimate_size()
+
+        self._evict()
+
+    def discard(self, key: str):
+        '''
+        Drop an entry if it is idle and evictable, so it is loaded afresh.
+        '''
+        entry = self.entries.get(key)
+        if entry and not entry.references and entry.state.evictable():
+            del self.entries[key]
+
+    def clear(self):
+        '''Drop every idle, evictable entry.'''
+        for key in list(self.entries):
+            self.discard(key)
+
+    def _evict(self):
+        size = self.size()
+        for key, entry in list(self.entries.items()):
+            if size <= self.budget:
+                break
+            if entry.references or not entry.state.evictable():
+                continue
+
+            del self.entries[key]
+            size -= entry.size
+
+user_cache = UserCache()
@@ -1,6 +1,7 @@
 '''
 The user I/O provider for application logic.
 '''
+from datetime import datetime, date
 from typing import Callable, ContextManager
 
 from latian.model import Event, Exercise
@@ -124,6 +125,21 @@ class IO(IOWriter):
             validator_fn=validator
         )
 
+    async def read_date(
+        self, message: str = None, min: date = None
+    ) -> date:
+        '''Read a day written as dd/mm/yyyy, no earlier than `min`.'''
+        def validator(value):
+            value = datetime.strptime(value, '%d/%m/%Y').date()
+            if min and value < min:
+                raise ValueError()
+            return value
+
+        return await self._source.read_input(
+            message=message,
+            validator_fn=validator
+        )
+
     async def read_choice(
         self, options: list[str], message: str = None, *,
         control_options: list[str] = None,
@@ -12,7 +12,7 @@ CONFIG_TITLES = {
     'timer_delay_seconds': 'lead-in seconds on timer'
 }
 
-@dataclass
+@dataclass(slots=True)
 class Config(Model):
     exit_message: str = None
     milestone_reps: int = 0
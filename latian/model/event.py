@@ -8,7 +8,7 @@ from .model import Model
 from .config import Config
 from .exercise import Exercise
 
-@dataclass
+@dataclass(slots=True)
 class Event(Model):
     type: str = None
     exercise: str = None
@@ -19,6 +19,20 @@ class Event(Model):
     def collection_name(cls) -> str:
         return 'events'
 
+    @classmethod
+    def partition_by(cls) -> str:
+        return 'when'
+
+    @classmethod
+    def indexes(cls) -> tuple[tuple[str, ...], ...]:
+        return (('type', 'exercise'), ('when',))
+
+    @classmethod
+    def aggregates(cls) -> dict[str, tuple[tuple[str, ...], ...]]:
+        return {
+            'value': (('type', 'exercise'), ('type', 'exercise', 'when'))
+        }
+
     @property
     def is_rep(self):
         return self.type == 'rep'
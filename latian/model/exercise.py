@@ -7,7 +7,7 @@ from .model import Model
 
 EXERCISE_TYPES = ('rep', 'timed')
 
-@dataclass
+@dataclass(slots=True)
 class Exercise(Model):
     type: str = None
     name: str = None
@@ -16,6 +16,10 @@ class Exercise(Model):
     def collection_name(cls) -> str:
         return 'exercises'
 
+    @classmethod
+    def unique(cls) -> tuple[tuple[str, ...], ...]:
+        return (('type', 'name'),)
+
     @property
     def is_rep(self):
         return self.type == 'rep'
@@ -1,17 +1,60 @@
 '''
 Abstract base for data models.
+
+Models are slotted dataclasses; their schemas are computed once per class.
 '''
+from typing import Type, Any
 from dataclasses import fields
 from types import GenericAlias
 
+_schemas: dict[Type['Model'], dict[str, Any]] = dict()
+
 class Model:
+    __slots__ = ()
 
     @classmethod
     def collection_name(cls) -> str:
         raise NotImplementedError()
 
     @classmethod
-    def schema(cls):
+    def indexes(cls) -> tuple[tuple[str, ...], ...]:
+        '''Groups of fields storage backends should index lookups on.'''
+        return tuple()
+
+    @classmethod
+    def aggregates(cls) -> dict[str, tuple[tuple[str, ...], ...]]:
+        '''
+        Groups of fields storage backends should keep running sums of a
+        field by, keyed by the summed field.
+        '''
+        return dict()
+
+    @classmethod
+    def partition_by(cls) -> str:
+        '''
+        A `datetime` field storage backends may partition the collection
+        by, or `None`.
+        '''
+        return None
+
+    @classmethod
+    def unique(cls) -> tuple[tuple[str, ...], ...]:
+        '''
+        Groups of fields no two models may share values of. Storage
+        backends merging concurrent writes drop creates that collide.
+        '''
+        return tuple()
+
+    @classmethod
+    def schema(cls) -> dict[str, Any]:
+        schema = _schemas.get(cls)
+        if schema is None:
+            schema = _schemas[cls] = cls._compute_schema()
+
+        return schema
+
+    @classmethod
+    def _compute_schema(cls) -> dict[str, Any]:
         attributes = fields(cls)
         schema = dict()
         for attribute in attributes:
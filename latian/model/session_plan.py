@@ -6,7 +6,7 @@ from dataclasses import dataclass
 from .model import Model
 from .exercise import Exercise
 
-@dataclass
+@dataclass(slots=True)
 class SessionPlan(Model):
     name: str = None
     exercises: list[Exercise] = None
@@ -14,3 +14,7 @@ class SessionPlan(Model):
     @classmethod
     def collection_name(cls) -> str:
         return 'session_plans'
+
+    @classmethod
+    def unique(cls) -> tuple[tuple[str, ...], ...]:
+        return (('name',),)
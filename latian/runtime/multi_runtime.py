@@ -4,18 +4,32 @@ A runtime that can serve multiple different users concurrently.
 import asyncio
 
 from ..io import IO
-from ..actions import ActionFn
+from ..actions import ActionFn, worker_pool
 from ..common import Implementations, Exit
 from .runtime import Runtime, runtimes
 @runtimes.implementation('multi')
 class MultiUserRuntime(Runtime):
 
     async def run(self, actions: Implementations[ActionFn]):
-        while True:
-            io = self.io_factory()
-            await io.bind()
+        maintenance = asyncio.create_task(self.run_maintenance())
+        # Heavy report work runs beside the loop sessions share.
+        worker_pool.start(self.args.get('report_workers'))
 
-            asyncio.create_task(self.run_one(io, actions))
+        try:
+            while True:
+                io = self.io_factory()
+                await io.bind()
+
+                asyncio.create_task(self.run_one(io, actions))
+        finally:
+            # Maintenance must not run against backends being torn down.
+            maintenance.cancel()
+            try:
+                await maintenance
+            except asyncio.CancelledError:
+                pass
+
+            worker_pool.shutdown()
 
     async def run_one(
         self, io: IO, actions: Implementations[ActionFn]
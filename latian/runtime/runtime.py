@@ -1,6 +1,7 @@
 '''
 Abstract base and implementation registry for runtimes.
 '''
+import asyncio
 from typing import Type, Callable
 
 from ..io import IO
@@ -14,6 +15,7 @@ class Runtime:
     io_factory: Callable[[], IO]
     dal_factory: Callable[[], DAL]
     args: CLIArgs
+    maintenance_metrics: dict
 
     def __init__(
         self,
@@ -24,10 +26,26 @@ class Runtime:
         self.dal_factory = dal_factory
         self.io_factory = io_factory
         self.args = args
+        self.maintenance_metrics = None
     
     async def run(self, actions: Implementations[ActionFn]):
         raise NotImplementedError()
 
+    async def run_maintenance(self):
+        '''
+        Run storage maintenance every `maintenance_interval` seconds, in
+        the background of the sessions being served.
+        '''
+        interval = self.args.get('maintenance_interval')
+        while interval:
+            await asyncio.sleep(interval)
+
+            try:
+                self.maintenance_metrics = await self.dal_factory().maintain()
+            except Exception as ex:
+                # Maintenance failing must not take the runtime down.
+                self.maintenance_metrics = { 'error': str(ex) }
+
     async def run_user_standard(
         self, dal: DAL, io: IO, actions: Implementations[ActionFn]
     ):
@@ -0,0 +1,20 @@
+import pytest
+
+from latian.cli import CLIArgs
+from latian.application import ARGUMENTS
+from latian.dal import DAL, storage_backends, user_cache
+from latian.model import get_schema
+
+@pytest.fixture
+def make_dal(tmp_path):
+    '''Create DALs over a fresh storage location, given extra arguments.'''
+    def make_dal(*arguments: str) -> DAL:
+        args = CLIArgs(['-d', str(tmp_path), *arguments], ARGUMENTS)
+
+        return DAL(storage_backends.get(args.get('storage'))(
+            get_schema(), args
+        ))
+
+    yield make_dal
+
+    user_cache.clear()
@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime, date, timedelta
+
+import pytest
+
+from latian.dal import iterate
+from latian.model import Event
+
+STORAGE_MODES = (
+    ('file', ()),
+    ('columnar', ('--columnar',)),
+    ('binary partition', (
+        '--snapshot-format', 'binary', '--partition', '--columnar'
+    )),
+    ('sqlite', ('-s', 'sqlite')),
+    ('memory', ('-s', 'memory'))
+)
+storage_modes = pytest.mark.parametrize(
+    'arguments', [arguments for _, arguments in STORAGE_MODES],
+    ids=[name for name, _ in STORAGE_MODES]
+)
+
+def _events() -> list[Event]:
+    '''Events over several months, with ties in time and undated ones.'''
+    events = list()
+    start = datetime(2024, 1, 30, 6)
+    for k in range(40):
+        when = start + timedelta(hours=7*(k//2))
+        events.append(Event('rep', 'push up', k, when))
+    events.append(Event('rep', 'push up', 100, None))
+    events.append(Event('rep', 'push up', 101, None))
+
+    return events
+
+async def _iterate(dal, **kwargs) -> list[Event]:
+    await dal.connect('u')
+    try:
+        await dal.create_events(_events())
+        await dal.commit()
+
+        events = list()
+        async for event in dal.iter_events(**kwargs):
+            events.append(event)
+
+        return events
+    finally:
+        await dal.disconnect()
+
+def _check_order(events: list[Event], expected: list[Event], descending):
+    # Ties may come in any order, so only the times are compared in order.
+    assert sorted(event.value for event in events) == \
+        sorted(event.value for event in expected)
+    assert list(event.when for event in events) == sorted(
+        (event.when for event in expected), reverse=descending
+    )
+
+@pytest.mark.parametrize('order', ('asc', 'desc'))
+@storage_modes
+def test_iterate_window(make_dal, arguments, order):
+    events = asyncio.run(_iterate(
+        make_dal(*arguments), start=date(2024, 2, 1), end=date(2024, 2, 5),
+        order=order, page_size=3
+    ))
+
+    expected = list(
+        event for event in _events() if event.when and
+        date(2024, 2, 1) <= event.when.date() < date(2024, 2, 5)
+    )
+    _check_order(events, expected, order == 'desc')
+
+@pytest.mark.parametrize('order', ('asc', 'desc'))
+@storage_modes
+def test_iterate_all(make_dal, arguments, order):
+    events = asyncio.run(_iterate(
+        make_dal(*arguments), order=order, page_size=3
+    ))
+
+    # Undated events come first, or last when newest first.
+    undated = list(event for event in events if event.when is None)
+    assert len(undated) == 2
+    if order == 'asc':
+        assert events[:2] == undated
+    else:
+        assert events[-2:] == undated
+    _check_order(
+        list(event for event in events if event.when),
+        list(event for event in _events() if event.when), order == 'desc'
+    )
+
+@storage_modes
+def test_iterate_by_other_field(make_dal, arguments):
+    async def read() -> list[int]:
+        dal = make_dal(*arguments)
+        await dal.connect('u')
+        try:
+            await dal.create_events(_events())
+            values = list()
+            async for event in iterate(
+                dal._backend, Event, '-value', { 'value': { 'lt': 30 } }, 4
+            ):
+                values.append(event.value)
+
+            return values
+        finally:
+            await dal.disconnect()
+
+    assert asyncio.run(read()) == list(range(29, -1, -1))
@@ -0,0 +1,92 @@
+import os
+import sys
+import asyncio
+import subprocess
+from datetime import datetime
+
+import pytest
+
+from latian.dal import user_cache
+from latian.model import Event, Exercise
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Writes the same user's files from another process.
+WRITER = '''
+import sys
+import asyncio
+from datetime import datetime
+
+from latian.cli import CLIArgs
+from latian.application import ARGUMENTS
+from latian.dal import DAL, storage_backends
+from latian.model import get_schema, Event, Exercise
+
+async def write():
+    args = CLIArgs(sys.argv[1:], ARGUMENTS)
+    dal = DAL(storage_backends.get('file')(get_schema(), args))
+    await dal.connect('u')
+    await dal.create_exercise(Exercise('rep', 'push up'))
+    await dal.create_exercise(Exercise('rep', 'squat'))
+    await dal.create_event(Event('rep', 'squat', 2, datetime(2024, 1, 2)))
+    await dal.commit()
+    await dal.disconnect()
+
+asyncio.run(write())
+'''
+
+def _write_elsewhere(arguments: list[str]):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        path for path in (ROOT, env.get('PYTHONPATH')) if path
+    )
+    subprocess.run(
+        [sys.executable, '-c', WRITER, *arguments], env=env, check=True
+    )
+
+async def _read(dal) -> tuple[list[str], list[int]]:
+    return (
+        sorted(exercise.name for exercise in await dal.get_exercises('rep')),
+        sorted(event.value for event in await dal.get_events())
+    )
+
+@pytest.mark.parametrize('journal', (False, True), ids=('plain', 'journal'))
+def test_rebase_onto_other_process(make_dal, tmp_path, journal):
+    extra = ['-j'] if journal else list()
+    merged = (['push up', 'sit up', 'squat'], [1, 2, 3])
+
+    async def write():
+        dal = make_dal(*extra)
+        await dal.connect('u')
+        try:
+            await dal.create_event(
+                Event('rep', 'sit up', 1, datetime(2024, 1, 1))
+            )
+            await dal.commit()
+            # Cached before the other process writes.
+            assert await _read(dal) == (list(), [1])
+
+            await dal.create_exercise(Exercise('rep', 'push up'))
+            await dal.create_exercise(Exercise('rep', 'sit up'))
+            _write_elsewhere(['-d', str(tmp_path), *extra])
+            await dal.create_event(
+                Event('rep', 'sit up', 3, datetime(2024, 1, 3))
+            )
+            await dal.commit()
+
+            # The colliding create of "push up" is dropped, and the reads
+            # cached before the rebase aren't served after it.
+            assert await _read(dal) == merged
+        finally:
+            await dal.disconnect()
+
+    async def read():
+        dal = make_dal(*extra)
+        await dal.connect('u')
+        try:
+            return await _read(dal)
+        finally:
+            await dal.disconnect()
+
+    asyncio.run(write())
+    user_cache.clear()
+    assert asyncio.run(read()) == merged
@@ -0,0 +1,59 @@
+from datetime import datetime, date, timedelta
+
+import pytest
+
+from latian.dal.columnar import ColumnarCollection
+from latian.model import Event
+from latian.actions.report import EventGroups, _group_rows
+
+def _events() -> list[Event]:
+    '''Events on days either side of the epoch, undated and valueless.'''
+    events = list()
+    for k in range(500):
+        when = datetime(1969, 12, 20, 23, 30) + timedelta(hours=5*k)
+        events.append(Event(
+            ('rep', 'time')[k%2], ('push up', 'sit up', 'plank')[k%3],
+            k%11, when
+        ))
+    events.append(Event('rep', 'push up', 4, None))
+    events.append(Event('rep', 'push up', 6, None))
+    events.append(Event('rep', 'sit up', None, datetime(2024, 1, 1)))
+
+    return events
+
+def _expected(events: list[Event]) -> tuple[dict, dict]:
+    totals = dict()
+    counts = dict()
+    for event in events:
+        day = event.when.date() if event.when else None
+        key = (event.type, event.exercise, day)
+        totals[key] = totals.get(key, 0) + (event.value or 0)
+        counts[day] = counts.get(day, 0) + 1
+
+    return totals, counts
+
+def test_group_rows():
+    events = ColumnarCollection.encoded(Event, _events())
+    groups = EventGroups(
+        events, _group_rows(*EventGroups._columns(events))
+    )
+
+    totals, counts = _expected(_events())
+    assert groups.totals == totals
+    assert groups.counts == counts
+    assert groups.total('rep', 'push up', date(1969, 12, 21)) == \
+        totals.get(('rep', 'push up', date(1969, 12, 21)), 0)
+    assert groups.count() == len(_events())
+
+def test_group_arrays_match_rows():
+    pytest.importorskip('numpy')
+
+    events = ColumnarCollection.encoded(Event, _events())
+    vectorised = EventGroups(events)
+    fallback = EventGroups(
+        events, _group_rows(*EventGroups._columns(events))
+    )
+
+    assert vectorised.totals == fallback.totals
+    assert vectorised.exercise_totals == fallback.exercise_totals
+    assert vectorised.counts == fallback.counts
@@ -0,0 +1,231 @@
+import io
+import os
+import json
+import asyncio
+from datetime import datetime, date
+
+import pytest
+
+from latian.dal import user_cache
+from latian.dal.codec import Codec
+from latian.dal.file_system_backend import FORMAT_VERSION
+from latian.model import (
+    Event, Exercise, SessionPlan, create_default_config
+)
+
+STORAGE_MODES = (
+    ('plain', ()),
+    ('journal', ('-j',)),
+    ('columnar', ('--columnar',)),
+    ('binary', ('--snapshot-format', 'binary')),
+    ('partition', ('--partition',)),
+    ('binary partition', (
+        '--snapshot-format', 'binary', '--partition', '--columnar'
+    )),
+    ('sqlite', ('-s', 'sqlite')),
+    ('memory', ('-s', 'memory', '--memory-snapshot'))
+)
+
+PUSH_UP = Exercise('rep', 'push up')
+SIT_UP = Exercise('rep', 'sit up')
+
+def _events() -> list[Event]:
+    events = list()
+    for month in (1, 2, 3):
+        for day in (1, 15):
+            events.append(Event(
+                'rep', 'push up', month*10 + day, datetime(2024, month, day, 9)
+            ))
+            events.append(Event(
+                'rep', 'sit up', month, datetime(2024, month, day, 18)
+            ))
+    events.append(Event('rep', 'push up', 7, None))
+
+    return events
+
+def _sort_key(event: Event) -> tuple:
+    return (event.when or datetime.min, event.exercise, event.value)
+
+async def _write(dal):
+    await dal.connect('u')
+    await dal.set_config(create_default_config())
+    await dal.create_exercise(PUSH_UP)
+    await dal.create_exercise(SIT_UP)
+    await dal.create_session_plan(SessionPlan('daily', [PUSH_UP, SIT_UP]))
+    await dal.create_events(_events())
+    await dal.commit()
+
+    # A second commit, so journals and rotated snapshots are exercised.
+    await dal.delete_events(day=date(2024, 2, 1))
+    await dal.create_event(Event('rep', 'sit up', 5, datetime(2024, 3, 20)))
+    await dal.commit()
+    await dal.disconnect()
+
+async def _read(dal) -> dict:
+    await dal.connect('u')
+    try:
+        return {
+            'events': sorted(await dal.get_events(), key=_sort_key),
+            'march': len(await dal.get_events(
+                start=date(2024, 3, 1), end=date(2024, 4, 1)
+            )),
+            'push up': await dal.get_exercise_total(PUSH_UP),
+            'sit up': await dal.get_exercise_total(
+                SIT_UP, day=date(2024, 3, 20)
+            ),
+            'exercises': sorted(
+                exercise.name for exercise in await dal.get_exercises('rep')
+            ),
+            'plans': await dal.get_session_plans(),
+            'config': await dal.get_config()
+        }
+    finally:
+        await dal.disconnect()
+
+@pytest.mark.parametrize(
+    'arguments', [arguments for _, arguments in STORAGE_MODES],
+    ids=[name for name, _ in STORAGE_MODES]
+)
+def test_reconnect_round_trip(make_dal, arguments):
+    asyncio.run(_write(make_dal(*arguments)))
+    user_cache.clear()
+
+    read = asyncio.run(_read(make_dal(*arguments)))
+
+    expected = list(
+        event for event in _events() if event.when is None or
+        event.when.date() != date(2024, 2, 1)
+    )
+    expected.append(Event('rep', 'sit up', 5, datetime(2024, 3, 20)))
+    assert read['events'] == sorted(expected, key=_sort_key)
+    assert read['march'] == 5
+    assert read['push up'] == sum(
+        event.value for event in expected if event.exercise == 'push up'
+    )
+    assert read['sit up'] == 5
+    assert read['exercises'] == ['push up', 'sit up']
+    assert read['plans'] == [SessionPlan('daily', [PUSH_UP, SIT_UP])]
+    assert read['config'] == create_default_config()
+
+def _snapshot_version(path) -> int:
+    with io.open(path, 'rb') as file_io:
+        return json.loads(file_io.readline()).get('version', 1)
+
+def _upgrade(make_dal, tmp_path, raw_data: dict):
+    with io.open(tmp_path/'u.db.json', 'w') as file_io:
+        json.dump(raw_data, file_io)
+
+    async def upgrade():
+        dal = make_dal()
+        await dal.connect('u')
+        try:
+            events = await dal.get_events()
+            total = await dal.get_exercise_total(PUSH_UP)
+            await dal.commit()
+        finally:
+            await dal.disconnect()
+
+        return events, total
+
+    events, total = asyncio.run(upgrade())
+    assert sorted(event.value for event in events) == [3, 4]
+    assert total == 7
+    assert _snapshot_version(tmp_path/'u.db.json') == FORMAT_VERSION
+
+    # The rewritten snapshot reads back the same.
+    user_cache.clear()
+    assert asyncio.run(upgrade()) == (events, total)
+
+def test_upgrade_version_1_snapshot(make_dal, tmp_path):
+    _upgrade(make_dal, tmp_path, {
+        'events': [
+            {
+                'type': 'rep', 'exercise': 'push up', 'value': 3,
+                'when': '02/01/2024 10:00'
+            },
+            {
+                'type': 'rep', 'exercise': 'push up', 'value': 4,
+                'when': '03/01/2024 10:30'
+            }
+        ],
+        'exercises': [{ 'type': 'rep', 'name': 'push up' }]
+    })
+
+def test_upgrade_version_2_snapshot(make_dal, tmp_path):
+    _upgrade(make_dal, tmp_path, {
+        'version': 2,
+        'journal_seq': 0,
+        'collections': {
+            'events': Codec.get(Event).encode_collection((
+                Event('rep', 'push up', 3, datetime(2024, 1, 2, 10)),
+                Event('rep', 'push up', 4, datetime(2024, 1, 3, 10, 30))
+            )),
+            'exercises': Codec.get(Exercise).encode_collection((PUSH_UP,))
+        }
+    })
+
+PARTITION = {
+    False: (),
+    True: ('--partition',)
+}
+
+def _corrupt(path):
+    with io.open(path, 'r+b') as file_io:
+        file_io.seek(-8, io.SEEK_END)
+        data = file_io.read(1)
+        file_io.seek(-8, io.SEEK_END)
+        file_io.write(bytes((data[0] ^ 0xff,)))
+
+async def _write_twice(dal):
+    await dal.connect('u')
+    await dal.create_event(Event('rep', 'push up', 1, datetime(2024, 1, 1)))
+    await dal.commit()
+    await dal.create_event(Event('rep', 'push up', 2, datetime(2024, 1, 2)))
+    await dal.commit()
+    await dal.disconnect()
+
+async def _read_values(dal) -> list[int]:
+    await dal.connect('u')
+    try:
+        return sorted(event.value for event in await dal.get_events())
+    finally:
+        await dal.disconnect()
+
+@pytest.mark.parametrize('format', ('json', 'binary'))
+@pytest.mark.parametrize('partition', (False, True))
+def test_corrupt_snapshot_recovery(make_dal, tmp_path, format, partition):
+    arguments = ('--snapshot-format', format) + PARTITION[partition]
+    asyncio.run(_write_twice(make_dal(*arguments)))
+    user_cache.clear()
+    head = tmp_path/('u.db.%s'%('bin' if format == 'binary' else 'json'))
+    _corrupt(head)
+
+    # Connecting reads the previous snapshot instead, and maintenance
+    # restores it, even while the user is cached.
+    assert asyncio.run(_read_values(make_dal(*arguments))) == [1]
+    metrics = asyncio.run(make_dal(*arguments).maintain())
+    assert (metrics['corrupt'], metrics['recovered']) == (1, 1)
+    user_cache.clear()
+    assert asyncio.run(_read_values(make_dal(*arguments))) == [1]
+    assert asyncio.run(make_dal(*arguments).maintain())['corrupt'] == 0
+
+@pytest.mark.parametrize('format', ('json', 'binary'))
+@pytest.mark.parametrize('partition', (False, True))
+def test_corrupt_snapshot_without_rotation(
+    make_dal, tmp_path, format, partition
+):
+    arguments = (
+        '--snapshot-format', format, '--snapshot-keep', '0'
+    ) + PARTITION[partition]
+    asyncio.run(_write_twice(make_dal(*arguments)))
+    user_cache.clear()
+    head = tmp_path/('u.db.%s'%('bin' if format == 'binary' else 'json'))
+    _corrupt(head)
+    files = sorted(os.listdir(tmp_path))
+
+    # Nothing is removed by maintenance, and connecting fails rather than
+    # starting from no data.
+    asyncio.run(make_dal(*arguments).maintain())
+    assert sorted(os.listdir(tmp_path)) == files
+    with pytest.raises(ValueError):
+        asyncio.run(_read_values(make_dal(*arguments)))